@@ -9,10 +9,331 @@ import indigo
 import time
 import subprocess
 import json
-import re
+import threading
+import itertools
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from mediacontrol import (kScriptTimeout, withStatusQuery, ScriptTimeout, ScriptLost, ScriptRunnerPool,
+                          AppleScriptParser, LRUCache, CircuitBreaker, NotificationSource, PollScheduler, ActionWorker,
+                          CommandCoalescer)
 
 # Constants
 kUpdateFrequencyKey = "updateFrequency"
+kPersistentRunnerKey = "usePersistentRunner"
+
+# Due devices are polled concurrently by up to kPollWorkers threads, one poll
+# per device at a time. Script calls share up to kScriptRunners persistent
+# workers; extra workers are only started when calls actually overlap
+kPollWorkers = 3
+kScriptRunners = 4
+
+# Each device's last published states are saved here on shutdown and shown
+# again at startup until the first live poll replaces them
+kSnapshotFileSuffix = ".snapshot.json"
+
+# A device saved while playing is restored as paused: it is only known to be
+# playing after the first poll, and a restored "playing" would look like playback
+# starting to the Music Manager, whose auto-exclusive mode pauses the other players
+kSnapshotPausedStates = {'playerState': 'paused', 'isPlaying': False, 'isPaused': True, 'isStopped': False}
+
+# Returned for script calls refused while the circuit breaker (see
+# mediacontrol) has suspended calls to the player
+kSuspendedError = u"{} is not responding; script calls are suspended"
+
+# Longest poll interval (seconds) reached by backing off in each idle state.
+# Polling starts at the device's update frequency and doubles on every poll
+# that finds the player still in the same idle state.
+kIdlePollCaps = {
+    'playing': 0,
+    'paused': 5,
+    'stopped': 15,
+    'notRunning': 30
+}
+kMaxIdlePolls = 10
+
+# Seconds between full state pushes; in between only changed states are sent
+kFullResyncInterval = 60
+
+# States that change every poll; their variables are written at most this often (seconds)
+kHighChurnVariables = ('playerPosition', 'playerPositionFormatted', 'progressPercent')
+kHighChurnVariableInterval = 5
+
+# Number of tracks whose metadata is kept in memory
+kMetadataCacheSize = 64
+
+# Upper bound on how long the poll thread sleeps when no device is due
+kSchedulerMaxWait = 10.0
+# Golden ratio fraction used to spread device poll phases across the interval
+kPhaseSpread = 0.618
+
+# Consecutive failures of the JavaScript status backend before a device
+# falls back to AppleScript for the rest of the session
+kMaxJavaScriptFailures = 3
+
+# Event mode: Music broadcasts this notification on every playback change.
+# States are updated from its payload and polling (for position, volume and
+# shuffle/repeat) slows to at least kEventPollInterval seconds
+kPlaybackNotification = "com.apple.Music.playerInfo"
+kEventPollInterval = 5.0
+kNotificationKeys = {
+    'Player State': 'playerState',
+    'PersistentID': 'persistentId',
+    'Name': 'trackName',
+    'Artist': 'trackArtist',
+    'Album': 'trackAlbum',
+    'Album Artist': 'albumArtist',
+    'Total Time': 'trackDuration',
+    'Track Number': 'trackNumber',
+    'Disc Number': 'discNumber',
+    'Genre': 'genre',
+    'Composer': 'composer',
+    'Year': 'year'
+}
+
+# A notification carrying all of these is published without a metadata query;
+# the next poll's query fills in what the payload lacks (rating)
+kPayloadMetadataKeys = frozenset(('trackName', 'trackArtist', 'trackAlbum', 'trackDuration'))
+
+
+# JavaScript for Automation versions of the status queries (optional "jxa"
+# backend). They return JSON text with the same keys as the AppleScript records.
+kHeartbeatJavaScript = '''
+(function () {
+    var stopped = {playerState: 'stopped', trackName: '', trackArtist: '', trackAlbum: '', trackDuration: 0,
+                   playerPosition: 0, trackNumber: 0, discNumber: 0, genre: '', composer: '', rating: 0, year: 0,
+                   albumArtist: '', soundVolume: 50, shuffleEnabled: false, songRepeat: 'off'};
+    var music = Application('Music');
+    if (!music.running()) {
+        stopped.notRunning = true;
+        return JSON.stringify(stopped);
+    }
+    try {
+        var playerState = music.playerState();
+        var player = {playerState: playerState, soundVolume: music.soundVolume(),
+                      shuffleEnabled: music.shuffleEnabled(), songRepeat: music.songRepeat()};
+        if (playerState === 'stopped') {
+            return JSON.stringify(Object.assign(stopped, player));
+        }
+        player.playerPosition = music.playerPosition();
+        player.persistentId = music.currentTrack.persistentID();
+        return JSON.stringify(player);
+    } catch (e) {
+        return JSON.stringify({errorMsg: String(e)});
+    }
+})()
+'''
+
+kMetadataJavaScript = '''
+(function () {
+    try {
+        var track = Application('Music').currentTrack;
+        return JSON.stringify({
+            persistentId: track.persistentID(),
+            trackName: track.name(),
+            trackArtist: track.artist(),
+            trackAlbum: track.album(),
+            trackDuration: track.duration(),
+            trackNumber: track.trackNumber(),
+            discNumber: track.discNumber(),
+            genre: track.genre(),
+            composer: track.composer(),
+            rating: track.rating(),
+            year: track.year(),
+            albumArtist: track.albumArtist()
+        });
+    } catch (e) {
+        return JSON.stringify({errorMsg: String(e)});
+    }
+})()
+'''
+
+
+# Bursts of volume, seek, skip and toggle actions for a device are merged and
+# only the settled value is sent once no new one has arrived for the debounce
+# window (plugin preference, seconds), or after mediacontrol.kMaxDebounceWindows windows
+kCommandDebounceKey = "commandDebounce"
+kDefaultCommandDebounce = 0.25
+
+# Song repeat toggle order
+kNextRepeatMode = {'off': 'all', 'all': 'one', 'one': 'off'}
+
+# After an action, a cheap probe is repeated every kActionProbeInterval seconds
+# until the expected change shows up. The deadline adapts to how long each
+# action has taken to show up before (kActionDeadlineFactor x its average),
+# within kActionMinWait..kActionMaxWait.
+kActionProbeInterval = 0.1
+kActionMinWait = 0.5
+kActionMaxWait = 5.0
+kActionDeadlineFactor = 3.0
+
+# The app liveness probe result is shared by all devices for this long (seconds);
+# while the app is down the status query is skipped and this record is used
+kLivenessTTL = 2.0
+kNotRunningStatus = {
+    'playerState': 'stopped', 'trackName': '', 'trackArtist': '', 'trackAlbum': '', 'trackDuration': 0,
+    'playerPosition': 0, 'trackNumber': 0, 'discNumber': 0, 'genre': '', 'composer': '', 'rating': 0,
+    'year': 0, 'albumArtist': '', 'soundVolume': 50, 'shuffleEnabled': False, 'songRepeat': 'off',
+    'notRunning': True
+}
+
+# Named AppleScript sources. Each is compiled once per session, on its first
+# use (by the script runner, or with osacompile for the one-shot fallback), and
+# values are passed through "on run argv" instead of being spliced into the source.
+kScripts = {
+    'isRunning': 'return application id "com.apple.Music" is running',
+    # Cheap heartbeat: player-level properties and the current track's persistent ID only
+    'heartbeat': '''
+-- "is running" checks the app by bundle ID without System Events or launching it
+if application id "com.apple.Music" is running then
+    tell application "Music"
+        try
+            set playerState to player state as string
+            set soundVol to sound volume
+            set isShuffleEnabled to shuffle enabled
+            set repeatMode to song repeat as string
+            
+            if playerState is not equal to "stopped" then
+                set playerPos to player position
+                set persistentId to persistent ID of current track
+                
+                return {playerState:playerState, playerPosition:playerPos, persistentId:persistentId, soundVolume:soundVol, shuffleEnabled:isShuffleEnabled, songRepeat:repeatMode}
+            else
+                return {playerState:"stopped", trackName:"", trackArtist:"", trackAlbum:"", trackDuration:0, playerPosition:0, trackNumber:0, discNumber:0, genre:"", composer:"", rating:0, year:0, albumArtist:"", soundVolume:soundVol, shuffleEnabled:isShuffleEnabled, songRepeat:repeatMode}
+            end if
+        on error errMsg
+            return {errorMsg:errMsg}
+        end try
+    end tell
+else
+    return {playerState:"stopped", trackName:"", trackArtist:"", trackAlbum:"", trackDuration:0, playerPosition:0, trackNumber:0, discNumber:0, genre:"", composer:"", rating:0, year:0, albumArtist:"", soundVolume:50, shuffleEnabled:false, songRepeat:"off", notRunning:true}
+end if
+''',
+    'metadata': '''
+tell application "Music"
+    try
+        set theTrack to current track
+        return {persistentId:persistent ID of theTrack, trackName:name of theTrack, trackArtist:artist of theTrack, trackAlbum:album of theTrack, trackDuration:duration of theTrack, trackNumber:track number of theTrack, discNumber:disc number of theTrack, genre:genre of theTrack, composer:composer of theTrack, rating:rating of theTrack, year:year of theTrack, albumArtist:album artist of theTrack}
+    on error errMsg
+        return {errorMsg:errMsg}
+    end try
+end tell
+''',
+    'play': 'tell application "Music" to play',
+    'pause': 'tell application "Music" to pause',
+    'playPause': 'tell application "Music" to playpause',
+    'stop': 'tell application "Music" to stop',
+    'nextTrack': '''
+on run argv
+    tell application "Music"
+        repeat (item 1 of argv) as integer times
+            next track
+        end repeat
+    end tell
+end run
+''',
+    'previousTrack': '''
+on run argv
+    tell application "Music"
+        repeat (item 1 of argv) as integer times
+            previous track
+        end repeat
+    end tell
+end run
+''',
+    'setVolume': '''
+on run argv
+    tell application "Music" to set sound volume to (item 1 of argv) as integer
+end run
+''',
+    'setPosition': '''
+on run argv
+    tell application "Music" to set player position to (item 1 of argv) as integer
+end run
+''',
+    'setShuffle': '''
+on run argv
+    tell application "Music" to set shuffle enabled to (item 1 of argv is "true")
+end run
+''',
+    'setRepeat': '''
+on run argv
+    set repeatMode to item 1 of argv
+    tell application "Music"
+        if repeatMode is "one" then
+            set song repeat to one
+        else if repeatMode is "all" then
+            set song repeat to all
+        else
+            set song repeat to off
+        end if
+    end tell
+end run
+''',
+    'setRating': '''
+on run argv
+    tell application "Music" to set rating of current track to (item 1 of argv) as integer
+end run
+''',
+    'playPlaylist': '''
+on run argv
+    set playlistName to item 1 of argv
+    tell application "Music"
+        try
+            play playlist playlistName
+        on error
+            error "Playlist not found: " & playlistName
+        end try
+    end tell
+end run
+''',
+    'playAlbum': '''
+on run argv
+    set albumName to item 1 of argv
+    set artistName to item 2 of argv
+    tell application "Music"
+        try
+            if artistName is "" then
+                set theAlbum to first track of library whose album is albumName
+            else
+                set theAlbum to first track of library whose album is albumName and artist is artistName
+            end if
+            play theAlbum
+        on error
+            if artistName is "" then
+                error "Album not found: " & albumName
+            else
+                error "Album not found: " & albumName & " by " & artistName
+            end if
+        end try
+    end tell
+end run
+''',
+    'searchAndPlay': '''
+on run argv
+    set searchQuery to item 1 of argv
+    tell application "Music"
+        try
+            set searchResults to (search library for searchQuery)
+        on error
+            error "Search failed for: " & searchQuery
+        end try
+        if (count of searchResults) > 0 then
+            play item 1 of searchResults
+        else
+            error "No results found for: " & searchQuery
+        end if
+    end tell
+end run
+''',
+}
+
+
+# Action scripts with the status query appended, run by the action worker
+kActionScripts = dict((name, withStatusQuery(source, kScripts['heartbeat']))
+                      for name, source in kScripts.items()
+                      if name not in ('isRunning', 'heartbeat', 'metadata'))
 
 
 class Plugin(indigo.PluginBase):
@@ -22,108 +343,426 @@ class Plugin(indigo.PluginBase):
         super(Plugin, self).__init__(pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
         self.debug = pluginPrefs.get("showDebugInfo", False)
         self.deviceDict = {}
+        self.scriptRunner = None
+        self.scriptFolder = None
+        self.compiledScripts = {}
+        self.liveness = {'running': None, 'checkedAt': 0}
+        self.livenessLock = threading.Lock()
+        self.pollScheduler = PollScheduler()
+        self.pollPool = ThreadPoolExecutor(max_workers=kPollWorkers)
+        self.flightLock = threading.Lock()   # guards each device's polling/queryStarted/followUp
+        self.readSequence = itertools.count(1)   # orders status reads so an older one never overwrites a newer
+        self.compileLock = threading.Lock()
+        self.breaker = CircuitBreaker(self.breakerChanged)
+        self.notificationSource = None
+        self.actionWorker = ActionWorker(self)
+        self.coalescer = CommandCoalescer(self.sendCoalesced, self.getCommandDebounce(pluginPrefs))
+        self.mirrorLock = threading.Lock()
+        self.snapshot = {}        # str(devId) -> {state key: value} from the last run
+        self.snapshotPath = None
+        self.actionLatency = {}   # script name -> average seconds until its effect showed up
+        self.metadataCache = LRUCache(kMetadataCacheSize)
         
     def startup(self):
         """Called when plugin starts"""
         self.debugLog(u"Apple Music Plugin startup called")
+        self.loadSnapshot()
+        if self.pluginPrefs.get(kPersistentRunnerKey, True):
+            self.scriptRunner = ScriptRunnerPool(self, kScriptRunners)
+        self.actionWorker.start()
         
     def shutdown(self):
         """Called when plugin shuts down"""
         self.debugLog(u"Apple Music Plugin shutdown called")
+        if self.notificationSource:
+            self.notificationSource.stop()
+        self.coalescer.flushAll()
+        self.actionWorker.stop(kActionMaxWait + 1)
+        self.pollPool.shutdown(wait=True)
+        self.saveSnapshot()
+        if self.scriptRunner:
+            self.scriptRunner.stop()
+        if self.scriptFolder:
+            shutil.rmtree(self.scriptFolder, ignore_errors=True)
+        
+    def closedPrefsConfigUi(self, valuesDict, userCancelled):
+        """Apply preference changes that do not need a restart"""
+        if not userCancelled:
+            self.debug = valuesDict.get("showDebugInfo", False)
+            self.coalescer.window = self.getCommandDebounce(valuesDict)
+            
+    def getCommandDebounce(self, prefs):
+        """Return the command debounce window from the plugin preferences, in seconds"""
+        value = prefs.get(kCommandDebounceKey, kDefaultCommandDebounce)
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            self.errorLog(u"Invalid command debounce '{}', using {}".format(value, kDefaultCommandDebounce))
+            return kDefaultCommandDebounce
         
     def deviceStartComm(self, dev):
         """Called when device communication starts"""
         self.debugLog(u"Starting device: " + dev.name)
         
-        # Initialize the device's update frequency
+        # Initialize the device's update frequency; in event mode polls only
+        # need to keep the position current
         updateFreq = float(dev.pluginProps.get(kUpdateFrequencyKey, 1))
+        updateMode = dev.pluginProps.get('updateMode', 'poll')
+        if updateMode == 'events':
+            updateFreq = max(updateFreq, kEventPollInterval)
+            if self.notificationSource is None:
+                self.notificationSource = NotificationSource(self, kPlaybackNotification, self.playerNotified)
+            self.notificationSource.start()
         
         # Store device info
         self.deviceDict[dev.id] = {
             'device': dev,
             'updateFrequency': updateFreq,
             'lastUpdate': 0,
+            'pollInterval': updateFreq,
+            'idlePolls': 0,
+            'lastPlayerState': None,
+            'resetPending': False,
+            'updateMode': updateMode,
+            'statusBackend': dev.pluginProps.get('statusBackend', 'applescript'),
+            'javaScriptFailures': 0,
+            'persistentId': '',
+            'lastStatus': None,
+            'optimistic': {},   # state key -> value expected from a queued command
+            'pollLock': threading.Lock(),   # one publish per device at a time
+            'polling': False,        # a poll is queued or running
+            'queryStarted': False,   # ...and has started its query
+            'followUp': False,       # refresh requested while the query was running
+            'publishedRead': 0,      # readSequence stamp of the last status published
+            'publishedStates': {},
+            'lastFullSync': 0,
+            'variables': None,
             'previousVolume': None  # For mute/unmute
         }
         
-        # Do initial update
-        self.updateAppleMusicStatus(dev)
+        # Show the last known states at once; the first live poll runs in the
+        # background, offset from the other devices
+        devInfo = self.deviceDict[dev.id]
+        with devInfo['pollLock']:
+            self.restoreSnapshot(dev)
+            self.publishStates(dev, [{'key': 'connectionState', 'value': self.breaker.state}])
+        phase = (len(self.deviceDict) * kPhaseSpread) % 1.0
+        devInfo['resetPending'] = True
+        self.pollScheduler.schedule(dev.id, time.time() + devInfo['pollInterval'] * phase)
         
     def deviceStopComm(self, dev):
         """Called when device communication stops"""
         self.debugLog(u"Stopping device: " + dev.name)
-        if dev.id in self.deviceDict:
-            del self.deviceDict[dev.id]
+        devInfo = self.deviceDict.pop(dev.id, None)
+        if devInfo:
+            # Kept for the snapshot written at shutdown
+            with self.mirrorLock:
+                self.snapshot[str(dev.id)] = dict(devInfo['publishedStates'])
+        self.pollScheduler.cancel(dev.id)
+        
+        # Stop observing notifications once no device uses them
+        if self.notificationSource and not any(info['updateMode'] == 'events' for info in list(self.deviceDict.values())):
+            self.notificationSource.stop()
+        
+    def loadSnapshot(self):
+        """Read the state snapshot saved by the last run, if any"""
+        self.snapshotPath = os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins',
+                                         self.pluginId + kSnapshotFileSuffix)
+        try:
+            with open(self.snapshotPath) as snapshotFile:
+                self.snapshot = json.load(snapshotFile)
+        except FileNotFoundError:
+            self.snapshot = {}
+        except (OSError, ValueError) as e:
+            self.debugLog(u"Could not read state snapshot: {}".format(str(e)))
+            self.snapshot = {}
+            
+    def restoreSnapshot(self, dev):
+        """Publish a device's states from the snapshot so they show before the first poll"""
+        states = self.snapshot.pop(str(dev.id), None)
+        if states:
+            states.pop('connectionState', None)
+            if states.get('isPlaying'):
+                states.update(kSnapshotPausedStates)
+                if states.get('status', '').startswith(u"▶"):
+                    states['status'] = u"⏸" + states['status'][1:]
+            self.publishStates(dev, [{'key': key, 'value': value} for key, value in states.items()])
+            
+    def saveSnapshot(self):
+        """Write every device's last published states for the next startup"""
+        if not self.snapshotPath:
+            return
+        for devId, devInfo in list(self.deviceDict.items()):
+            with self.mirrorLock:
+                self.snapshot[str(devId)] = dict(devInfo['publishedStates'])
+        # Drop devices that have been deleted
+        deviceIds = set(str(dev.id) for dev in indigo.devices.iter('self'))
+        snapshot = dict((devId, states) for devId, states in self.snapshot.items() if devId in deviceIds)
+        try:
+            tempPath = self.snapshotPath + '.tmp'
+            with open(tempPath, 'w') as snapshotFile:
+                json.dump(snapshot, snapshotFile, separators=(',', ':'))
+            os.replace(tempPath, self.snapshotPath)
+        except (OSError, TypeError, ValueError) as e:
+            self.errorLog(u"Could not save state snapshot: {}".format(str(e)))
             
     def runConcurrentThread(self):
-        """Main plugin loop - updates device states"""
+        """Main plugin loop - updates device states as their poll deadlines come due"""
         try:
             while True:
-                currentTime = time.time()
+                for devId in self.pollScheduler.waitForDue(kSchedulerMaxWait):
+                    devInfo = self.deviceDict.get(devId)
+                    if devInfo and self.startFlight(devInfo):
+                        self.pollPool.submit(self.pollTask, devInfo)
                 
-                for devId, devInfo in list(self.deviceDict.items()):
-                    dev = devInfo['device']
-                    updateFreq = devInfo['updateFrequency']
-                    lastUpdate = devInfo['lastUpdate']
-                    
-                    # Check if it's time to update this device
-                    if currentTime - lastUpdate >= updateFreq:
-                        self.updateAppleMusicStatus(dev)
-                        devInfo['lastUpdate'] = currentTime
-                
-                self.sleep(0.1)  # Short sleep to prevent CPU spinning
+                if self.stopThread:
+                    raise self.StopThread
                 
         except self.StopThread:
             pass
             
-    def updateAppleMusicStatus(self, dev):
-        """Update all Apple Music status information"""
+    def stopConcurrentThread(self):
+        """Called when the plugin is stopping - wake the poll thread so it can exit"""
+        super(Plugin, self).stopConcurrentThread()
+        self.pollScheduler.wake()
+            
+    def playerNotified(self, payload):
+        """Publish a playback notification to every device in event mode"""
+        status = self.statusFromNotification(payload)
+        readStamp = next(self.readSequence)
+        self.debugLog(u"Player notification: {} {}".format(status.get('playerState'), status.get('persistentId', '')))
+        for devInfo in list(self.deviceDict.values()):
+            if devInfo['updateMode'] != 'events':
+                continue
+            # The notification lacks volume and shuffle/repeat; keep the last polled values
+            # but not track details, which may belong to an earlier track
+            lastStatus = devInfo['lastStatus'] or {}
+            record = {key: value for key, value in lastStatus.items() if key not in kPayloadMetadataKeys}
+            record.update(status)
+            for key in ('notRunning', 'livenessCached', 'error', 'errorMsg'):
+                record.pop(key, None)
+            self.pollDevice(devInfo['device'], reset=True, status=record, readStamp=readStamp)
+            
+    def statusFromNotification(self, payload):
+        """Translate a playerInfo notification into heartbeat/metadata record keys"""
+        status = {}
+        for key, statusKey in kNotificationKeys.items():
+            if key in payload:
+                status[statusKey] = payload[key]
+        if 'playerState' in status:
+            status['playerState'] = str(status['playerState']).lower()
+        if 'persistentId' in status:
+            # Sent as a signed 64-bit number; AppleScript reports it as 16 hex digits
+            status['persistentId'] = format(int(status['persistentId']) & 0xFFFFFFFFFFFFFFFF, '016X')
+        if 'trackDuration' in status:
+            status['trackDuration'] = float(status['trackDuration']) / 1000.0   # ms to seconds
+        if status.get('playerState') == 'stopped':
+            status.update({'persistentId': '', 'playerPosition': 0})
+        return status
+        
+    def requestRefresh(self, dev):
+        """Ask the poll thread to refresh a device now at the fast poll rate"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo:
+            devInfo['resetPending'] = True
+            self.pollScheduler.schedule(dev.id, time.time())
+            
+    def queueAction(self, dev, script, *args, expect=None, after=None, optimistic=None):
+        """Queue a named script for the action worker so the action handler returns at once
+        
+        expect describes the change that confirms the action in the probe record:
+        ('equals', key, value) or ('changes', key). after runs once the script has run.
+        optimistic maps state keys to the values the command will set; handlers
+        see them in the state mirror until the action has run.
+        """
+        # Coalesced commands given earlier (a toggle still in its debounce
+        # window) go first, so a play, pause or stop cannot overtake them. The
+        # coalescer sends through here too; its own slot is no longer pending
+        self.coalescer.flushDevice(dev.id)
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and optimistic:
+            with self.mirrorLock:
+                devInfo['optimistic'].update(optimistic)
+        self.actionWorker.submit(dev, {'script': script, 'args': args, 'expect': expect, 'after': after,
+                                       'optimistic': optimistic})
+        
+    def settleAction(self, dev, action):
+        """Action worker: drop an action's optimistic values once it has run, unless a later command replaced them"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and action['optimistic']:
+            with self.mirrorLock:
+                for key, value in action['optimistic'].items():
+                    if devInfo['optimistic'].get(key) == value:
+                        del devInfo['optimistic'][key]
+        
+    def performAction(self, dev, action):
+        """Action worker: run one action, wait until its effect shows up, then publish the status"""
+        expect = action['expect']
+        # Skip the confirmation wait when more actions for this device are queued
+        confirm = expect is not None and not self.actionWorker.hasPending(dev.id)
+        before = None
+        if confirm and expect[0] == 'changes':
+            devInfo = self.deviceDict.get(dev.id)
+            before = devInfo and devInfo['lastStatus'] or self.probePlayer()
+        
+        # The action script returns the status read right after the command,
+        # so no separate status query is needed
+        started = time.time()
+        status = self.executeAppleScript(kActionScripts[action['script']], [str(arg) for arg in action['args']])
+        readStamp = next(self.readSequence)
+        if action['after']:
+            action['after']()
+        
+        if confirm:
+            average = self.actionLatency.get(action['script'], kActionMinWait / kActionDeadlineFactor)
+            deadline = min(kActionMaxWait, max(kActionMinWait, average * kActionDeadlineFactor))
+            while True:
+                elapsed = time.time() - started
+                if status is not None and self.expectationMet(expect, before, status):
+                    self.debugLog(u"{} on {} showed up after {:.2f}s".format(action['script'], dev.name, elapsed))
+                    break
+                if elapsed >= deadline or self.actionWorker.hasPending(dev.id):
+                    self.debugLog(u"{} on {} not confirmed within {:.2f}s".format(action['script'], dev.name, deadline))
+                    break
+                time.sleep(kActionProbeInterval)
+                status = self.probePlayer()
+                readStamp = next(self.readSequence)
+            self.actionLatency[action['script']] = 0.8 * average + 0.2 * elapsed
+            
+        if status is not None:
+            self.pollDevice(dev, reset=True, status=status, readStamp=readStamp)
+        else:
+            self.requestRefresh(dev)
+        
+    def expectationMet(self, expect, before, probe):
+        """Return whether a probe record shows the change an action expects"""
+        if expect[0] == 'equals':
+            return probe.get(expect[1]) == expect[2]
+        return before is not None and probe.get(expect[1]) != before.get(expect[1])
+        
+    def startFlight(self, devInfo):
+        """Claim a due device for the poll pool; returns False if a poll is already in flight
+        
+        Refreshes requested while a poll is queued are served by that poll; one
+        requested while its query is running gets exactly one follow-up query.
+        """
+        with self.flightLock:
+            if not devInfo['polling']:
+                devInfo['polling'] = True
+                devInfo['queryStarted'] = False
+                return True
+            if devInfo['queryStarted']:
+                devInfo['followUp'] = True
+            return False
+            
+    def pollTask(self, devInfo):
+        """Poll pool: poll one device (plus one follow-up if requested meanwhile), then release it"""
+        dev = devInfo['device']
         try:
-            # Build comprehensive AppleScript to get all Apple Music data
-            script = '''
-            tell application "System Events"
-                set musicRunning to (name of processes) contains "Music"
-            end tell
-            
-            if musicRunning then
-                tell application "Music"
-                    try
-                        set playerState to player state as string
-                        set soundVol to sound volume
-                        set isShuffleEnabled to shuffle enabled
-                        set repeatMode to song repeat as string
-                        
-                        if playerState is not equal to "stopped" then
-                            set trackName to name of current track
-                            set trackArtist to artist of current track
-                            set trackAlbum to album of current track
-                            set trackDuration to duration of current track
-                            set playerPos to player position
-                            set trackNumber to track number of current track
-                            set discNumber to disc number of current track
-                            set trackGenre to genre of current track
-                            set trackComposer to composer of current track
-                            set trackRating to rating of current track
-                            set trackYear to year of current track
-                            set albumArtist to album artist of current track
-                            
-                            return {playerState:playerState, trackName:trackName, trackArtist:trackArtist, trackAlbum:trackAlbum, trackDuration:trackDuration, playerPosition:playerPos, trackNumber:trackNumber, discNumber:discNumber, genre:trackGenre, composer:trackComposer, rating:trackRating, year:trackYear, albumArtist:albumArtist, soundVolume:soundVol, shuffleEnabled:isShuffleEnabled, songRepeat:repeatMode}
-                        else
-                            return {playerState:"stopped", trackName:"", trackArtist:"", trackAlbum:"", trackDuration:0, playerPosition:0, trackNumber:0, discNumber:0, genre:"", composer:"", rating:0, year:0, albumArtist:"", soundVolume:soundVol, shuffleEnabled:isShuffleEnabled, songRepeat:repeatMode}
-                        end if
-                    on error errMsg
-                        return {errorMsg:errMsg}
-                    end try
-                end tell
-            else
-                return {playerState:"stopped", trackName:"", trackArtist:"", trackAlbum:"", trackDuration:0, playerPosition:0, trackNumber:0, discNumber:0, genre:"", composer:"", rating:0, year:0, albumArtist:"", soundVolume:50, shuffleEnabled:false, songRepeat:"off"}
-            end if
-            '''
+            while True:
+                with self.flightLock:
+                    devInfo['queryStarted'] = True
+                    devInfo['followUp'] = False
+                self.pollDevice(dev)
+                with self.flightLock:
+                    if not devInfo['followUp']:
+                        devInfo['polling'] = False
+                        return
+        except Exception as e:
+            self.errorLog(u"Exception polling {}: {}".format(dev.name, str(e)))
+            with self.flightLock:
+                devInfo['polling'] = False
+            # popDue already dropped the device's deadline; without a new one it
+            # would never be polled again
+            if self.deviceDict.get(dev.id) is devInfo:
+                self.pollScheduler.schedule(dev.id, time.time() + devInfo['pollInterval'])
+            
+    def pollDevice(self, dev, reset=False, status=None, readStamp=None):
+        """Update status (or publish a record already read) and schedule the next poll from player activity
+        
+        readStamp is the readSequence value taken when status was read; a status
+        read before the last one published is dropped.
+        """
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo is None:
+            return
+        
+        # The status query runs outside the device's lock so the action worker
+        # and notifications are not held up while it waits on the player; the
+        # read stamp taken before it still keeps it from overwriting a newer read
+        if status is None:
+            readStamp = next(self.readSequence)
+            status = self.readAppleMusicStatus(dev)
+        elif readStamp is None:
+            readStamp = next(self.readSequence)
+        # ...and so does a new track's metadata query
+        metadata = self.statusMetadata(dev, status) if status else None
+        
+        # The action worker and notifications publish too; the device's lock
+        # keeps its updates in order
+        with devInfo['pollLock']:
+            if readStamp < devInfo['publishedRead']:
+                # A newer read was published while this one was on its way
+                return
+            devInfo['publishedRead'] = readStamp
+            
+            playerState = None if status is None else self.processStatus(dev, status, metadata)
             
-            # Execute AppleScript
-            result = self.executeAppleScript(script)
+            if dev.id in self.deviceDict:
+                # Circuit breaker changes show up here, under the device's lock
+                self.publishStates(dev, [{'key': 'connectionState', 'value': self.breaker.state}])
+                reset = reset or devInfo['resetPending']
+                devInfo['resetPending'] = False
+                devInfo['lastUpdate'] = time.time()
+                self.adjustPollInterval(devInfo, playerState, reset)
+                self.pollScheduler.schedule(dev.id, devInfo['lastUpdate'] + devInfo['pollInterval'])
+            
+    def adjustPollInterval(self, devInfo, playerState, reset=False):
+        """Back off polling while the player stays idle, snap back on any change"""
+        updateFreq = devInfo['updateFrequency']
+        
+        if reset or playerState == 'playing' or playerState != devInfo['lastPlayerState']:
+            devInfo['idlePolls'] = 0
+        else:
+            devInfo['idlePolls'] = min(kMaxIdlePolls, devInfo['idlePolls'] + 1)
+        devInfo['lastPlayerState'] = playerState
+        
+        # Unknown states (errors) back off like a player that isn't running
+        cap = max(updateFreq, kIdlePollCaps.get(playerState, kIdlePollCaps['notRunning']))
+        devInfo['pollInterval'] = min(cap, updateFreq * (2 ** devInfo['idlePolls']))
+            
+    def readAppleMusicStatus(self, dev):
+        """Read the player's status record, or None while the circuit breaker blocks calls"""
+        # Leave a player that keeps timing out alone until the breaker retries
+        if self.breaker.blocking():
+            return None
+        
+        # Cheap heartbeat: player-level properties and the current track's persistent ID only
+        if self.isPlayerRunning():
+            result = self.queryPlayer(dev, kScripts['heartbeat'], kHeartbeatJavaScript)
+        else:
+            # Known to be down - no need to ask. The record is marked so it does
+            # not renew the cached liveness, or a launch would never be seen
+            result = dict(kNotRunningStatus, livenessCached=True)
+        return result
+        
+    def processStatus(self, dev, result, metadata=None):
+        """Publish a status record from a poll or an action, with its track's metadata, and return the player state"""
+        try:
+            if result is not None:
+                if not result.get('livenessCached'):
+                    self.noteLiveness(not result.get('notRunning', False))
+                devInfo = self.deviceDict.get(dev.id)
+                if devInfo:
+                    devInfo['lastStatus'] = result
             
             if result and 'errorMsg' not in result:
+                devInfo = self.deviceDict.get(dev.id)
+                if devInfo:
+                    devInfo['persistentId'] = result.get('persistentId', '')
+                if metadata:
+                    result = dict(metadata, **result)
+                
                 stateList = []
                 
                 # Player state
@@ -194,37 +833,160 @@ class Plugin(indigo.PluginBase):
                 stateList.append({'key': 'status', 'value': status})
                 
                 # Update all states at once
-                dev.updateStatesOnServer(stateList)
+                self.publishStates(dev, stateList)
                 
                 # Update variables if enabled
                 if dev.pluginProps.get('updateVariables', False):
                     self.updateVariables(dev, stateList)
                 
+                if result.get('notRunning', False):
+                    return 'notRunning'
+                return playerState
+                
             else:
                 # Error or Music not available
                 if result and 'errorMsg' in result:
                     self.errorLog(u"Error getting Apple Music status: {}".format(result['errorMsg']))
                 
         except Exception as e:
-            self.errorLog(u"Exception in updateAppleMusicStatus: {}".format(str(e)))
+            self.errorLog(u"Exception in processStatus: {}".format(str(e)))
+        return None
+            
+    def statusMetadata(self, dev, result):
+        """Return the metadata for a status record's track
+        
+        Metadata only needs fetching when the persistent ID changes, and not at
+        all for a notification that carries the track details.
+        """
+        persistentId = result.get('persistentId', '')
+        if kPayloadMetadataKeys.issubset(result):
+            return self.metadataCache.get(persistentId) if persistentId else None
+        return self.getTrackMetadata(dev, persistentId)
+        
+    def getTrackMetadata(self, dev, persistentId):
+        """Return metadata for the current track, querying Music only on a cache miss"""
+        if not persistentId:
+            return None
+        
+        metadata = self.metadataCache.get(persistentId)
+        if metadata is not None:
+            return metadata
+        
+        metadata = self.queryPlayer(dev, kScripts['metadata'], kMetadataJavaScript)
+        if not metadata or 'errorMsg' in metadata:
+            return None
+        
+        # Cache under the ID Music reported, in case the track changed in between
+        self.debugLog(u"Fetched metadata for track {}".format(metadata.get('persistentId', persistentId)))
+        self.metadataCache.put(metadata.get('persistentId', persistentId), metadata)
+        return metadata
+            
+    def publishStates(self, dev, stateList):
+        """Send only the states that changed since the last update, with a periodic full resync"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo is None:
+            dev.updateStatesOnServer(stateList)
+            return stateList
+        
+        published = devInfo['publishedStates']
+        now = time.time()
+        if now - devInfo['lastFullSync'] >= kFullResyncInterval:
+            changed = stateList
+            devInfo['lastFullSync'] = now
+        else:
+            changed = [state for state in stateList
+                       if state['key'] not in published or published[state['key']] != state['value']]
+        
+        if changed:
+            dev.updateStatesOnServer(changed)
+            # Publishers are serialized by the device's poll lock; the mirror
+            # lock keeps action handlers from reading the cache mid-update
+            with self.mirrorLock:
+                for state in changed:
+                    published[state['key']] = state['value']
+        return changed
             
     def updateVariables(self, dev, stateList):
-        """Update Indigo variables with current states"""
+        """Update Indigo variables with current states, writing only values that changed"""
         try:
-            prefix = dev.pluginProps.get('variablePrefix', 'AppleMusic')
+            devInfo = self.deviceDict.get(dev.id)
+            if devInfo is None:
+                return
             
+            variables = devInfo['variables']
+            if variables is None:
+                variables = devInfo['variables'] = {
+                    'prefix': dev.pluginProps.get('variablePrefix', 'AppleMusic'),
+                    'useFolder': dev.pluginProps.get('variableFolder', False),
+                    'folderId': None,
+                    'names': {},       # state key -> variable name
+                    'ids': {},         # variable name -> variable ID
+                    'values': {},      # variable name -> last written value
+                    'writeTimes': {}   # variable name -> time of last write
+                }
+            
+            now = time.time()
             for state in stateList:
-                varName = prefix + state['key'][0].upper() + state['key'][1:]
+                varName = variables['names'].get(state['key'])
+                if varName is None:
+                    varName = variables['prefix'] + state['key'][0].upper() + state['key'][1:]
+                    variables['names'][state['key']] = varName
                 
-                # Create variable if it doesn't exist
-                if varName not in indigo.variables:
-                    indigo.variable.create(varName, value=str(state['value']), folder=0)
-                else:
-                    indigo.variable.updateValue(varName, value=str(state['value']))
+                varValue = str(state['value'])
+                if variables['values'].get(varName) == varValue:
+                    continue
+                
+                # Fast-moving values are written at most once per interval; the
+                # latest value goes out on the first poll after the interval
+                if (state['key'] in kHighChurnVariables and
+                        now - variables['writeTimes'].get(varName, 0) < kHighChurnVariableInterval):
+                    continue
+                
+                try:
+                    self.writeVariable(variables, varName, varValue)
+                    variables['values'][varName] = varValue
+                    variables['writeTimes'][varName] = now
+                except Exception as e:
+                    # Variable was probably deleted - resolve it again next time
+                    variables['ids'].pop(varName, None)
+                    self.errorLog(u"Exception updating variable {}: {}".format(varName, str(e)))
                     
         except Exception as e:
             self.errorLog(u"Exception in updateVariables: {}".format(str(e)))
             
+    def writeVariable(self, variables, varName, varValue):
+        """Write a variable by cached ID, creating or filing it (and its folder) on first use"""
+        varId = variables['ids'].get(varName)
+        if varId is None:
+            folderId = self.getVariableFolderId(variables)
+            if varName in indigo.variables:
+                var = indigo.variables[varName]
+                # Variables created before the folder option was enabled move into the folder
+                if variables['useFolder'] and var.folderId != folderId:
+                    indigo.variable.moveToFolder(var, value=folderId)
+                varId = var.id
+            else:
+                var = indigo.variable.create(varName, value=varValue, folder=folderId)
+                variables['ids'][varName] = var.id
+                return
+            variables['ids'][varName] = varId
+        
+        indigo.variable.updateValue(varId, value=varValue)
+        
+    def getVariableFolderId(self, variables):
+        """Return the folder for new variables, creating the device's folder once if enabled"""
+        if not variables['useFolder']:
+            return 0
+        
+        if variables['folderId'] is None:
+            folderName = variables['prefix']
+            if folderName in indigo.variables.folders:
+                variables['folderId'] = indigo.variables.folders[folderName].id
+            else:
+                variables['folderId'] = indigo.variables.folder.create(folderName).id
+                self.debugLog(u"Created variable folder {}".format(folderName))
+        return variables['folderId']
+            
     def formatTime(self, seconds):
         """Format seconds as MM:SS"""
         try:
@@ -235,156 +997,254 @@ class Plugin(indigo.PluginBase):
         except:
             return "0:00"
             
-    def executeAppleScript(self, script):
+    def executeAppleScript(self, script, args=None):
         """Execute AppleScript and return result"""
         try:
-            process = subprocess.Popen(['osascript', '-e', script],
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-            output, error = process.communicate()
+            output, error = self.runAppleScript(script, args=args)
             
             if error:
-                self.errorLog(u"AppleScript error: {}".format(error.decode('utf-8')))
+                # Refused calls were logged once when the breaker opened
+                if error == kSuspendedError.format(self.pluginDisplayName):
+                    self.debugLog(u"AppleScript error: {}".format(error))
+                else:
+                    self.errorLog(u"AppleScript error: {}".format(error))
                 return None
             
             # Parse the output
-            result_str = output.decode('utf-8').strip()
+            result_str = output.strip()
             
             if not result_str:
                 return {}
             
             # Parse AppleScript record format
-            result = {}
-            
-            # Remove outer braces
-            if result_str.startswith('{') and result_str.endswith('}'):
-                result_str = result_str[1:-1]
-            
-            # Split by comma, but be careful with nested content
-            parts = []
-            current = ""
-            depth = 0
-            for char in result_str:
-                if char == '{':
-                    depth += 1
-                elif char == '}':
-                    depth -= 1
-                elif char == ',' and depth == 0:
-                    parts.append(current.strip())
-                    current = ""
-                    continue
-                current += char
-            if current:
-                parts.append(current.strip())
-            
-            # Parse each key:value pair
-            for part in parts:
-                if ':' in part:
-                    key, value = part.split(':', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    # Remove quotes from strings
-                    if value.startswith('"') and value.endswith('"'):
-                        value = value[1:-1]
-                    
-                    # Convert to appropriate type
-                    if value == 'true':
-                        value = True
-                    elif value == 'false':
-                        value = False
-                    elif value.replace('.', '', 1).isdigit():
-                        if '.' in value:
-                            value = float(value)
-                        else:
-                            value = int(value)
-                    
-                    result[key] = value
-            
-            return result
+            return self.parseAppleScriptRecord(result_str)
             
         except Exception as e:
             self.errorLog(u"Exception in executeAppleScript: {}".format(str(e)))
             return None
             
+    def parseAppleScriptRecord(self, result_str):
+        """Parse AppleScript record output into a dictionary"""
+        try:
+            return AppleScriptParser(result_str).parseRecord()
+        except ValueError as e:
+            self.errorLog(u"Error parsing AppleScript record: {}".format(str(e)))
+            return {}
+            
+    def executeJavaScript(self, script):
+        """Execute a JavaScript for Automation script that returns JSON, as a dictionary"""
+        try:
+            output, error = self.runAppleScript(script, language='JavaScript')
+            
+            if error:
+                self.debugLog(u"JavaScript error: {}".format(error))
+                return None
+            
+            output = output.strip()
+            if not output:
+                return None
+            
+            result = json.loads(output)
+            # The worker reports a returned string in quoted form
+            if isinstance(result, str):
+                result = json.loads(result)
+            return result if isinstance(result, dict) else None
+            
+        except ValueError as e:
+            self.debugLog(u"Invalid JSON from JavaScript: {}".format(str(e)))
+            return None
+        except Exception as e:
+            self.errorLog(u"Exception in executeJavaScript: {}".format(str(e)))
+            return None
+            
+    def queryPlayer(self, dev, script, javaScript):
+        """Run a status query with the device's backend, falling back to AppleScript"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and devInfo['statusBackend'] == 'jxa':
+            result = self.executeJavaScript(javaScript)
+            if result is not None:
+                devInfo['javaScriptFailures'] = 0
+                return result
+            
+            devInfo['javaScriptFailures'] += 1
+            if devInfo['javaScriptFailures'] >= kMaxJavaScriptFailures:
+                self.errorLog(u"JavaScript status queries keep failing for {}, using AppleScript".format(dev.name))
+                devInfo['statusBackend'] = 'applescript'
+                
+        return self.executeAppleScript(script)
+            
+    def isPlayerRunning(self):
+        """Return whether the app is running, probing at most once per kLivenessTTL for all devices"""
+        with self.livenessLock:
+            if time.time() - self.liveness['checkedAt'] < kLivenessTTL:
+                return self.liveness['running']
+            
+            try:
+                output, error = self.runAppleScript(kScripts['isRunning'])
+            except OSError as e:
+                output, error = '', str(e)
+            if error:
+                self.debugLog(u"Liveness probe failed, assuming the app is running: {}".format(error.strip()))
+                running = True
+            else:
+                running = output.strip() == 'true'
+            self.liveness = {'running': running, 'checkedAt': time.time()}
+            return running
+            
+    def noteLiveness(self, running):
+        """Record liveness learned from a status query, saving the next probe"""
+        with self.livenessLock:
+            self.liveness = {'running': running, 'checkedAt': time.time()}
+            
+    def probePlayer(self):
+        """Return the heartbeat record, used to confirm that an action took effect"""
+        return self.runScript('heartbeat')
+        
+    def breakerChanged(self, state):
+        """Log circuit breaker changes and show them on every device"""
+        if state == 'suspended':
+            self.errorLog(u"{} is not responding; suspending script calls for {} seconds".format(self.pluginDisplayName, self.breaker.delay))
+        elif state == 'ok':
+            indigo.server.log(u"{} is responding again".format(self.pluginDisplayName))
+        # This runs on whichever thread made the call, possibly inside a poll
+        # holding its device's lock; each device publishes the new state from
+        # its next poll, brought forward to now
+        now = time.time()
+        for devId in list(self.deviceDict):
+            self.pollScheduler.schedule(devId, now)
+            
+    def runScript(self, name, *args):
+        """Run one of the plugin's named scripts, passing arguments through argv"""
+        return self.executeAppleScript(kScripts[name], [str(arg) for arg in args])
+            
+    def runAppleScript(self, script, language='AppleScript', args=None, timeout=kScriptTimeout):
+        """Run AppleScript (or JavaScript) and return its (output, error) text, guarded by the circuit breaker"""
+        if not self.breaker.allow():
+            return '', kSuspendedError.format(self.pluginDisplayName)
+        try:
+            result = self.invokeScript(script, language, args, timeout)
+        except (ScriptTimeout, ScriptLost) as e:
+            self.breaker.recordFailure()
+            return '', str(e)
+        except Exception:
+            self.breaker.recordFailure()
+            raise
+        self.breaker.recordSuccess()
+        return result
+            
+    def invokeScript(self, script, language, args, timeout):
+        """Run a script in the worker or a one-shot osascript, raising ScriptTimeout past the deadline
+        
+        A script whose worker died after reading it raises ScriptLost instead of
+        running again in a one-shot osascript.
+        """
+        if self.scriptRunner:
+            result = self.scriptRunner.run(script, language, args, timeout)
+            if result is not None:
+                return result
+            
+        # No worker available - fall back to a one-shot osascript process,
+        # running a compiled copy of the script when one is available
+        if language == 'JavaScript':
+            command = ['osascript', '-l', 'JavaScript', '-e', script]
+        else:
+            compiledPath = self.compileScript(script)
+            if compiledPath:
+                command = ['osascript', '-s', 's', compiledPath]
+            else:
+                command = ['osascript', '-s', 's', '-e', script]
+        command += args or []
+        process = subprocess.Popen(command,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        try:
+            output, error = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise ScriptTimeout(u"Script timed out after {:g} seconds".format(timeout))
+        return output.decode('utf-8'), error.decode('utf-8')
+            
+    def compileScript(self, script):
+        """Compile a script to a .scpt file once and return its path, or None"""
+        with self.compileLock:
+            return self.compileScriptLocked(script)
+            
+    def compileScriptLocked(self, script):
+        """Compile a script unless already compiled; the caller holds compileLock"""
+        if script in self.compiledScripts:
+            return self.compiledScripts[script]
+        
+        path = None
+        try:
+            if not self.scriptFolder:
+                self.scriptFolder = tempfile.mkdtemp(prefix='AppleMusicScripts')
+            path = os.path.join(self.scriptFolder, u"{}.scpt".format(len(self.compiledScripts)))
+            subprocess.run(['osacompile', '-o', path, '-e', script],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.debugLog(u"Could not compile script, running from source: {}".format(str(e)))
+            path = None
+        
+        self.compiledScripts[script] = path
+        return path
+            
     ########################################
     # Action Handlers
     ########################################
     
     def actionPlay(self, pluginAction, dev):
         """Play action"""
-        script = 'tell application "Music" to play'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.queueAction(dev, 'play', expect=('equals', 'playerState', 'playing'))
         
     def actionPause(self, pluginAction, dev):
         """Pause action"""
-        script = 'tell application "Music" to pause'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.queueAction(dev, 'pause', expect=('equals', 'playerState', 'paused'))
         
     def actionPlayPause(self, pluginAction, dev):
         """Play/Pause toggle action"""
-        script = 'tell application "Music" to playpause'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        # Repeated toggles cancel out in pairs
+        self.coalescer.update(dev, 'playPause', lambda count: (count or 0) + 1)
         
     def actionStop(self, pluginAction, dev):
         """Stop action"""
-        script = 'tell application "Music" to stop'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.queueAction(dev, 'stop', expect=('equals', 'playerState', 'stopped'))
         
     def actionNextTrack(self, pluginAction, dev):
         """Next track action"""
-        script = 'tell application "Music" to next track'
-        self.executeAppleScript(script)
-        time.sleep(0.5)  # Give Music time to switch tracks
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'skip', lambda count: (count or 0) + 1)
         
     def actionPreviousTrack(self, pluginAction, dev):
         """Previous track action"""
-        script = 'tell application "Music" to previous track'
-        self.executeAppleScript(script)
-        time.sleep(0.5)  # Give Music time to switch tracks
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'skip', lambda count: (count or 0) - 1)
         
     def actionSetVolume(self, pluginAction, dev):
         """Set volume action"""
         volume = int(pluginAction.props.get('volume', 50))
-        volume = max(0, min(100, volume))  # Clamp between 0-100
-        script = f'tell application "Music" to set sound volume to {volume}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: volume)
         
     def actionVolumeUp(self, pluginAction, dev):
         """Volume up action"""
         amount = int(pluginAction.props.get('amount', 10))
-        currentVolume = int(dev.states.get('soundVolume', 50))
-        newVolume = min(100, currentVolume + amount)
-        script = f'tell application "Music" to set sound volume to {newVolume}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: self.pendingOrState(pending, dev, 'soundVolume', 50) + amount)
         
     def actionVolumeDown(self, pluginAction, dev):
         """Volume down action"""
         amount = int(pluginAction.props.get('amount', 10))
-        currentVolume = int(dev.states.get('soundVolume', 50))
-        newVolume = max(0, currentVolume - amount)
-        script = f'tell application "Music" to set sound volume to {newVolume}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: self.pendingOrState(pending, dev, 'soundVolume', 50) - amount)
         
     def actionMute(self, pluginAction, dev):
         """Mute action"""
         devInfo = self.deviceDict.get(dev.id)
-        if devInfo:
-            # Store current volume
-            currentVolume = int(dev.states.get('soundVolume', 50))
-            devInfo['previousVolume'] = currentVolume
-        script = 'tell application "Music" to set sound volume to 0'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        
+        def mute(pending):
+            # Unmute restores a volume change still being coalesced, not the
+            # last one published; muting twice keeps the volume from before
+            currentVolume = self.pendingOrState(pending, dev, 'soundVolume', 50)
+            if devInfo and currentVolume:
+                devInfo['previousVolume'] = currentVolume
+            return 0
+        self.coalescer.update(dev, 'volume', mute)
         
     def actionUnmute(self, pluginAction, dev):
         """Unmute action"""
@@ -392,81 +1252,87 @@ class Plugin(indigo.PluginBase):
         previousVolume = 50  # Default
         if devInfo and devInfo.get('previousVolume'):
             previousVolume = devInfo['previousVolume']
-        script = f'tell application "Music" to set sound volume to {previousVolume}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: previousVolume)
         
     def actionSetPosition(self, pluginAction, dev):
         """Set playback position action"""
         position = int(pluginAction.props.get('position', 0))
-        script = f'tell application "Music" to set player position to {position}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'position', lambda pending: position)
         
     def actionSkipForward(self, pluginAction, dev):
         """Skip forward action"""
         seconds = int(pluginAction.props.get('seconds', 10))
-        currentPos = int(dev.states.get('playerPosition', 0))
-        newPos = currentPos + seconds
-        script = f'tell application "Music" to set player position to {newPos}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'position', lambda pending: self.pendingOrState(pending, dev, 'playerPosition', 0) + seconds)
         
     def actionSkipBackward(self, pluginAction, dev):
         """Skip backward action"""
         seconds = int(pluginAction.props.get('seconds', 10))
-        currentPos = int(dev.states.get('playerPosition', 0))
-        newPos = max(0, currentPos - seconds)
-        script = f'tell application "Music" to set player position to {newPos}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        self.coalescer.update(dev, 'position', lambda pending: self.pendingOrState(pending, dev, 'playerPosition', 0) - seconds)
         
     def actionSetShuffle(self, pluginAction, dev):
         """Set shuffle action"""
         shuffleState = pluginAction.props.get('shuffleState', 'toggle')
         
         if shuffleState == 'toggle':
-            currentShuffle = dev.states.get('shuffleEnabled', False)
-            shuffleState = 'off' if currentShuffle else 'on'
-        
-        shuffleBool = 'true' if shuffleState == 'on' else 'false'
-        script = f'tell application "Music" to set shuffle enabled to {shuffleBool}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+            # Toggle the pending value if a toggle is already waiting
+            self.coalescer.update(dev, 'shuffleEnabled', lambda pending: not self.pendingOrState(pending, dev, 'shuffleEnabled', False))
+        else:
+            self.coalescer.update(dev, 'shuffleEnabled', lambda pending: shuffleState == 'on')
         
     def actionSetRepeat(self, pluginAction, dev):
         """Set repeat action"""
         repeatState = pluginAction.props.get('repeatState', 'toggle')
         
         if repeatState == 'toggle':
-            currentRepeat = dev.states.get('songRepeat', 'off')
-            if currentRepeat == 'off':
-                repeatState = 'all'
-            elif currentRepeat == 'all':
-                repeatState = 'one'
+            # Cycle off -> all -> one from the pending mode if a change is already waiting
+            self.coalescer.update(dev, 'songRepeat', lambda pending: kNextRepeatMode.get(self.pendingOrState(pending, dev, 'songRepeat', 'off'), 'off'))
+        else:
+            self.coalescer.update(dev, 'songRepeat', lambda pending: repeatState)
+        
+    def pendingOrState(self, pending, dev, key, default):
+        """Return a pending coalesced value, or the mirrored state when nothing is pending"""
+        if pending is not None:
+            return pending
+        return self.mirrorState(dev, key, default)
+        
+    def mirrorState(self, dev, key, default):
+        """Return a state from the in-memory mirror: the value a queued command will set,
+        else the last value published, else the server's copy"""
+        devInfo = self.deviceDict.get(dev.id)
+        with self.mirrorLock:
+            if devInfo and key in devInfo['optimistic']:
+                value = devInfo['optimistic'][key]
+            elif devInfo and key in devInfo['publishedStates']:
+                value = devInfo['publishedStates'][key]
             else:
-                repeatState = 'off'
+                value = dev.states.get(key, default)
+        return type(default)(value)
         
-        script = f'tell application "Music" to set song repeat to {repeatState}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+    def sendCoalesced(self, dev, slot, value):
+        """Queue the settled value of a coalesced command burst"""
+        if slot == 'volume':
+            volume = max(0, min(100, value))
+            self.queueAction(dev, 'setVolume', volume, optimistic={'soundVolume': volume, 'muted': volume == 0})
+        elif slot == 'position':
+            self.queueAction(dev, 'setPosition', max(0, value), optimistic={'playerPosition': max(0, value)})
+        elif slot == 'skip':
+            if value > 0:
+                self.queueAction(dev, 'nextTrack', value, expect=('changes', 'persistentId'))
+            elif value < 0:
+                self.queueAction(dev, 'previousTrack', -value, expect=('changes', 'persistentId'))
+        elif slot == 'playPause':
+            if value % 2:
+                self.queueAction(dev, 'playPause', expect=('changes', 'playerState'))
+        elif slot == 'shuffleEnabled':
+            self.queueAction(dev, 'setShuffle', 'true' if value else 'false', optimistic={'shuffleEnabled': bool(value)})
+        elif slot == 'songRepeat':
+            self.queueAction(dev, 'setRepeat', value, optimistic={'songRepeat': value})
         
     def actionPlayPlaylist(self, pluginAction, dev):
         """Play playlist action"""
         playlistName = pluginAction.props.get('playlistName', '')
         if playlistName:
-            script = f'''
-            tell application "Music"
-                try
-                    play playlist "{playlistName}"
-                on error
-                    display dialog "Playlist not found: {playlistName}"
-                end try
-            end tell
-            '''
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateAppleMusicStatus(dev)
+            self.queueAction(dev, 'playPlaylist', playlistName, expect=('changes', 'persistentId'))
         
     def actionPlayAlbum(self, pluginAction, dev):
         """Play album action"""
@@ -474,61 +1340,25 @@ class Plugin(indigo.PluginBase):
         artistName = pluginAction.props.get('artistName', '')
         
         if albumName:
-            if artistName:
-                script = f'''
-                tell application "Music"
-                    try
-                        set theAlbum to first track of library whose album is "{albumName}" and artist is "{artistName}"
-                        play theAlbum
-                    on error
-                        display dialog "Album not found: {albumName} by {artistName}"
-                    end try
-                end tell
-                '''
-            else:
-                script = f'''
-                tell application "Music"
-                    try
-                        set theAlbum to first track of library whose album is "{albumName}"
-                        play theAlbum
-                    on error
-                        display dialog "Album not found: {albumName}"
-                    end try
-                end tell
-                '''
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateAppleMusicStatus(dev)
+            self.queueAction(dev, 'playAlbum', albumName, artistName, expect=('changes', 'persistentId'))
         
     def actionSearchAndPlay(self, pluginAction, dev):
         """Search and play action"""
         searchQuery = pluginAction.props.get('searchQuery', '')
         if searchQuery:
-            script = f'''
-            tell application "Music"
-                try
-                    set searchResults to (search library for "{searchQuery}")
-                    if (count of searchResults) > 0 then
-                        play item 1 of searchResults
-                    else
-                        display dialog "No results found for: {searchQuery}"
-                    end if
-                on error
-                    display dialog "Search failed for: {searchQuery}"
-                end try
-            end tell
-            '''
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateAppleMusicStatus(dev)
+            self.queueAction(dev, 'searchAndPlay', searchQuery, expect=('changes', 'persistentId'))
     
     def actionSetRating(self, pluginAction, dev):
         """Set rating action"""
         rating = int(pluginAction.props.get('rating', 0))
-        script = f'tell application "Music" to set rating of current track to {rating}'
-        self.executeAppleScript(script)
-        self.updateAppleMusicStatus(dev)
+        
+        def discardMetadata():
+            # The cached metadata holds the old rating
+            devInfo = self.deviceDict.get(dev.id)
+            if devInfo:
+                self.metadataCache.discard(devInfo['persistentId'])
+        self.queueAction(dev, 'setRating', rating, after=discardMetadata)
         
     def actionUpdateNow(self, pluginAction, dev):
         """Force immediate update"""
-        self.updateAppleMusicStatus(dev)
+        self.requestRefresh(dev)
@@ -7,6 +7,34 @@ Provides unified control over Spotify and Apple Music with automatic mutual excl
 
 import indigo
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# Seconds between full state pushes; in between only changed states are sent
+kFullResyncInterval = 60
+
+# States that change every poll; their variables are written at most this often (seconds)
+kHighChurnVariables = ('playerPosition', 'playerPositionFormatted', 'progressPercent')
+kHighChurnVariableInterval = 5
+
+# Source plugins and the states the manager derives its own states from;
+# an update to any other state of a source device is ignored
+kSourcePluginIds = ('com.indigodomo.spotify', 'com.indigodomo.applemusic', 'com.indigodomo.vlc')
+kWatchedStates = ('isPlaying', 'isPaused', 'isStopped', 'trackName', 'mediaName', 'artist', 'album',
+                  'playerPosition', 'playerPositionFormatted', 'currentTime', 'currentTimeFormatted',
+                  'duration', 'durationFormatted', 'progressPercent', 'soundVolume', 'audioVolume')
+
+# Managers are updated from source device changes; this slow pass only
+# catches anything missed (e.g. a source device replaced while disabled)
+kSafetyInterval = 30
+
+# Service name -> pluginProps key of the manager's source device for that service
+kSourceProps = (('spotify', 'spotifyDeviceId'), ('applemusic', 'appleMusicDeviceId'), ('vlc', 'vlcDeviceId'))
+
+# Stop and switch actions send their commands to all services at once;
+# the handler waits at most kFanOutDeadline seconds for all of them
+kFanOutWorkers = 3
+kFanOutDeadline = 2.0
 
 
 class Plugin(indigo.PluginBase):
@@ -16,14 +44,21 @@ class Plugin(indigo.PluginBase):
         super(Plugin, self).__init__(pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
         self.debug = pluginPrefs.get("showDebugInfo", False)
         self.deviceDict = {}
+        self.sourceIndex = {}   # source device ID -> IDs of the managers using it
+        self.sourceDevices = {}   # source device ID -> latest copy, kept current by deviceUpdated
+        self.deviceLists = {}   # plugin ID -> cached (id, name) list for the device pickers
+        self.updateLock = threading.RLock()
+        self.actionPool = ThreadPoolExecutor(max_workers=kFanOutWorkers)
         
     def startup(self):
         """Called when plugin starts"""
         self.debugLog(u"Music Manager Plugin startup called")
+        indigo.devices.subscribeToChanges()
         
     def shutdown(self):
         """Called when plugin shuts down"""
         self.debugLog(u"Music Manager Plugin shutdown called")
+        self.actionPool.shutdown(wait=False)
     
     ########################################
     # ConfigUI Methods
@@ -31,37 +66,36 @@ class Plugin(indigo.PluginBase):
     
     def getSpotifyDeviceList(self, filter="", valuesDict=None, typeId="", targetId=0):
         """Return list of Spotify devices"""
-        self.debugLog(u"getSpotifyDeviceList called")
-        deviceList = []
-        for dev in indigo.devices.iter():
-            self.debugLog(u"Checking device: {} with pluginId: {}".format(dev.name, dev.pluginId))
-            if dev.pluginId == "com.indigodomo.spotify":
-                self.debugLog(u"Found Spotify device: {}".format(dev.name))
-                deviceList.append((dev.id, dev.name))
-        self.debugLog(u"Returning {} Spotify devices".format(len(deviceList)))
-        return deviceList
+        return self.getDeviceList("com.indigodomo.spotify", u"Spotify")
     
     def getAppleMusicDeviceList(self, filter="", valuesDict=None, typeId="", targetId=0):
         """Return list of Apple Music devices"""
-        self.debugLog(u"getAppleMusicDeviceList called")
-        deviceList = []
-        for dev in indigo.devices.iter():
-            if dev.pluginId == "com.indigodomo.applemusic":
-                self.debugLog(u"Found Apple Music device: {}".format(dev.name))
-                deviceList.append((dev.id, dev.name))
-        self.debugLog(u"Returning {} Apple Music devices".format(len(deviceList)))
-        return deviceList
+        return self.getDeviceList("com.indigodomo.applemusic", u"Apple Music")
     
     def getVLCDeviceList(self, filter="", valuesDict=None, typeId="", targetId=0):
         """Return list of VLC devices"""
-        self.debugLog(u"getVLCDeviceList called")
-        deviceList = []
-        for dev in indigo.devices.iter():
-            if dev.pluginId == "com.indigodomo.vlc":
-                self.debugLog(u"Found VLC device: {}".format(dev.name))
-                deviceList.append((dev.id, dev.name))
-        self.debugLog(u"Returning {} VLC devices".format(len(deviceList)))
-        return deviceList
+        return self.getDeviceList("com.indigodomo.vlc", u"VLC")
+    
+    def getDeviceList(self, pluginId, label):
+        """Return (id, name) pairs for a plugin's devices, cached until one is created, deleted or renamed"""
+        deviceList = self.deviceLists.get(pluginId)
+        if deviceList is None:
+            deviceList = [(dev.id, dev.name) for dev in indigo.devices.iter(pluginId)]
+            self.deviceLists[pluginId] = deviceList
+            if self.debug:
+                self.debugLog(u"Found {} {} devices".format(len(deviceList), label))
+        return list(deviceList)
+    
+    def deviceCreated(self, dev):
+        """Drop the cached device list for the new device's plugin"""
+        super(Plugin, self).deviceCreated(dev)
+        self.deviceLists.pop(dev.pluginId, None)
+        
+    def deviceDeleted(self, dev):
+        """Drop the cached device list for the deleted device's plugin"""
+        super(Plugin, self).deviceDeleted(dev)
+        self.deviceLists.pop(dev.pluginId, None)
+        self.sourceDevices.pop(dev.id, None)
         
     def deviceStartComm(self, dev):
         """Called when device communication starts"""
@@ -70,12 +104,18 @@ class Plugin(indigo.PluginBase):
         # Store device info
         self.deviceDict[dev.id] = {
             'device': dev,
+            'config': self.readConfig(dev),
             'lastActiveService': None,
             'lastSpotifyState': False,
             'lastAppleMusicState': False,
-            'lastVLCState': False
+            'lastVLCState': False,
+            'variables': None,
+            'publishedStates': {},
+            'lastFullSync': 0
         }
         
+        self.rebuildSourceIndex()
+        
         # Do initial update
         self.updateMusicStatus(dev)
         
@@ -84,86 +124,159 @@ class Plugin(indigo.PluginBase):
         self.debugLog(u"Stopping device: " + dev.name)
         if dev.id in self.deviceDict:
             del self.deviceDict[dev.id]
+            self.rebuildSourceIndex()
+            
+    def readConfig(self, dev):
+        """Snapshot the manager's settings, with source device IDs parsed once"""
+        config = {
+            'autoExclusive': dev.pluginProps.get('autoExclusive', True),
+            'preferredService': dev.pluginProps.get('preferredService', 'last'),
+            'updateVariables': dev.pluginProps.get('updateVariables', False)
+        }
+        for service, key in kSourceProps:
+            deviceId = dev.pluginProps.get(key, '')
+            try:
+                config[service] = int(deviceId) if deviceId else 0
+            except (TypeError, ValueError):
+                # A stale or garbled selection counts as no device
+                self.errorLog(u"Invalid {} setting on {}: {}".format(key, dev.name, deviceId))
+                config[service] = 0
+        return config
+        
+    def rebuildSourceIndex(self):
+        """Rebuild the source device ID -> manager IDs index from the config snapshots"""
+        sourceIndex = {}
+        for devId, devInfo in list(self.deviceDict.items()):
+            for service, key in kSourceProps:
+                sourceId = devInfo['config'][service]
+                if sourceId:
+                    sourceIndex.setdefault(sourceId, set()).add(devId)
+        self.sourceIndex = sourceIndex
+        
+    def deviceUpdated(self, origDev, newDev):
+        """Recompute the managers using a source device when one of its watched states changes"""
+        super(Plugin, self).deviceUpdated(origDev, newDev)
+        # Every device change in the database arrives here; most are dropped
+        # by plugin ID before anything else is looked at
+        if newDev.pluginId not in kSourcePluginIds and newDev.pluginId != self.pluginId:
+            return
+        if origDev.name != newDev.name:
+            self.deviceLists.pop(newDev.pluginId, None)
+        
+        if newDev.pluginId == self.pluginId:
+            # A manager's own state updates are ignored; config edits refresh its snapshot
+            devInfo = self.deviceDict.get(newDev.id)
+            if devInfo and origDev.pluginProps != newDev.pluginProps:
+                devInfo['device'] = newDev
+                devInfo['config'] = self.readConfig(newDev)
+                devInfo['variables'] = None
+                self.rebuildSourceIndex()
+                self.updateMusicStatus(newDev)
+            return
+        
+        managerIds = self.sourceIndex.get(newDev.id)
+        if not managerIds:
+            return
+        
+        # Managers read the changed device from here instead of fetching it again
+        self.sourceDevices[newDev.id] = newDev
+        if all(origDev.states.get(key) == newDev.states.get(key) for key in kWatchedStates):
+            return
+        
+        for managerId in list(managerIds):
+            devInfo = self.deviceDict.get(managerId)
+            if devInfo:
+                self.updateMusicStatus(devInfo['device'])
             
     def runConcurrentThread(self):
-        """Main plugin loop - monitors music players and enforces exclusivity"""
+        """Safety loop - managers are normally updated from deviceUpdated"""
         try:
             while True:
+                self.sleep(kSafetyInterval)
+                
+                # Fetch every source device again in case an update was missed
+                self.sourceDevices = {}
                 for devId, devInfo in list(self.deviceDict.items()):
                     dev = devInfo['device']
                     self.updateMusicStatus(dev)
                 
-                self.sleep(0.5)  # Update every 0.5 seconds
-                
         except self.StopThread:
             pass
             
     def updateMusicStatus(self, dev):
         """Update unified music status from all services"""
+        with self.updateLock:
+            self.updateMusicStatusLocked(dev)
+            
+    def updateMusicStatusLocked(self, dev):
+        """Update unified music status; the caller holds updateLock"""
         try:
-            # Get configured device IDs - handle empty strings
-            spotifyDeviceId = dev.pluginProps.get('spotifyDeviceId', '')
-            appleMusicDeviceId = dev.pluginProps.get('appleMusicDeviceId', '')
-            vlcDeviceId = dev.pluginProps.get('vlcDeviceId', '')
+            devInfo = self.deviceDict.get(dev.id)
+            if devInfo is None:
+                return
             
-            # Convert to int only if not empty
-            spotifyDeviceId = int(spotifyDeviceId) if spotifyDeviceId else 0
-            appleMusicDeviceId = int(appleMusicDeviceId) if appleMusicDeviceId else 0
-            vlcDeviceId = int(vlcDeviceId) if vlcDeviceId else 0
+            # Configured device IDs, parsed when the device started
+            config = devInfo['config']
+            spotifyDeviceId = config['spotify']
+            appleMusicDeviceId = config['applemusic']
+            vlcDeviceId = config['vlc']
             
             if not spotifyDeviceId and not appleMusicDeviceId and not vlcDeviceId:
                 self.debugLog(u"No devices configured for Music Manager")
                 return
             
             # Get the actual devices
-            spotifyDev = indigo.devices.get(spotifyDeviceId) if spotifyDeviceId else None
-            appleMusicDev = indigo.devices.get(appleMusicDeviceId) if appleMusicDeviceId else None
-            vlcDev = indigo.devices.get(vlcDeviceId) if vlcDeviceId else None
+            spotifyDev = self.getSourceDevice(spotifyDeviceId)
+            appleMusicDev = self.getSourceDevice(appleMusicDeviceId)
+            vlcDev = self.getSourceDevice(vlcDeviceId)
             
             # Get playing states
             spotifyPlaying = spotifyDev.states.get('isPlaying', False) if spotifyDev else False
             appleMusicPlaying = appleMusicDev.states.get('isPlaying', False) if appleMusicDev else False
             vlcPlaying = vlcDev.states.get('isPlaying', False) if vlcDev else False
             
-            devInfo = self.deviceDict.get(dev.id)
-            
             # Check if states changed
             spotifyJustStarted = spotifyPlaying and not devInfo['lastSpotifyState']
             appleMusicJustStarted = appleMusicPlaying and not devInfo['lastAppleMusicState']
             vlcJustStarted = vlcPlaying and not devInfo['lastVLCState']
             
-            # Auto-exclusive logic
-            if dev.pluginProps.get('autoExclusive', True):
+            # Auto-exclusive logic; the pauses are sent from the action pool
+            # so this never waits on the other plugins
+            pauseDevices = []
+            if config['autoExclusive']:
                 if spotifyJustStarted:
                     if appleMusicPlaying and appleMusicDev:
                         self.debugLog(u"Spotify started - pausing Apple Music")
-                        self.executeDeviceAction(appleMusicDev, 'pause')
+                        pauseDevices.append(appleMusicDev)
                         appleMusicPlaying = False
                     if vlcPlaying and vlcDev:
                         self.debugLog(u"Spotify started - pausing VLC")
-                        self.executeDeviceAction(vlcDev, 'pause')
+                        pauseDevices.append(vlcDev)
                         vlcPlaying = False
                     
                 elif appleMusicJustStarted:
                     if spotifyPlaying and spotifyDev:
                         self.debugLog(u"Apple Music started - pausing Spotify")
-                        self.executeDeviceAction(spotifyDev, 'pause')
+                        pauseDevices.append(spotifyDev)
                         spotifyPlaying = False
                     if vlcPlaying and vlcDev:
                         self.debugLog(u"Apple Music started - pausing VLC")
-                        self.executeDeviceAction(vlcDev, 'pause')
+                        pauseDevices.append(vlcDev)
                         vlcPlaying = False
                 
                 elif vlcJustStarted:
                     if spotifyPlaying and spotifyDev:
                         self.debugLog(u"VLC started - pausing Spotify")
-                        self.executeDeviceAction(spotifyDev, 'pause')
+                        pauseDevices.append(spotifyDev)
                         spotifyPlaying = False
                     if appleMusicPlaying and appleMusicDev:
                         self.debugLog(u"VLC started - pausing Apple Music")
-                        self.executeDeviceAction(appleMusicDev, 'pause')
+                        pauseDevices.append(appleMusicDev)
                         appleMusicPlaying = False
             
+            if pauseDevices:
+                self.executeDeviceActions(pauseDevices, 'pause', waitForAll=False)
+            
             # Update last states
             devInfo['lastSpotifyState'] = spotifyPlaying
             devInfo['lastAppleMusicState'] = appleMusicPlaying
@@ -187,7 +300,7 @@ class Plugin(indigo.PluginBase):
                 devInfo['lastActiveService'] = 'vlc'
             else:
                 # Nothing playing - use last active or preference
-                preferredService = dev.pluginProps.get('preferredService', 'last')
+                preferredService = config['preferredService']
                 if preferredService == 'spotify' and spotifyDev:
                     activeService = "spotify"
                     activeDevice = spotifyDev
@@ -298,58 +411,178 @@ class Plugin(indigo.PluginBase):
                 stateList.append({'key': 'status', 'value': status})
             
             # Update all states
-            dev.updateStatesOnServer(stateList)
+            self.publishStates(dev, stateList)
             
             # Update variables if enabled
-            if dev.pluginProps.get('updateVariables', False):
+            if config['updateVariables']:
                 self.updateVariables(dev, stateList)
                 
         except Exception as e:
             self.errorLog(u"Exception in updateMusicStatus: {}".format(str(e)))
             
+    def publishStates(self, dev, stateList):
+        """Send only the states that changed since the last update, with a periodic full resync"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo is None:
+            dev.updateStatesOnServer(stateList)
+            return stateList
+        
+        published = devInfo['publishedStates']
+        now = time.time()
+        if now - devInfo['lastFullSync'] >= kFullResyncInterval:
+            changed = stateList
+            devInfo['lastFullSync'] = now
+        else:
+            changed = [state for state in stateList
+                       if state['key'] not in published or published[state['key']] != state['value']]
+        
+        if changed:
+            dev.updateStatesOnServer(changed)
+            for state in changed:
+                published[state['key']] = state['value']
+        return changed
+            
     def updateVariables(self, dev, stateList):
-        """Update Indigo variables with current states"""
+        """Update Indigo variables with current states, writing only values that changed"""
         try:
-            prefix = dev.pluginProps.get('variablePrefix', 'Music')
+            devInfo = self.deviceDict.get(dev.id)
+            if devInfo is None:
+                return
+            
+            variables = devInfo['variables']
+            if variables is None:
+                variables = devInfo['variables'] = {
+                    'prefix': dev.pluginProps.get('variablePrefix', 'Music'),
+                    'useFolder': dev.pluginProps.get('variableFolder', False),
+                    'folderId': None,
+                    'names': {},       # state key -> variable name
+                    'ids': {},         # variable name -> variable ID
+                    'values': {},      # variable name -> last written value
+                    'writeTimes': {}   # variable name -> time of last write
+                }
             
+            now = time.time()
             for state in stateList:
-                varName = prefix + state['key'][0].upper() + state['key'][1:]
+                varName = variables['names'].get(state['key'])
+                if varName is None:
+                    varName = variables['prefix'] + state['key'][0].upper() + state['key'][1:]
+                    variables['names'][state['key']] = varName
                 
-                # Create variable if it doesn't exist
-                if varName not in indigo.variables:
-                    indigo.variable.create(varName, value=str(state['value']), folder=0)
-                else:
-                    indigo.variable.updateValue(varName, value=str(state['value']))
+                varValue = str(state['value'])
+                if variables['values'].get(varName) == varValue:
+                    continue
+                
+                # Fast-moving values are written at most once per interval; the
+                # latest value goes out on the first poll after the interval
+                if (state['key'] in kHighChurnVariables and
+                        now - variables['writeTimes'].get(varName, 0) < kHighChurnVariableInterval):
+                    continue
+                
+                try:
+                    self.writeVariable(variables, varName, varValue)
+                    variables['values'][varName] = varValue
+                    variables['writeTimes'][varName] = now
+                except Exception as e:
+                    # Variable was probably deleted - resolve it again next time
+                    variables['ids'].pop(varName, None)
+                    self.errorLog(u"Exception updating variable {}: {}".format(varName, str(e)))
                     
         except Exception as e:
             self.errorLog(u"Exception in updateVariables: {}".format(str(e)))
-    
+            
+    def writeVariable(self, variables, varName, varValue):
+        """Write a variable by cached ID, creating or filing it (and its folder) on first use"""
+        varId = variables['ids'].get(varName)
+        if varId is None:
+            folderId = self.getVariableFolderId(variables)
+            if varName in indigo.variables:
+                var = indigo.variables[varName]
+                # Variables created before the folder option was enabled move into the folder
+                if variables['useFolder'] and var.folderId != folderId:
+                    indigo.variable.moveToFolder(var, value=folderId)
+                varId = var.id
+            else:
+                var = indigo.variable.create(varName, value=varValue, folder=folderId)
+                variables['ids'][varName] = var.id
+                return
+            variables['ids'][varName] = varId
+        
+        indigo.variable.updateValue(varId, value=varValue)
+        
+    def getVariableFolderId(self, variables):
+        """Return the folder for new variables, creating the device's folder once if enabled"""
+        if not variables['useFolder']:
+            return 0
+        
+        if variables['folderId'] is None:
+            folderName = variables['prefix']
+            if folderName in indigo.variables.folders:
+                variables['folderId'] = indigo.variables.folders[folderName].id
+            else:
+                variables['folderId'] = indigo.variables.folder.create(folderName).id
+                self.debugLog(u"Created variable folder {}".format(folderName))
+        return variables['folderId']
+            
+    def getConfig(self, dev):
+        """Return the manager's config snapshot, reading it from pluginProps if the device is not started"""
+        devInfo = self.deviceDict.get(dev.id)
+        return devInfo['config'] if devInfo else self.readConfig(dev)
+        
     def getActiveDevice(self, dev):
         """Get the currently active music device"""
         activeService = dev.states.get('activeService', 'none')
+        config = self.getConfig(dev)
         
-        deviceId = 0
-        if activeService == 'spotify':
-            deviceIdStr = dev.pluginProps.get('spotifyDeviceId', '')
-            deviceId = int(deviceIdStr) if deviceIdStr else 0
-        elif activeService == 'applemusic':
-            deviceIdStr = dev.pluginProps.get('appleMusicDeviceId', '')
-            deviceId = int(deviceIdStr) if deviceIdStr else 0
-        elif activeService == 'vlc':
-            deviceIdStr = dev.pluginProps.get('vlcDeviceId', '')
-            deviceId = int(deviceIdStr) if deviceIdStr else 0
+        if activeService in ('spotify', 'applemusic', 'vlc'):
+            deviceId = config[activeService]
         else:
             # Default to first available
-            deviceIdStr = dev.pluginProps.get('spotifyDeviceId', '')
-            deviceId = int(deviceIdStr) if deviceIdStr else 0
-            if not deviceId:
-                deviceIdStr = dev.pluginProps.get('appleMusicDeviceId', '')
-                deviceId = int(deviceIdStr) if deviceIdStr else 0
-            if not deviceId:
-                deviceIdStr = dev.pluginProps.get('vlcDeviceId', '')
-                deviceId = int(deviceIdStr) if deviceIdStr else 0
-        
-        return indigo.devices.get(deviceId) if deviceId else None
+            deviceId = config['spotify'] or config['applemusic'] or config['vlc']
+        
+        return self.getSourceDevice(deviceId)
+    
+    def getSourceDevices(self, dev, services):
+        """Return the manager's configured devices for the given services"""
+        config = self.getConfig(dev)
+        devices = []
+        for service in services:
+            sourceDev = self.getSourceDevice(config[service])
+            if sourceDev:
+                devices.append(sourceDev)
+        return devices
+    
+    def getSourceDevice(self, deviceId):
+        """Return a source device, from the cache if a started manager uses it (deviceUpdated keeps those current)"""
+        if not deviceId:
+            return None
+        sourceDev = self.sourceDevices.get(deviceId)
+        if sourceDev is None:
+            sourceDev = indigo.devices.get(deviceId)
+            if sourceDev is not None and deviceId in self.sourceIndex:
+                self.sourceDevices[deviceId] = sourceDev
+        return sourceDev
+    
+    def executeDeviceActions(self, targetDevices, actionName, waitForAll=True):
+        """Execute an action on several devices concurrently
+        
+        With waitForAll, block until all of them are done, up to a shared
+        deadline; otherwise return as soon as they are queued on the action pool.
+        """
+        if not waitForAll:
+            for targetDevice in targetDevices:
+                self.actionPool.submit(self.executeDeviceAction, targetDevice, actionName)
+            return
+        
+        if len(targetDevices) < 2:
+            for targetDevice in targetDevices:
+                self.executeDeviceAction(targetDevice, actionName)
+            return
+        
+        futures = {self.actionPool.submit(self.executeDeviceAction, targetDevice, actionName): targetDevice
+                   for targetDevice in targetDevices}
+        done, notDone = wait(futures, timeout=kFanOutDeadline)
+        for future in notDone:
+            self.errorLog(u"Timed out sending {} to {}".format(actionName, futures[future].name))
     
     def executeDeviceAction(self, targetDevice, actionName, props=None):
         """Execute an action on a target device"""
@@ -376,191 +609,102 @@ class Plugin(indigo.PluginBase):
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'play')
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionPause(self, pluginAction, dev):
         """Pause action - pauses active service"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'pause')
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionPlayPause(self, pluginAction, dev):
         """Play/Pause toggle - toggles active service"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'playpause')
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionStop(self, pluginAction, dev):
         """Stop action - stops all services"""
-        spotifyDeviceIdStr = dev.pluginProps.get('spotifyDeviceId', '')
-        appleMusicDeviceIdStr = dev.pluginProps.get('appleMusicDeviceId', '')
-        vlcDeviceIdStr = dev.pluginProps.get('vlcDeviceId', '')
-        
-        spotifyDeviceId = int(spotifyDeviceIdStr) if spotifyDeviceIdStr else 0
-        appleMusicDeviceId = int(appleMusicDeviceIdStr) if appleMusicDeviceIdStr else 0
-        vlcDeviceId = int(vlcDeviceIdStr) if vlcDeviceIdStr else 0
-        
-        if spotifyDeviceId:
-            spotifyDev = indigo.devices.get(spotifyDeviceId)
-            if spotifyDev:
-                self.executeDeviceAction(spotifyDev, 'stop')
-        
-        if appleMusicDeviceId:
-            appleMusicDev = indigo.devices.get(appleMusicDeviceId)
-            if appleMusicDev:
-                self.executeDeviceAction(appleMusicDev, 'stop')
-        
-        if vlcDeviceId:
-            vlcDev = indigo.devices.get(vlcDeviceId)
-            if vlcDev:
-                self.executeDeviceAction(vlcDev, 'stop')
-        
-        time.sleep(0.2)
-        self.updateMusicStatus(dev)
+        self.executeDeviceActions(self.getSourceDevices(dev, ('spotify', 'applemusic', 'vlc')), 'stop')
         
     def actionNextTrack(self, pluginAction, dev):
         """Next track action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'nextTrack')
-            time.sleep(0.5)
-            self.updateMusicStatus(dev)
         
     def actionPreviousTrack(self, pluginAction, dev):
         """Previous track action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'previousTrack')
-            time.sleep(0.5)
-            self.updateMusicStatus(dev)
         
     def actionSetVolume(self, pluginAction, dev):
         """Set volume action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'setVolume', pluginAction.props)
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionVolumeUp(self, pluginAction, dev):
         """Volume up action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'volumeUp', pluginAction.props)
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionVolumeDown(self, pluginAction, dev):
         """Volume down action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'volumeDown', pluginAction.props)
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionMute(self, pluginAction, dev):
         """Mute action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'mute')
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionUnmute(self, pluginAction, dev):
         """Unmute action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'unmute')
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionSwitchToSpotify(self, pluginAction, dev):
         """Switch to Spotify"""
-        spotifyDeviceIdStr = dev.pluginProps.get('spotifyDeviceId', '')
-        appleMusicDeviceIdStr = dev.pluginProps.get('appleMusicDeviceId', '')
-        vlcDeviceIdStr = dev.pluginProps.get('vlcDeviceId', '')
-        
-        spotifyDeviceId = int(spotifyDeviceIdStr) if spotifyDeviceIdStr else 0
-        appleMusicDeviceId = int(appleMusicDeviceIdStr) if appleMusicDeviceIdStr else 0
-        vlcDeviceId = int(vlcDeviceIdStr) if vlcDeviceIdStr else 0
-        
         if pluginAction.props.get('pauseOther', True):
-            if appleMusicDeviceId:
-                appleMusicDev = indigo.devices.get(appleMusicDeviceId)
-                if appleMusicDev:
-                    self.executeDeviceAction(appleMusicDev, 'pause')
-            if vlcDeviceId:
-                vlcDev = indigo.devices.get(vlcDeviceId)
-                if vlcDev:
-                    self.executeDeviceAction(vlcDev, 'pause')
+            self.executeDeviceActions(self.getSourceDevices(dev, ('applemusic', 'vlc')), 'pause')
         
         # Update last active service
         devInfo = self.deviceDict.get(dev.id)
         if devInfo:
             devInfo['lastActiveService'] = 'spotify'
         
-        time.sleep(0.2)
+        # Source devices report their own changes; only lastActiveService changed here
         self.updateMusicStatus(dev)
         
     def actionSwitchToAppleMusic(self, pluginAction, dev):
         """Switch to Apple Music"""
-        spotifyDeviceIdStr = dev.pluginProps.get('spotifyDeviceId', '')
-        appleMusicDeviceIdStr = dev.pluginProps.get('appleMusicDeviceId', '')
-        vlcDeviceIdStr = dev.pluginProps.get('vlcDeviceId', '')
-        
-        spotifyDeviceId = int(spotifyDeviceIdStr) if spotifyDeviceIdStr else 0
-        appleMusicDeviceId = int(appleMusicDeviceIdStr) if appleMusicDeviceIdStr else 0
-        vlcDeviceId = int(vlcDeviceIdStr) if vlcDeviceIdStr else 0
-        
         if pluginAction.props.get('pauseOther', True):
-            if spotifyDeviceId:
-                spotifyDev = indigo.devices.get(spotifyDeviceId)
-                if spotifyDev:
-                    self.executeDeviceAction(spotifyDev, 'pause')
-            if vlcDeviceId:
-                vlcDev = indigo.devices.get(vlcDeviceId)
-                if vlcDev:
-                    self.executeDeviceAction(vlcDev, 'pause')
+            self.executeDeviceActions(self.getSourceDevices(dev, ('spotify', 'vlc')), 'pause')
         
         # Update last active service
         devInfo = self.deviceDict.get(dev.id)
         if devInfo:
             devInfo['lastActiveService'] = 'applemusic'
         
-        time.sleep(0.2)
+        # Source devices report their own changes; only lastActiveService changed here
         self.updateMusicStatus(dev)
     
     def actionSwitchToVLC(self, pluginAction, dev):
         """Switch to VLC"""
-        spotifyDeviceIdStr = dev.pluginProps.get('spotifyDeviceId', '')
-        appleMusicDeviceIdStr = dev.pluginProps.get('appleMusicDeviceId', '')
-        vlcDeviceIdStr = dev.pluginProps.get('vlcDeviceId', '')
-        
-        spotifyDeviceId = int(spotifyDeviceIdStr) if spotifyDeviceIdStr else 0
-        appleMusicDeviceId = int(appleMusicDeviceIdStr) if appleMusicDeviceIdStr else 0
-        vlcDeviceId = int(vlcDeviceIdStr) if vlcDeviceIdStr else 0
-        
         if pluginAction.props.get('pauseOther', True):
-            if spotifyDeviceId:
-                spotifyDev = indigo.devices.get(spotifyDeviceId)
-                if spotifyDev:
-                    self.executeDeviceAction(spotifyDev, 'pause')
-            if appleMusicDeviceId:
-                appleMusicDev = indigo.devices.get(appleMusicDeviceId)
-                if appleMusicDev:
-                    self.executeDeviceAction(appleMusicDev, 'pause')
+            self.executeDeviceActions(self.getSourceDevices(dev, ('spotify', 'applemusic')), 'pause')
         
         # Update last active service
         devInfo = self.deviceDict.get(dev.id)
         if devInfo:
             devInfo['lastActiveService'] = 'vlc'
         
-        time.sleep(0.2)
+        # Source devices report their own changes; only lastActiveService changed here
         self.updateMusicStatus(dev)
         
     def actionSetShuffle(self, pluginAction, dev):
@@ -568,32 +712,24 @@ class Plugin(indigo.PluginBase):
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'setShuffle', pluginAction.props)
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionSetRepeat(self, pluginAction, dev):
         """Set repeat action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'setRepeat', pluginAction.props)
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionSkipForward(self, pluginAction, dev):
         """Skip forward action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'skipForward', pluginAction.props)
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionSkipBackward(self, pluginAction, dev):
         """Skip backward action"""
         activeDevice = self.getActiveDevice(dev)
         if activeDevice:
             self.executeDeviceAction(activeDevice, 'skipBackward', pluginAction.props)
-            time.sleep(0.2)
-            self.updateMusicStatus(dev)
         
     def actionUpdateNow(self, pluginAction, dev):
         """Force immediate update"""
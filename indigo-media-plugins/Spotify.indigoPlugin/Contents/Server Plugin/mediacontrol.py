@@ -0,0 +1,747 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Helpers shared by the Spotify, Apple Music and VLC plugins: the persistent
+script worker, the AppleScript record parser, the circuit breaker, the poll
+scheduler, the action worker, command coalescing and notification reading.
+
+This file is the single source; every plugin bundle ships a copy next to its
+plugin.py. Edit it here and run python shared/vendor.py to update the copies.
+"""
+
+import hashlib
+import heapq
+import itertools
+import json
+import queue
+import re
+import select
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+
+# A worker that keeps dying is left alone this long (seconds) and calls fall
+# back to one-shot osascript meanwhile
+kScriptRunnerRetryDelay = 30
+
+# Every script call is killed after kScriptTimeout seconds. After
+# kBreakerThreshold timeouts in a row, calls are suspended; one trial call is
+# let through after a backoff that doubles on each failed trial, from
+# kBreakerBaseDelay up to kBreakerMaxDelay seconds
+kScriptTimeout = 10.0
+kBreakerThreshold = 3
+kBreakerBaseDelay = 5
+kBreakerMaxDelay = 300
+
+# Seconds before an exited notification observer is started again
+kNotificationRestartDelay = 10
+
+# A coalesced command is held back for at most this many debounce windows
+kMaxDebounceWindows = 4
+
+# JavaScript for Automation worker that stays alive for the lifetime of the
+# plugin. It reads one JSON request per line on stdin, compiles each AppleScript
+# once (keyed by the request's "key"), runs it and writes one JSON reply per line
+# on stdout with the same display text osascript would have printed.
+kScriptRunnerSource = r'''
+ObjC.import('Foundation');
+ObjC.import('OSAKit');
+
+function run(argv) {
+    var stdin = $.NSFileHandle.fileHandleWithStandardInput;
+    var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+    var newline = $('\n').dataUsingEncoding($.NSUTF8StringEncoding);
+    var pending = $.NSMutableData.data;
+    var compiled = {};
+
+    function errorMessage(info) {
+        if (!info || info.isNil()) {
+            return 'unknown error';
+        }
+        var message = info.objectForKey($.OSAScriptErrorMessageKey);
+        return message.isNil() ? JSON.stringify(ObjC.deepUnwrap(info)) : message.js;
+    }
+
+    function handle(request) {
+        var script = compiled[request.key];
+        if (!script) {
+            if (!request.source) {
+                return {id: request.id, ok: false, error: 'unknown script ' + request.key};
+            }
+            var language = $.OSALanguage.languageForName(request.language || 'AppleScript');
+            script = $.OSAScript.alloc.initWithSourceLanguage($(request.source), language);
+            var compileError = Ref();
+            if (!script.compileAndReturnError(compileError)) {
+                return {id: request.id, ok: false, error: errorMessage(compileError[0])};
+            }
+            compiled[request.key] = script;
+        }
+        var runError = Ref();
+        if (request.args) {
+            // Send a run event carrying the arguments, as osascript does for "on run argv"
+            var result = script.executeAppleEventError(runEvent(request.args), runError);
+            if (result.isNil()) {
+                return {id: request.id, ok: false, error: errorMessage(runError[0])};
+            }
+            return {id: request.id, ok: true, output: script.richTextFromDescriptor(result).string.js};
+        }
+        var display = Ref();
+        var result = script.executeAndReturnDisplayValueError(display, runError);
+        if (result.isNil()) {
+            return {id: request.id, ok: false, error: errorMessage(runError[0])};
+        }
+        return {id: request.id, ok: true, output: display[0].isNil() ? '' : display[0].string.js};
+    }
+
+    function runEvent(args) {
+        var argv = $.NSAppleEventDescriptor.listDescriptor;
+        args.forEach(function (arg, index) {
+            argv.insertDescriptorAtIndex($.NSAppleEventDescriptor.descriptorWithString($(String(arg))), index + 1);
+        });
+        // kCoreEventClass / kAEOpenApplication with the argument list as the direct object
+        var event = $.NSAppleEventDescriptor.appleEventWithEventClassEventIDTargetDescriptorReturnIDTransactionID(
+            0x61657674, 0x6f617070, $.NSAppleEventDescriptor.nullDescriptor, -1, 0);
+        event.setParamDescriptorForKeyword(argv, 0x2d2d2d2d);
+        return event;
+    }
+
+    function reply(response) {
+        var text = $(JSON.stringify(response) + '\n');
+        stdout.writeData(text.dataUsingEncoding($.NSUTF8StringEncoding));
+    }
+
+    while (true) {
+        var chunk = stdin.availableData;
+        if (chunk.length == 0) {
+            break;
+        }
+        pending.appendData(chunk);
+        while (true) {
+            var found = pending.rangeOfDataOptionsRange(newline, 0, $.NSMakeRange(0, pending.length));
+            if (found.length == 0) {
+                break;
+            }
+            var lineData = pending.subdataWithRange($.NSMakeRange(0, found.location));
+            var rest = found.location + 1;
+            pending = $.NSMutableData.dataWithData(pending.subdataWithRange($.NSMakeRange(rest, pending.length - rest)));
+            var request = null;
+            try {
+                request = JSON.parse($.NSString.alloc.initWithDataEncoding(lineData, $.NSUTF8StringEncoding).js);
+                reply(handle(request));
+            } catch (e) {
+                reply({id: request ? request.id : null, ok: false, error: String(e)});
+            }
+        }
+    }
+}
+'''
+
+
+# JavaScript for Automation observer for the player's distributed notification.
+# Prints each notification's userInfo as one JSON line; the notification name
+# is passed as the first argument. 64-bit IDs are sent as decimal strings
+# because JavaScript numbers cannot hold them exactly.
+kNotificationObserverSource = r'''
+ObjC.import('Foundation');
+
+function run(argv) {
+    var stdout = $.NSFileHandle.fileHandleWithStandardOutput;
+
+    ObjC.registerSubclass({
+        name: 'PlayerNotificationObserver',
+        methods: {
+            'notified:': {
+                types: ['void', ['id']],
+                implementation: function (notification) {
+                    var info = notification.userInfo;
+                    var payload = {};
+                    if (!info.isNil()) {
+                        var keys = info.allKeys;
+                        for (var i = 0; i < keys.count; i++) {
+                            var key = keys.objectAtIndex(i);
+                            var value = info.objectForKey(key);
+                            if (value.isKindOfClass($.NSNumber) && key.js === 'PersistentID') {
+                                payload[key.js] = value.stringValue.js;
+                            } else {
+                                payload[key.js] = ObjC.deepUnwrap(value);
+                            }
+                        }
+                    }
+                    var line = $(JSON.stringify(payload) + '\n');
+                    stdout.writeData(line.dataUsingEncoding($.NSUTF8StringEncoding));
+                }
+            }
+        }
+    });
+
+    var observer = $.PlayerNotificationObserver.alloc.init;
+    $.NSDistributedNotificationCenter.defaultCenter.addObserverSelectorNameObject(observer, 'notified:', argv[0], $());
+    $.NSRunLoop.currentRunLoop.run;
+}
+'''
+
+
+def withStatusQuery(source, statusSource):
+    """Return an action script that also runs the status query and returns its record"""
+    if not source.lstrip().startswith('on run argv'):
+        source = 'on run argv\n' + source.strip() + '\nend run\n'
+    body = source.rstrip()[:-len('end run')]
+    return (body + '    return playerStatus()\nend run\n\n'
+            'on playerStatus()\n' + statusSource.strip() + '\nend playerStatus\n')
+
+
+class ScriptTimeout(Exception):
+    """A script call did not finish before its deadline"""
+    pass
+
+
+class ScriptLost(Exception):
+    """A script reached the worker but its reply did not come back, so it may have run"""
+    pass
+
+
+class ScriptRunner(object):
+    """Persistent osascript worker that keeps compiled scripts between calls"""
+    
+    def __init__(self, plugin, command=None):
+        self.plugin = plugin
+        # The command can be swapped for any process speaking the same
+        # line-delimited JSON protocol (e.g. a stand-in runner off macOS)
+        self.command = command or ['osascript', '-l', 'JavaScript', '-e', kScriptRunnerSource]
+        self.lock = threading.Lock()
+        self.process = None
+        self.compiledKeys = set()
+        self.requestIds = itertools.count(1)
+        self.retryAfter = 0
+        
+    def start(self):
+        """Launch the worker process"""
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        self.compiledKeys = set()
+        
+    def stop(self):
+        """Terminate the worker process if it is running"""
+        process, self.process = self.process, None
+        if process and process.poll() is None:
+            try:
+                process.stdin.close()
+                process.wait(timeout=1)
+            except Exception:
+                process.kill()
+                
+    def kill(self):
+        """Kill the worker process immediately (it may be stuck waiting on the app)"""
+        process, self.process = self.process, None
+        if process and process.poll() is None:
+            process.kill()
+            process.wait()
+                
+    def run(self, script, language='AppleScript', args=None, timeout=kScriptTimeout):
+        """Run a script in the worker, returning (output, error) or None if the worker is unusable"""
+        key = hashlib.sha1((language + '\0' + script).encode('utf-8')).hexdigest()
+        with self.lock:
+            if time.time() < self.retryAfter:
+                return None
+            # One retry so a crashed worker is transparently restarted, but only
+            # while the request has not reached it: an action script that may
+            # have run (next track, a volume step) is never sent twice
+            for attempt in range(2):
+                try:
+                    if self.process is None or self.process.poll() is not None:
+                        self.start()
+                    request = self.send(key, script, language, args)
+                except (OSError, ValueError) as e:
+                    self.plugin.debugLog(f"Script runner failed ({str(e)}), restarting")
+                    self.stop()
+                    continue
+                try:
+                    return self.receive(key, request, timeout)
+                except ScriptTimeout:
+                    # Retrying would only hang again; the next call starts a fresh worker
+                    self.kill()
+                    raise
+                except (OSError, ValueError) as e:
+                    self.kill()
+                    raise ScriptLost(f"Script runner lost the reply ({str(e)})")
+            # Worker keeps dying - leave it alone for a while
+            self.retryAfter = time.time() + kScriptRunnerRetryDelay
+        return None
+        
+    def send(self, key, script, language, args):
+        """Write one request to the worker and return it"""
+        request = {'id': next(self.requestIds), 'key': key, 'language': language}
+        if args is not None:
+            request['args'] = args
+        if key not in self.compiledKeys:
+            request['source'] = script
+        self.process.stdin.write((json.dumps(request) + '\n').encode('utf-8'))
+        self.process.stdin.flush()
+        return request
+        
+    def receive(self, key, request, timeout):
+        """Wait for the reply to a request sent to the worker"""
+        ready, _, _ = select.select([self.process.stdout], [], [], timeout)
+        if not ready:
+            raise ScriptTimeout(f"Script timed out after {timeout:g} seconds")
+        line = self.process.stdout.readline()
+        if not line:
+            raise IOError("script runner exited")
+        reply = json.loads(line.decode('utf-8'))
+        if reply.get('id') != request['id']:
+            raise IOError("script runner reply out of sequence")
+        
+        if reply.get('ok'):
+            self.compiledKeys.add(key)
+            return reply.get('output', ''), ''
+        return '', reply.get('error', 'unknown error')
+
+
+class ScriptRunnerPool(object):
+    """A fixed set of ScriptRunner workers shared by concurrent callers"""
+    
+    def __init__(self, plugin, size, command=None):
+        self.runners = [ScriptRunner(plugin, command) for i in range(size)]
+        # LIFO so the most recently used worker is reused and the others
+        # stay unstarted until calls overlap
+        self.idle = queue.LifoQueue()
+        for runner in reversed(self.runners):
+            self.idle.put(runner)
+            
+    def run(self, script, language='AppleScript', args=None, timeout=kScriptTimeout):
+        """Run a script on an idle worker, waiting for one if all are busy"""
+        runner = self.idle.get()
+        try:
+            return runner.run(script, language, args, timeout)
+        finally:
+            self.idle.put(runner)
+            
+    def stop(self):
+        """Terminate all worker processes"""
+        for runner in self.runners:
+            runner.stop()
+
+
+class AppleScriptParser(object):
+    """Single-pass parser for AppleScript values printed in source form (osascript -s s)"""
+    
+    numberPattern = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?(?=\s*(?:[,}]|$))')
+    stringPattern = re.compile(r'"((?:[^"\\]|\\.)*)"', re.S)
+    escapePattern = re.compile(r'\\(.)', re.S)
+    keyPattern = re.compile(r'\s*(\|[^|]*\||[A-Za-z_][A-Za-z0-9_ ]*?)\s*:')
+    barePattern = re.compile(r'(?:«[^»]*»|[^,{}"])+')
+    escapes = {'n': '\n', 't': '\t', 'r': '\r'}
+    
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        
+    def parseRecord(self):
+        """Parse the whole text as a record; bare "key:value, ..." output is accepted too"""
+        self.skipSpace()
+        if self.text.startswith('{', self.pos):
+            value = self.parseValue()
+            return value if isinstance(value, dict) else {}
+        return self.parseItems(None, dict)
+        
+    def parseValue(self):
+        """Parse one value starting at the current position"""
+        self.skipSpace()
+        if self.pos >= len(self.text):
+            return None
+        
+        char = self.text[self.pos]
+        if char == '{':
+            self.pos += 1
+            self.skipSpace()
+            if self.text.startswith('}', self.pos):
+                self.pos += 1
+                return []
+            # A leading "key:" means a record, anything else is a list
+            container = dict if self.keyPattern.match(self.text, self.pos) else list
+            return self.parseItems('}', container)
+        if char == '"':
+            return self.parseString()
+        
+        match = self.numberPattern.match(self.text, self.pos)
+        if match:
+            self.pos = match.end()
+            number = match.group(0)
+            if '.' in number or 'e' in number or 'E' in number:
+                return float(number)
+            return int(number)
+        
+        return self.parseBare()
+        
+    def parseItems(self, closer, container):
+        """Parse comma separated items (key:value pairs for records) up to closer"""
+        items = container()
+        while True:
+            self.skipSpace()
+            if self.pos >= len(self.text):
+                return items
+            if closer and self.text.startswith(closer, self.pos):
+                self.pos += 1
+                return items
+            
+            if container is dict:
+                match = self.keyPattern.match(self.text, self.pos)
+                if not match:
+                    raise ValueError(f"expected record key at offset {self.pos}")
+                self.pos = match.end()
+                items[match.group(1).strip('|')] = self.parseValue()
+            else:
+                items.append(self.parseValue())
+            
+            self.skipSpace()
+            if self.text.startswith(',', self.pos):
+                self.pos += 1
+            elif self.pos < len(self.text) and not (closer and self.text.startswith(closer, self.pos)):
+                raise ValueError(f"unexpected {self.text[self.pos]!r} at offset {self.pos}")
+            
+    def parseString(self):
+        """Parse a double-quoted string, resolving backslash escapes"""
+        match = self.stringPattern.match(self.text, self.pos)
+        if not match:
+            raise ValueError(f"unterminated string at offset {self.pos}")
+        self.pos = match.end()
+        return self.escapePattern.sub(lambda m: self.escapes.get(m.group(1), m.group(1)), match.group(1))
+        
+    def parseBare(self):
+        """Parse an unquoted token: booleans, missing value, dates, enumerations"""
+        match = self.barePattern.match(self.text, self.pos)
+        if not match:
+            raise ValueError(f"unexpected {self.text[self.pos]!r} at offset {self.pos}")
+        self.pos = match.end()
+        word = match.group(0).strip()
+        
+        # Typed literals such as date "..." carry their value as a string
+        if self.text.startswith('"', self.pos) and word in ('date', 'file', 'alias', 'POSIX file'):
+            return self.parseString()
+        if word == 'true':
+            return True
+        if word == 'false':
+            return False
+        if word == 'missing value':
+            return None
+        return word
+        
+    def skipSpace(self):
+        """Advance past whitespace"""
+        while self.pos < len(self.text) and self.text[self.pos].isspace():
+            self.pos += 1
+
+
+class LRUCache(object):
+    """Small thread-safe least-recently-used cache"""
+    
+    def __init__(self, maxSize):
+        self.maxSize = maxSize
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        
+    def get(self, key):
+        """Return the cached value (marking it recently used) or None"""
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            return self.items[key]
+            
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entry when full"""
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.maxSize:
+                self.items.popitem(last=False)
+                
+    def discard(self, key):
+        """Drop a cached value if present"""
+        with self.lock:
+            self.items.pop(key, None)
+
+
+class CircuitBreaker(object):
+    """Suspends script calls to a player that keeps timing out, retrying with exponential backoff
+    
+    The state is 'ok', 'suspended' (calls are refused until the backoff has passed)
+    or 'retrying' (one trial call is in flight).
+    """
+    
+    def __init__(self, onChange=None):
+        self.onChange = onChange    # onChange(state), called outside the lock
+        self.lock = threading.Lock()
+        self.state = 'ok'
+        self.failures = 0
+        self.delay = kBreakerBaseDelay
+        self.retryAt = 0
+        
+    def blocking(self):
+        """Return whether calls are currently refused, without changing state"""
+        with self.lock:
+            if self.state == 'suspended':
+                return time.time() < self.retryAt
+            return self.state == 'retrying'
+            
+    def allow(self):
+        """Return whether a call may go ahead, letting one trial through once the backoff has passed"""
+        with self.lock:
+            if self.state == 'ok':
+                return True
+            if self.state != 'suspended' or time.time() < self.retryAt:
+                return False
+            self.state = 'retrying'
+        if self.onChange:
+            self.onChange('retrying')
+        return True
+            
+    def recordSuccess(self):
+        """Close the breaker after a call finished in time"""
+        with self.lock:
+            changed = self.state != 'ok'
+            self.state = 'ok'
+            self.failures = 0
+            self.delay = kBreakerBaseDelay
+        if changed and self.onChange:
+            self.onChange('ok')
+            
+    def recordFailure(self):
+        """Count a timed-out call, suspending calls after too many in a row"""
+        with self.lock:
+            self.failures += 1
+            if self.state == 'retrying':
+                self.delay = min(kBreakerMaxDelay, self.delay * 2)
+            elif self.state == 'suspended' or self.failures < kBreakerThreshold:
+                return
+            self.state = 'suspended'
+            self.retryAt = time.time() + self.delay
+        if self.onChange:
+            self.onChange('suspended')
+
+
+class NotificationSource(object):
+    """Feeds player notifications, read as JSON lines from an observer process, to a callback"""
+    
+    def __init__(self, plugin, name, callback, command=None):
+        self.plugin = plugin
+        self.callback = callback    # callback(payload dict), called on the reader thread
+        # The command can be swapped for any process printing JSON lines
+        # (e.g. a stand-in emitter off macOS)
+        self.command = command or ['osascript', '-l', 'JavaScript', '-e', kNotificationObserverSource, name]
+        self.process = None
+        self.thread = None
+        self.stopping = threading.Event()
+        
+    def start(self):
+        """Start reading notifications on a background thread"""
+        if self.thread is None:
+            # Each reader gets its own stop event, so one still winding down
+            # from an earlier stop() is never revived
+            self.stopping = threading.Event()
+            self.thread = threading.Thread(target=self.run, args=(self.stopping,), name='NotificationSource')
+            self.thread.daemon = True
+            self.thread.start()
+            
+    def stop(self):
+        """Stop the observer process and the reader thread"""
+        self.stopping.set()
+        process = self.process
+        if process and process.poll() is None:
+            process.kill()
+        if self.thread:
+            self.thread.join(2)
+            self.thread = None
+            
+    def run(self, stopping):
+        """Reader thread: run the observer, restarting it if it exits"""
+        while not stopping.is_set():
+            try:
+                self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                if stopping.is_set():
+                    # stop() ran while the process was starting
+                    self.process.kill()
+                for line in self.process.stdout:
+                    try:
+                        payload = json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        continue
+                    if isinstance(payload, dict):
+                        try:
+                            self.callback(payload)
+                        except Exception as e:
+                            self.plugin.errorLog(f"Exception handling player notification: {str(e)}")
+            except OSError as e:
+                self.plugin.errorLog(f"Could not start notification observer: {str(e)}")
+            if stopping.wait(kNotificationRestartDelay):
+                return
+            self.plugin.debugLog("Notification observer exited, restarting")
+
+
+class PollScheduler(object):
+    """Priority queue of device poll deadlines that sleeps until the next one is due"""
+    
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queue = []       # Heap of (due, sequence, devId)
+        self.deadlines = {}   # devId -> current due time; older heap entries are stale
+        self.sequence = itertools.count()
+        
+    def schedule(self, devId, due):
+        """Set (or move) the deadline for a device"""
+        with self.condition:
+            self.deadlines[devId] = due
+            heapq.heappush(self.queue, (due, next(self.sequence), devId))
+            self.condition.notify()
+            
+    def cancel(self, devId):
+        """Forget a device's deadline"""
+        with self.condition:
+            self.deadlines.pop(devId, None)
+            
+    def wake(self):
+        """Wake the waiting thread without scheduling anything"""
+        with self.condition:
+            self.condition.notify()
+            
+    def waitForDue(self, maxWait):
+        """Block until at least one device is due (or woken) and return the due device IDs"""
+        with self.condition:
+            now = time.time()
+            due = self.popDue(now)
+            if not due:
+                timeout = maxWait
+                if self.queue:
+                    timeout = min(maxWait, max(0, self.queue[0][0] - now))
+                self.condition.wait(timeout)
+                due = self.popDue(time.time())
+            return due
+            
+    def popDue(self, now):
+        """Remove and return devices whose deadline has passed, dropping stale entries"""
+        due = []
+        while self.queue and (self.queue[0][0] <= now or
+                              self.deadlines.get(self.queue[0][2]) != self.queue[0][0]):
+            when, sequence, devId = heapq.heappop(self.queue)
+            if self.deadlines.get(devId) == when:
+                del self.deadlines[devId]
+                due.append(devId)
+        return due
+
+
+class ActionWorker(object):
+    """Runs queued device actions in order on one background thread"""
+    
+    def __init__(self, plugin):
+        self.plugin = plugin
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.pending = {}     # devId -> number of queued actions not yet started
+        self.thread = None
+        
+    def start(self):
+        """Start the worker thread"""
+        self.thread = threading.Thread(target=self.run, name='ActionWorker')
+        self.thread.daemon = True
+        self.thread.start()
+        
+    def stop(self, timeout):
+        """Finish the current action (waiting up to timeout seconds) and stop the worker thread"""
+        if self.thread:
+            self.queue.put(None)
+            self.thread.join(timeout)
+            self.thread = None
+            
+    def submit(self, dev, action):
+        """Queue an action for a device and return immediately"""
+        with self.lock:
+            self.pending[dev.id] = self.pending.get(dev.id, 0) + 1
+        self.queue.put((dev, action))
+        
+    def hasPending(self, devId):
+        """Return whether more actions are waiting for a device"""
+        with self.lock:
+            return self.pending.get(devId, 0) > 0
+            
+    def run(self):
+        """Worker thread: perform actions until stopped"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            dev, action = item
+            with self.lock:
+                self.pending[dev.id] -= 1
+            try:
+                self.plugin.performAction(dev, action)
+            except Exception as e:
+                self.plugin.errorLog(f"Exception performing {action['script']} on {dev.name}: {str(e)}")
+            finally:
+                self.plugin.settleAction(dev, action)
+
+
+class CommandCoalescer(object):
+    """Merges bursts of commands per device and slot, sending only the settled value"""
+    
+    def __init__(self, send, window):
+        self.send = send      # send(dev, slot, value)
+        self.window = window
+        self.lock = threading.Lock()
+        # Held while a value is sent, so flushDevice returns only once every
+        # value for the device is queued (reentrant: sending can flush)
+        self.sendLock = threading.RLock()
+        self.pending = {}     # (devId, slot) -> {'dev', 'value', 'first', 'timer'}
+        
+    def update(self, dev, slot, merge):
+        """Merge a command into the device's pending value for a slot
+        
+        merge is called with the pending value (None if there is none) and returns the new one.
+        """
+        if self.window <= 0:
+            self.send(dev, slot, merge(None))
+            return
+        
+        with self.lock:
+            key = (dev.id, slot)
+            entry = self.pending.get(key)
+            if entry:
+                entry['timer'].cancel()
+            else:
+                entry = self.pending[key] = {'dev': dev, 'value': None, 'first': time.time()}
+            entry['value'] = merge(entry['value'])
+            
+            # Restart the window, but do not hold a command back indefinitely
+            delay = min(self.window, entry['first'] + self.window * kMaxDebounceWindows - time.time())
+            entry['timer'] = threading.Timer(max(0, delay), self.flush, (key,))
+            entry['timer'].daemon = True
+            entry['timer'].start()
+            
+    def flush(self, key):
+        """Send a slot's settled value"""
+        with self.sendLock:
+            with self.lock:
+                entry = self.pending.pop(key, None)
+            if entry:
+                entry['timer'].cancel()
+                self.send(entry['dev'], key[1], entry['value'])
+            
+    def flushDevice(self, devId):
+        """Send a device's pending values now, oldest first, so a command given after them runs after them"""
+        with self.sendLock:
+            with self.lock:
+                keys = sorted((key for key in self.pending if key[0] == devId),
+                              key=lambda key: self.pending[key]['first'])
+            for key in keys:
+                self.flush(key)
+            
+    def flushAll(self):
+        """Send every pending value now"""
+        with self.lock:
+            keys = list(self.pending)
+        for key in keys:
+            self.flush(key)
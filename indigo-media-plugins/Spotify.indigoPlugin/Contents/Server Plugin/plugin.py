@@ -10,9 +10,256 @@ import time
 import subprocess
 import json
 import re
+import threading
+import itertools
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from mediacontrol import (kScriptTimeout, withStatusQuery, ScriptTimeout, ScriptLost, ScriptRunnerPool,
+                          AppleScriptParser, LRUCache, CircuitBreaker, NotificationSource, PollScheduler, ActionWorker,
+                          CommandCoalescer)
 
 # Constants
 kUpdateFrequencyKey = "updateFrequency"
+kPersistentRunnerKey = "usePersistentRunner"
+
+# Due devices are polled concurrently by up to kPollWorkers threads, one poll
+# per device at a time. Script calls share up to kScriptRunners persistent
+# workers; extra workers are only started when calls actually overlap
+kPollWorkers = 3
+kScriptRunners = 4
+
+# Each device's last published states are saved here on shutdown and shown
+# again at startup until the first live poll replaces them
+kSnapshotFileSuffix = ".snapshot.json"
+
+# A device saved while playing is restored as paused: it is only known to be
+# playing after the first poll, and a restored "playing" would look like playback
+# starting to the Music Manager, whose auto-exclusive mode pauses the other players
+kSnapshotPausedStates = {'playerState': 'paused', 'isPlaying': False, 'isPaused': True, 'isStopped': False}
+
+# Returned for script calls refused while the circuit breaker (see
+# mediacontrol) has suspended calls to the player
+kSuspendedError = "{} is not responding; script calls are suspended"
+
+# Longest poll interval (seconds) reached by backing off in each idle state.
+# Polling starts at the device's update frequency and doubles on every poll
+# that finds the player still in the same idle state.
+kIdlePollCaps = {
+    'playing': 0,
+    'paused': 5,
+    'stopped': 15,
+    'notRunning': 30
+}
+kMaxIdlePolls = 10
+
+# Seconds between full state pushes; in between only changed states are sent
+kFullResyncInterval = 60
+
+# States that change every poll; their variables are written at most this often (seconds)
+kHighChurnVariables = ('playerPosition', 'playerPositionFormatted', 'progressPercent')
+kHighChurnVariableInterval = 5
+
+# Number of tracks whose metadata is kept in memory
+kMetadataCacheSize = 64
+
+# Upper bound on how long the poll thread sleeps when no device is due
+kSchedulerMaxWait = 10.0
+# Golden ratio fraction used to spread device poll phases across the interval
+kPhaseSpread = 0.618
+
+# Consecutive failures of the JavaScript status backend before a device
+# falls back to AppleScript for the rest of the session
+kMaxJavaScriptFailures = 3
+
+# Event mode: Spotify broadcasts this notification on every playback change.
+# States are updated from its payload and polling (for position, volume and
+# shuffle/repeat) slows to at least kEventPollInterval seconds
+kPlaybackNotification = "com.spotify.client.PlaybackStateChanged"
+kEventPollInterval = 5.0
+kNotificationKeys = {
+    'Player State': 'playerState',
+    'Track ID': 'trackId',
+    'Playback Position': 'playerPosition',
+    'Name': 'trackName',
+    'Artist': 'trackArtist',
+    'Album': 'trackAlbum',
+    'Album Artist': 'albumArtist',
+    'Duration': 'trackDuration',
+    'Track Number': 'trackNumber',
+    'Disc Number': 'discNumber',
+    'Popularity': 'popularity'
+}
+
+# A notification carrying all of these is published without a metadata query;
+# the next poll's query fills in what the payload lacks (artwork and Spotify URL)
+kPayloadMetadataKeys = frozenset(('trackName', 'trackArtist', 'trackAlbum', 'trackDuration'))
+
+
+# JavaScript for Automation versions of the status queries (optional "jxa"
+# backend). They return JSON text with the same keys as the AppleScript records.
+kHeartbeatJavaScript = '''
+(function () {
+    var spotify = Application('Spotify');
+    if (!spotify.running()) {
+        return JSON.stringify({playerState: 'stopped', trackName: '', trackArtist: '', trackAlbum: '', notRunning: true});
+    }
+    try {
+        return JSON.stringify({
+            playerState: spotify.playerState(),
+            playerPosition: spotify.playerPosition(),
+            trackId: spotify.currentTrack.id(),
+            soundVolume: spotify.soundVolume(),
+            shuffling: spotify.shuffling(),
+            repeating: spotify.repeating()
+        });
+    } catch (e) {
+        return JSON.stringify({error: String(e)});
+    }
+})()
+'''
+
+kMetadataJavaScript = '''
+(function () {
+    try {
+        var track = Application('Spotify').currentTrack;
+        return JSON.stringify({
+            trackId: track.id(),
+            trackName: track.name(),
+            trackArtist: track.artist(),
+            trackAlbum: track.album(),
+            trackDuration: track.duration(),
+            trackNumber: track.trackNumber(),
+            discNumber: track.discNumber(),
+            popularity: track.popularity(),
+            artworkUrl: track.artworkUrl(),
+            albumArtist: track.albumArtist(),
+            spotifyUrl: track.spotifyUrl()
+        });
+    } catch (e) {
+        return JSON.stringify({error: String(e)});
+    }
+})()
+'''
+
+
+# Bursts of volume, seek, skip and toggle actions for a device are merged and
+# only the settled value is sent once no new one has arrived for the debounce
+# window (plugin preference, seconds), or after mediacontrol.kMaxDebounceWindows windows
+kCommandDebounceKey = "commandDebounce"
+kDefaultCommandDebounce = 0.25
+
+# After an action, a cheap probe is repeated every kActionProbeInterval seconds
+# until the expected change shows up. The deadline adapts to how long each
+# action has taken to show up before (kActionDeadlineFactor x its average),
+# within kActionMinWait..kActionMaxWait.
+kActionProbeInterval = 0.1
+kActionMinWait = 0.5
+kActionMaxWait = 5.0
+kActionDeadlineFactor = 3.0
+
+# The app liveness probe result is shared by all devices for this long (seconds);
+# while the app is down the status query is skipped and this record is used
+kLivenessTTL = 2.0
+kNotRunningStatus = {'playerState': 'stopped', 'trackName': '', 'trackArtist': '', 'trackAlbum': '', 'notRunning': True}
+
+# Named AppleScript sources. Each is compiled once per session, on its first
+# use (by the script runner, or with osacompile for the one-shot fallback), and
+# values are passed through "on run argv" instead of being spliced into the source.
+kScripts = {
+    'isRunning': 'return application id "com.spotify.client" is running',
+    # Cheap heartbeat: player-level properties and the current track ID only
+    'heartbeat': '''
+-- "is running" checks the app by bundle ID without System Events or launching it
+if application id "com.spotify.client" is running then
+    tell application "Spotify"
+        try
+            set playerState to player state as string
+            set playerPos to player position
+            set trackId to id of current track
+            set soundVol to sound volume
+            set isShuffling to shuffling
+            set isRepeating to repeating
+            
+            return {playerState:playerState, playerPosition:playerPos, trackId:trackId, soundVolume:soundVol, shuffling:isShuffling, repeating:isRepeating}
+        on error errMsg
+            return {error:errMsg}
+        end try
+    end tell
+else
+    return {playerState:"stopped", trackName:"", trackArtist:"", trackAlbum:"", notRunning:true}
+end if
+''',
+    'metadata': '''
+tell application "Spotify"
+    try
+        set theTrack to current track
+        return {trackId:id of theTrack, trackName:name of theTrack, trackArtist:artist of theTrack, trackAlbum:album of theTrack, trackDuration:duration of theTrack, trackNumber:track number of theTrack, discNumber:disc number of theTrack, popularity:popularity of theTrack, artworkUrl:artwork url of theTrack, albumArtist:album artist of theTrack, spotifyUrl:spotify url of theTrack}
+    on error errMsg
+        return {error:errMsg}
+    end try
+end tell
+''',
+    'play': 'tell application "Spotify" to play',
+    'pause': 'tell application "Spotify" to pause',
+    'playPause': 'tell application "Spotify" to playpause',
+    'stop': '''
+tell application "Spotify"
+    pause
+    set player position to 0
+end tell
+''',
+    'nextTrack': '''
+on run argv
+    tell application "Spotify"
+        repeat (item 1 of argv) as integer times
+            next track
+        end repeat
+    end tell
+end run
+''',
+    'previousTrack': '''
+on run argv
+    tell application "Spotify"
+        repeat (item 1 of argv) as integer times
+            previous track
+        end repeat
+    end tell
+end run
+''',
+    'setVolume': '''
+on run argv
+    tell application "Spotify" to set sound volume to (item 1 of argv) as integer
+end run
+''',
+    'setPosition': '''
+on run argv
+    tell application "Spotify" to set player position to (item 1 of argv) as integer
+end run
+''',
+    'setShuffling': '''
+on run argv
+    tell application "Spotify" to set shuffling to (item 1 of argv is "true")
+end run
+''',
+    'setRepeating': '''
+on run argv
+    tell application "Spotify" to set repeating to (item 1 of argv is "true")
+end run
+''',
+    'playUri': '''
+on run argv
+    tell application "Spotify" to play track (item 1 of argv)
+end run
+''',
+}
+
+
+# Action scripts with the status query appended, run by the action worker
+kActionScripts = dict((name, withStatusQuery(source, kScripts['heartbeat']))
+                      for name, source in kScripts.items()
+                      if name not in ('isRunning', 'heartbeat', 'metadata'))
 
 
 class Plugin(indigo.PluginBase):
@@ -22,103 +269,415 @@ class Plugin(indigo.PluginBase):
         super(Plugin, self).__init__(pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
         self.debug = pluginPrefs.get("showDebugInfo", False)
         self.deviceDict = {}
+        self.scriptRunner = None
+        self.scriptFolder = None
+        self.compiledScripts = {}
+        self.liveness = {'running': None, 'checkedAt': 0}
+        self.livenessLock = threading.Lock()
+        self.pollScheduler = PollScheduler()
+        self.pollPool = ThreadPoolExecutor(max_workers=kPollWorkers)
+        self.flightLock = threading.Lock()   # guards each device's polling/queryStarted/followUp
+        self.readSequence = itertools.count(1)   # orders status reads so an older one never overwrites a newer
+        self.compileLock = threading.Lock()
+        self.breaker = CircuitBreaker(self.breakerChanged)
+        self.notificationSource = None
+        self.actionWorker = ActionWorker(self)
+        self.coalescer = CommandCoalescer(self.sendCoalesced, self.getCommandDebounce(pluginPrefs))
+        self.mirrorLock = threading.Lock()
+        self.snapshot = {}        # str(devId) -> {state key: value} from the last run
+        self.snapshotPath = None
+        self.actionLatency = {}   # script name -> average seconds until its effect showed up
+        self.metadataCache = LRUCache(kMetadataCacheSize)
         
     def startup(self):
         """Called when plugin starts"""
         self.debugLog(u"Spotify Plugin startup called")
+        self.loadSnapshot()
+        if self.pluginPrefs.get(kPersistentRunnerKey, True):
+            self.scriptRunner = ScriptRunnerPool(self, kScriptRunners)
+        self.actionWorker.start()
         
     def shutdown(self):
         """Called when plugin shuts down"""
         self.debugLog(u"Spotify Plugin shutdown called")
+        if self.notificationSource:
+            self.notificationSource.stop()
+        self.coalescer.flushAll()
+        self.actionWorker.stop(kActionMaxWait + 1)
+        self.pollPool.shutdown(wait=True)
+        self.saveSnapshot()
+        if self.scriptRunner:
+            self.scriptRunner.stop()
+        if self.scriptFolder:
+            shutil.rmtree(self.scriptFolder, ignore_errors=True)
+        
+    def closedPrefsConfigUi(self, valuesDict, userCancelled):
+        """Apply preference changes that do not need a restart"""
+        if not userCancelled:
+            self.debug = valuesDict.get("showDebugInfo", False)
+            self.coalescer.window = self.getCommandDebounce(valuesDict)
+            
+    def getCommandDebounce(self, prefs):
+        """Return the command debounce window from the plugin preferences, in seconds"""
+        value = prefs.get(kCommandDebounceKey, kDefaultCommandDebounce)
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            self.errorLog(f"Invalid command debounce '{value}', using {kDefaultCommandDebounce}")
+            return kDefaultCommandDebounce
         
     def deviceStartComm(self, dev):
         """Called when device communication starts"""
         self.debugLog(u"Starting device: " + dev.name)
         
-        # Initialize the device's update frequency
+        # Initialize the device's update frequency; in event mode polls only
+        # need to keep the position current
         updateFreq = float(dev.pluginProps.get(kUpdateFrequencyKey, 1))
+        updateMode = dev.pluginProps.get('updateMode', 'poll')
+        if updateMode == 'events':
+            updateFreq = max(updateFreq, kEventPollInterval)
+            if self.notificationSource is None:
+                self.notificationSource = NotificationSource(self, kPlaybackNotification, self.playerNotified)
+            self.notificationSource.start()
         
         # Store device info
         self.deviceDict[dev.id] = {
             'device': dev,
             'updateFrequency': updateFreq,
             'lastUpdate': 0,
+            'pollInterval': updateFreq,
+            'idlePolls': 0,
+            'lastPlayerState': None,
+            'resetPending': False,
+            'updateMode': updateMode,
+            'statusBackend': dev.pluginProps.get('statusBackend', 'applescript'),
+            'javaScriptFailures': 0,
+            'lastStatus': None,
+            'optimistic': {},   # state key -> value expected from a queued command
+            'pollLock': threading.Lock(),   # one publish per device at a time
+            'polling': False,        # a poll is queued or running
+            'queryStarted': False,   # ...and has started its query
+            'followUp': False,       # refresh requested while the query was running
+            'publishedRead': 0,      # readSequence stamp of the last status published
+            'publishedStates': {},
+            'lastFullSync': 0,
+            'variables': None,
             'previousVolume': None  # For mute/unmute
         }
         
-        # Do initial update
-        self.updateSpotifyStatus(dev)
+        # Show the last known states at once; the first live poll runs in the
+        # background, offset from the other devices
+        devInfo = self.deviceDict[dev.id]
+        with devInfo['pollLock']:
+            self.restoreSnapshot(dev)
+            self.publishStates(dev, [{'key': 'connectionState', 'value': self.breaker.state}])
+        phase = (len(self.deviceDict) * kPhaseSpread) % 1.0
+        devInfo['resetPending'] = True
+        self.pollScheduler.schedule(dev.id, time.time() + devInfo['pollInterval'] * phase)
         
     def deviceStopComm(self, dev):
         """Called when device communication stops"""
         self.debugLog(u"Stopping device: " + dev.name)
-        if dev.id in self.deviceDict:
-            del self.deviceDict[dev.id]
+        devInfo = self.deviceDict.pop(dev.id, None)
+        if devInfo:
+            # Kept for the snapshot written at shutdown
+            with self.mirrorLock:
+                self.snapshot[str(dev.id)] = dict(devInfo['publishedStates'])
+        self.pollScheduler.cancel(dev.id)
+        
+        # Stop observing notifications once no device uses them
+        if self.notificationSource and not any(info['updateMode'] == 'events' for info in list(self.deviceDict.values())):
+            self.notificationSource.stop()
+        
+    def loadSnapshot(self):
+        """Read the state snapshot saved by the last run, if any"""
+        self.snapshotPath = os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins',
+                                         self.pluginId + kSnapshotFileSuffix)
+        try:
+            with open(self.snapshotPath) as snapshotFile:
+                self.snapshot = json.load(snapshotFile)
+        except FileNotFoundError:
+            self.snapshot = {}
+        except (OSError, ValueError) as e:
+            self.debugLog(f"Could not read state snapshot: {str(e)}")
+            self.snapshot = {}
+            
+    def restoreSnapshot(self, dev):
+        """Publish a device's states from the snapshot so they show before the first poll"""
+        states = self.snapshot.pop(str(dev.id), None)
+        if states:
+            states.pop('connectionState', None)
+            if states.get('isPlaying'):
+                states.update(kSnapshotPausedStates)
+                if states.get('status', '').startswith("▶"):
+                    states['status'] = "⏸" + states['status'][1:]
+            self.publishStates(dev, [{'key': key, 'value': value} for key, value in states.items()])
+            
+    def saveSnapshot(self):
+        """Write every device's last published states for the next startup"""
+        if not self.snapshotPath:
+            return
+        for devId, devInfo in list(self.deviceDict.items()):
+            with self.mirrorLock:
+                self.snapshot[str(devId)] = dict(devInfo['publishedStates'])
+        # Drop devices that have been deleted
+        deviceIds = set(str(dev.id) for dev in indigo.devices.iter('self'))
+        snapshot = dict((devId, states) for devId, states in self.snapshot.items() if devId in deviceIds)
+        try:
+            tempPath = self.snapshotPath + '.tmp'
+            with open(tempPath, 'w') as snapshotFile:
+                json.dump(snapshot, snapshotFile, separators=(',', ':'))
+            os.replace(tempPath, self.snapshotPath)
+        except (OSError, TypeError, ValueError) as e:
+            self.errorLog(f"Could not save state snapshot: {str(e)}")
             
     def runConcurrentThread(self):
-        """Main plugin loop - updates device states"""
+        """Main plugin loop - updates device states as their poll deadlines come due"""
         try:
             while True:
-                currentTime = time.time()
-                
-                for devId, devInfo in list(self.deviceDict.items()):
-                    dev = devInfo['device']
-                    updateFreq = devInfo['updateFrequency']
-                    lastUpdate = devInfo['lastUpdate']
-                    
-                    # Check if it's time to update this device
-                    if currentTime - lastUpdate >= updateFreq:
-                        self.updateSpotifyStatus(dev)
-                        devInfo['lastUpdate'] = currentTime
+                for devId in self.pollScheduler.waitForDue(kSchedulerMaxWait):
+                    devInfo = self.deviceDict.get(devId)
+                    if devInfo and self.startFlight(devInfo):
+                        self.pollPool.submit(self.pollTask, devInfo)
                 
-                self.sleep(0.1)  # Short sleep to prevent CPU spinning
+                if self.stopThread:
+                    raise self.StopThread
                 
         except self.StopThread:
             pass
             
-    def updateSpotifyStatus(self, dev):
-        """Update all Spotify status information"""
+    def stopConcurrentThread(self):
+        """Called when the plugin is stopping - wake the poll thread so it can exit"""
+        super(Plugin, self).stopConcurrentThread()
+        self.pollScheduler.wake()
+            
+    def playerNotified(self, payload):
+        """Publish a playback notification to every device in event mode"""
+        status = self.statusFromNotification(payload)
+        readStamp = next(self.readSequence)
+        self.debugLog(f"Player notification: {status.get('playerState')} {status.get('trackId', '')}")
+        for devInfo in list(self.deviceDict.values()):
+            if devInfo['updateMode'] != 'events':
+                continue
+            # The notification lacks volume and shuffle/repeat; keep the last polled values
+            # but not track details, which may belong to an earlier track
+            lastStatus = devInfo['lastStatus'] or {}
+            record = {key: value for key, value in lastStatus.items() if key not in kPayloadMetadataKeys}
+            record.update(status)
+            for key in ('notRunning', 'livenessCached', 'error', 'errorMsg'):
+                record.pop(key, None)
+            self.pollDevice(devInfo['device'], reset=True, status=record, readStamp=readStamp)
+            
+    def statusFromNotification(self, payload):
+        """Translate a PlaybackStateChanged notification into heartbeat/metadata record keys"""
+        status = {}
+        for key, statusKey in kNotificationKeys.items():
+            if key in payload:
+                status[statusKey] = payload[key]
+        if 'playerState' in status:
+            status['playerState'] = str(status['playerState']).lower()
+        return status
+        
+    def requestRefresh(self, dev):
+        """Ask the poll thread to refresh a device now at the fast poll rate"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo:
+            devInfo['resetPending'] = True
+            self.pollScheduler.schedule(dev.id, time.time())
+            
+    def queueAction(self, dev, script, *args, expect=None, after=None, optimistic=None):
+        """Queue a named script for the action worker so the action handler returns at once
+        
+        expect describes the change that confirms the action in the probe record:
+        ('equals', key, value) or ('changes', key). after runs once the script has run.
+        optimistic maps state keys to the values the command will set; handlers
+        see them in the state mirror until the action has run.
+        """
+        # Coalesced commands given earlier (a toggle still in its debounce
+        # window) go first, so a play, pause or stop cannot overtake them. The
+        # coalescer sends through here too; its own slot is no longer pending
+        self.coalescer.flushDevice(dev.id)
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and optimistic:
+            with self.mirrorLock:
+                devInfo['optimistic'].update(optimistic)
+        self.actionWorker.submit(dev, {'script': script, 'args': args, 'expect': expect, 'after': after,
+                                       'optimistic': optimistic})
+        
+    def settleAction(self, dev, action):
+        """Action worker: drop an action's optimistic values once it has run, unless a later command replaced them"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and action['optimistic']:
+            with self.mirrorLock:
+                for key, value in action['optimistic'].items():
+                    if devInfo['optimistic'].get(key) == value:
+                        del devInfo['optimistic'][key]
+        
+    def performAction(self, dev, action):
+        """Action worker: run one action, wait until its effect shows up, then publish the status"""
+        expect = action['expect']
+        # Skip the confirmation wait when more actions for this device are queued
+        confirm = expect is not None and not self.actionWorker.hasPending(dev.id)
+        before = None
+        if confirm and expect[0] == 'changes':
+            devInfo = self.deviceDict.get(dev.id)
+            before = devInfo and devInfo['lastStatus'] or self.probePlayer()
+        
+        # The action script returns the status read right after the command,
+        # so no separate status query is needed
+        started = time.time()
+        status = self.executeAppleScript(kActionScripts[action['script']], [str(arg) for arg in action['args']])
+        readStamp = next(self.readSequence)
+        if action['after']:
+            action['after']()
+        
+        if confirm:
+            average = self.actionLatency.get(action['script'], kActionMinWait / kActionDeadlineFactor)
+            deadline = min(kActionMaxWait, max(kActionMinWait, average * kActionDeadlineFactor))
+            while True:
+                elapsed = time.time() - started
+                if status is not None and self.expectationMet(expect, before, status):
+                    self.debugLog(f"{action['script']} on {dev.name} showed up after {elapsed:.2f}s")
+                    break
+                if elapsed >= deadline or self.actionWorker.hasPending(dev.id):
+                    self.debugLog(f"{action['script']} on {dev.name} not confirmed within {deadline:.2f}s")
+                    break
+                time.sleep(kActionProbeInterval)
+                status = self.probePlayer()
+                readStamp = next(self.readSequence)
+            self.actionLatency[action['script']] = 0.8 * average + 0.2 * elapsed
+            
+        if status is not None:
+            self.pollDevice(dev, reset=True, status=status, readStamp=readStamp)
+        else:
+            self.requestRefresh(dev)
+        
+    def expectationMet(self, expect, before, probe):
+        """Return whether a probe record shows the change an action expects"""
+        if expect[0] == 'equals':
+            return probe.get(expect[1]) == expect[2]
+        return before is not None and probe.get(expect[1]) != before.get(expect[1])
+        
+    def startFlight(self, devInfo):
+        """Claim a due device for the poll pool; returns False if a poll is already in flight
+        
+        Refreshes requested while a poll is queued are served by that poll; one
+        requested while its query is running gets exactly one follow-up query.
+        """
+        with self.flightLock:
+            if not devInfo['polling']:
+                devInfo['polling'] = True
+                devInfo['queryStarted'] = False
+                return True
+            if devInfo['queryStarted']:
+                devInfo['followUp'] = True
+            return False
+            
+    def pollTask(self, devInfo):
+        """Poll pool: poll one device (plus one follow-up if requested meanwhile), then release it"""
+        dev = devInfo['device']
+        try:
+            while True:
+                with self.flightLock:
+                    devInfo['queryStarted'] = True
+                    devInfo['followUp'] = False
+                self.pollDevice(dev)
+                with self.flightLock:
+                    if not devInfo['followUp']:
+                        devInfo['polling'] = False
+                        return
+        except Exception as e:
+            self.errorLog(f"Exception polling {dev.name}: {str(e)}")
+            with self.flightLock:
+                devInfo['polling'] = False
+            # popDue already dropped the device's deadline; without a new one it
+            # would never be polled again
+            if self.deviceDict.get(dev.id) is devInfo:
+                self.pollScheduler.schedule(dev.id, time.time() + devInfo['pollInterval'])
+            
+    def pollDevice(self, dev, reset=False, status=None, readStamp=None):
+        """Update status (or publish a record already read) and schedule the next poll from player activity
+        
+        readStamp is the readSequence value taken when status was read; a status
+        read before the last one published is dropped.
+        """
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo is None:
+            return
+        
+        # The status query runs outside the device's lock so the action worker
+        # and notifications are not held up while it waits on the player; the
+        # read stamp taken before it still keeps it from overwriting a newer read
+        if status is None:
+            readStamp = next(self.readSequence)
+            status = self.readSpotifyStatus(dev)
+        elif readStamp is None:
+            readStamp = next(self.readSequence)
+        # ...and so does a new track's metadata query
+        metadata = self.statusMetadata(dev, status) if status else None
+        
+        # The action worker and notifications publish too; the device's lock
+        # keeps its updates in order
+        with devInfo['pollLock']:
+            if readStamp < devInfo['publishedRead']:
+                # A newer read was published while this one was on its way
+                return
+            devInfo['publishedRead'] = readStamp
+            
+            playerState = None if status is None else self.processStatus(dev, status, metadata)
+            
+            if dev.id in self.deviceDict:
+                # Circuit breaker changes show up here, under the device's lock
+                self.publishStates(dev, [{'key': 'connectionState', 'value': self.breaker.state}])
+                reset = reset or devInfo['resetPending']
+                devInfo['resetPending'] = False
+                devInfo['lastUpdate'] = time.time()
+                self.adjustPollInterval(devInfo, playerState, reset)
+                self.pollScheduler.schedule(dev.id, devInfo['lastUpdate'] + devInfo['pollInterval'])
+            
+    def adjustPollInterval(self, devInfo, playerState, reset=False):
+        """Back off polling while the player stays idle, snap back on any change"""
+        updateFreq = devInfo['updateFrequency']
+        
+        if reset or playerState == 'playing' or playerState != devInfo['lastPlayerState']:
+            devInfo['idlePolls'] = 0
+        else:
+            devInfo['idlePolls'] = min(kMaxIdlePolls, devInfo['idlePolls'] + 1)
+        devInfo['lastPlayerState'] = playerState
+        
+        # Unknown states (errors) back off like a player that isn't running
+        cap = max(updateFreq, kIdlePollCaps.get(playerState, kIdlePollCaps['notRunning']))
+        devInfo['pollInterval'] = min(cap, updateFreq * (2 ** devInfo['idlePolls']))
+            
+    def readSpotifyStatus(self, dev):
+        """Read the player's status record, or None while the circuit breaker blocks calls"""
+        # Leave a player that keeps timing out alone until the breaker retries
+        if self.breaker.blocking():
+            return None
+        
+        # Cheap heartbeat: player-level properties and the current track ID only
+        if self.isPlayerRunning():
+            result = self.queryPlayer(dev, kScripts['heartbeat'], kHeartbeatJavaScript)
+        else:
+            # Known to be down - no need to ask. The record is marked so it does
+            # not renew the cached liveness, or a launch would never be seen
+            result = dict(kNotRunningStatus, livenessCached=True)
+        return result
+        
+    def processStatus(self, dev, result, metadata=None):
+        """Publish a status record from a poll or an action, with its track's metadata, and return the player state"""
         try:
-            # Build comprehensive AppleScript to get all Spotify data
-            script = '''
-            tell application "System Events"
-                set spotifyRunning to (name of processes) contains "Spotify"
-            end tell
-            
-            if spotifyRunning then
-                tell application "Spotify"
-                    try
-                        set playerState to player state as string
-                        set trackName to name of current track
-                        set trackArtist to artist of current track
-                        set trackAlbum to album of current track
-                        set trackDuration to duration of current track
-                        set playerPos to player position
-                        set trackNumber to track number of current track
-                        set discNumber to disc number of current track
-                        set trackPopularity to popularity of current track
-                        set artworkUrl to artwork url of current track
-                        set albumArtist to album artist of current track
-                        set spotifyUrl to spotify url of current track
-                        set trackId to id of current track
-                        set soundVol to sound volume
-                        set isShuffling to shuffling
-                        set isRepeating to repeating
-                        
-                        return {playerState:playerState, trackName:trackName, trackArtist:trackArtist, trackAlbum:trackAlbum, trackDuration:trackDuration, playerPosition:playerPos, trackNumber:trackNumber, discNumber:discNumber, popularity:trackPopularity, artworkUrl:artworkUrl, albumArtist:albumArtist, spotifyUrl:spotifyUrl, trackId:trackId, soundVolume:soundVol, shuffling:isShuffling, repeating:isRepeating}
-                    on error errMsg
-                        return {error:errMsg}
-                    end try
-                end tell
-            else
-                return {playerState:"stopped", trackName:"", trackArtist:"", trackAlbum:""}
-            end if
-            '''
-            
-            # Execute AppleScript
-            result = self.executeAppleScript(script)
+            if result is not None:
+                if not result.get('livenessCached'):
+                    self.noteLiveness(not result.get('notRunning', False))
+                devInfo = self.deviceDict.get(dev.id)
+                if devInfo:
+                    devInfo['lastStatus'] = result
             
             if result and 'error' not in result:
+                if metadata:
+                    result = dict(metadata, **result)
+                
                 stateList = []
                 
                 # Player state
@@ -183,11 +742,15 @@ class Plugin(indigo.PluginBase):
                 stateList.append({'key': 'status', 'value': status})
                 
                 # Update all states
-                dev.updateStatesOnServer(stateList)
+                self.publishStates(dev, stateList)
                 
                 # Update variables if enabled
                 if dev.pluginProps.get('updateVariables', False):
                     self.updateVariables(dev, result, stateList)
+                
+                if result.get('notRunning', False):
+                    return 'notRunning'
+                return playerState
                     
             else:
                 # Spotify not responding or error
@@ -198,47 +761,157 @@ class Plugin(indigo.PluginBase):
                     {'key': 'isStopped', 'value': True},
                     {'key': 'status', 'value': 'Not Running'}
                 ]
-                dev.updateStatesOnServer(stateList)
+                self.publishStates(dev, stateList)
                 
         except Exception as e:
             self.errorLog(f"Error updating Spotify status: {str(e)}")
+        return None
+            
+    def statusMetadata(self, dev, result):
+        """Return the metadata for a status record's track
+        
+        Metadata only needs fetching when the track changes, and not at all for
+        a notification that carries the track details.
+        """
+        trackId = result.get('trackId', '')
+        if kPayloadMetadataKeys.issubset(result):
+            return self.metadataCache.get(trackId) if trackId else None
+        return self.getTrackMetadata(dev, trackId)
+        
+    def getTrackMetadata(self, dev, trackId):
+        """Return metadata for the current track, querying Spotify only on a cache miss"""
+        if not trackId:
+            return None
+        
+        metadata = self.metadataCache.get(trackId)
+        if metadata is not None:
+            return metadata
+        
+        metadata = self.queryPlayer(dev, kScripts['metadata'], kMetadataJavaScript)
+        if not metadata or 'error' in metadata:
+            return None
+        
+        # Cache under the ID Spotify reported, in case the track changed in between
+        self.debugLog(f"Fetched metadata for track {metadata.get('trackId', trackId)}")
+        self.metadataCache.put(metadata.get('trackId', trackId), metadata)
+        return metadata
+            
+    def publishStates(self, dev, stateList):
+        """Send only the states that changed since the last update, with a periodic full resync"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo is None:
+            dev.updateStatesOnServer(stateList)
+            return stateList
+        
+        published = devInfo['publishedStates']
+        now = time.time()
+        if now - devInfo['lastFullSync'] >= kFullResyncInterval:
+            changed = stateList
+            devInfo['lastFullSync'] = now
+        else:
+            changed = [state for state in stateList
+                       if state['key'] not in published or published[state['key']] != state['value']]
+        
+        if changed:
+            dev.updateStatesOnServer(changed)
+            # Publishers are serialized by the device's poll lock; the mirror
+            # lock keeps action handlers from reading the cache mid-update
+            with self.mirrorLock:
+                for state in changed:
+                    published[state['key']] = state['value']
+        return changed
             
     def updateVariables(self, dev, result, stateList):
-        """Update Indigo variables with Spotify data"""
+        """Update Indigo variables with current states, writing only values that changed"""
         try:
-            prefix = dev.pluginProps.get('variablePrefix', 'Spotify')
+            devInfo = self.deviceDict.get(dev.id)
+            if devInfo is None:
+                return
             
-            # Create or update variables for each state
+            variables = devInfo['variables']
+            if variables is None:
+                variables = devInfo['variables'] = {
+                    'prefix': dev.pluginProps.get('variablePrefix', 'Spotify'),
+                    'useFolder': dev.pluginProps.get('variableFolder', False),
+                    'folderId': None,
+                    'names': {},       # state key -> variable name
+                    'ids': {},         # variable name -> variable ID
+                    'values': {},      # variable name -> last written value
+                    'writeTimes': {}   # variable name -> time of last write
+                }
+            
+            now = time.time()
             for state in stateList:
-                varName = f"{prefix}{state['key'][0].upper()}{state['key'][1:]}"
+                varName = variables['names'].get(state['key'])
+                if varName is None:
+                    varName = variables['prefix'] + state['key'][0].upper() + state['key'][1:]
+                    variables['names'][state['key']] = varName
+                
                 varValue = str(state['value'])
+                if variables['values'].get(varName) == varValue:
+                    continue
                 
-                # Check if variable exists
-                if varName in indigo.variables:
-                    indigo.variable.updateValue(varName, value=varValue)
-                else:
-                    # Create new variable
-                    indigo.variable.create(varName, value=varValue, folder=0)
+                # Fast-moving values are written at most once per interval; the
+                # latest value goes out on the first poll after the interval
+                if (state['key'] in kHighChurnVariables and
+                        now - variables['writeTimes'].get(varName, 0) < kHighChurnVariableInterval):
+                    continue
+                
+                try:
+                    self.writeVariable(variables, varName, varValue)
+                    variables['values'][varName] = varValue
+                    variables['writeTimes'][varName] = now
+                except Exception as e:
+                    # Variable was probably deleted - resolve it again next time
+                    variables['ids'].pop(varName, None)
+                    self.errorLog(f"Error updating variable {varName}: {str(e)}")
                     
         except Exception as e:
             self.errorLog(f"Error updating variables: {str(e)}")
             
-    def executeAppleScript(self, script):
+    def writeVariable(self, variables, varName, varValue):
+        """Write a variable by cached ID, creating or filing it (and its folder) on first use"""
+        varId = variables['ids'].get(varName)
+        if varId is None:
+            folderId = self.getVariableFolderId(variables)
+            if varName in indigo.variables:
+                var = indigo.variables[varName]
+                # Variables created before the folder option was enabled move into the folder
+                if variables['useFolder'] and var.folderId != folderId:
+                    indigo.variable.moveToFolder(var, value=folderId)
+                varId = var.id
+            else:
+                var = indigo.variable.create(varName, value=varValue, folder=folderId)
+                variables['ids'][varName] = var.id
+                return
+            variables['ids'][varName] = varId
+        
+        indigo.variable.updateValue(varId, value=varValue)
+        
+    def getVariableFolderId(self, variables):
+        """Return the folder for new variables, creating the device's folder once if enabled"""
+        if not variables['useFolder']:
+            return 0
+        
+        if variables['folderId'] is None:
+            folderName = variables['prefix']
+            if folderName in indigo.variables.folders:
+                variables['folderId'] = indigo.variables.folders[folderName].id
+            else:
+                variables['folderId'] = indigo.variables.folder.create(folderName).id
+                self.debugLog(f"Created variable folder {folderName}")
+        return variables['folderId']
+            
+    def executeAppleScript(self, script, args=None):
         """Execute AppleScript and return results as dictionary"""
         try:
-            # Use osascript to execute the script
-            process = subprocess.Popen(
-                ['osascript', '-e', script],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE
-            )
-            stdout, stderr = process.communicate()
+            output, stderr = self.runAppleScript(script, args=args)
             
             if stderr:
-                self.debugLog(f"AppleScript stderr: {stderr.decode('utf-8')}")
+                self.debugLog(f"AppleScript stderr: {stderr}")
                 
             # Parse the output (AppleScript record format)
-            output = stdout.decode('utf-8').strip()
+            output = output.strip()
             
             if not output:
                 return None
@@ -251,63 +924,170 @@ class Plugin(indigo.PluginBase):
             self.errorLog(f"Error executing AppleScript: {str(e)}")
             return None
             
-    def parseAppleScriptRecord(self, record_string):
-        """Parse AppleScript record format into Python dictionary"""
+    def executeJavaScript(self, script):
+        """Execute a JavaScript for Automation script that returns JSON, as a dictionary"""
         try:
-            # Remove outer braces
-            record_string = record_string.strip()
-            if record_string.startswith('{') and record_string.endswith('}'):
-                record_string = record_string[1:-1]
-            
-            result = {}
-            
-            # Split by comma, but be careful with nested structures
-            parts = []
-            current = ""
-            depth = 0
-            in_quotes = False
-            
-            for char in record_string:
-                if char == '"' and (not current or current[-1] != '\\'):
-                    in_quotes = not in_quotes
-                elif not in_quotes:
-                    if char in '{[':
-                        depth += 1
-                    elif char in '}]':
-                        depth -= 1
-                    elif char == ',' and depth == 0:
-                        parts.append(current.strip())
-                        current = ""
-                        continue
-                current += char
-            
-            if current:
-                parts.append(current.strip())
-            
-            # Parse each key:value pair
-            for part in parts:
-                if ':' in part:
-                    key, value = part.split(':', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    # Remove quotes if present
-                    if value.startswith('"') and value.endswith('"'):
-                        value = value[1:-1]
-                    
-                    # Convert to appropriate type
-                    if value.lower() == 'true':
-                        value = True
-                    elif value.lower() == 'false':
-                        value = False
-                    elif value.replace('.', '', 1).replace('-', '', 1).isdigit():
-                        value = float(value) if '.' in value else int(value)
-                    
-                    result[key] = value
+            output, stderr = self.runAppleScript(script, language='JavaScript')
             
-            return result
+            if stderr:
+                self.debugLog(f"JavaScript stderr: {stderr}")
             
+            output = output.strip()
+            if not output:
+                return None
+            
+            result = json.loads(output)
+            # The worker reports a returned string in quoted form
+            if isinstance(result, str):
+                result = json.loads(result)
+            return result if isinstance(result, dict) else None
+            
+        except ValueError as e:
+            self.debugLog(f"Invalid JSON from JavaScript: {str(e)}")
+            return None
         except Exception as e:
+            self.errorLog(f"Error executing JavaScript: {str(e)}")
+            return None
+            
+    def queryPlayer(self, dev, script, javaScript):
+        """Run a status query with the device's backend, falling back to AppleScript"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and devInfo['statusBackend'] == 'jxa':
+            result = self.executeJavaScript(javaScript)
+            if result is not None:
+                devInfo['javaScriptFailures'] = 0
+                return result
+            
+            devInfo['javaScriptFailures'] += 1
+            if devInfo['javaScriptFailures'] >= kMaxJavaScriptFailures:
+                self.errorLog(f"JavaScript status queries keep failing for {dev.name}, using AppleScript")
+                devInfo['statusBackend'] = 'applescript'
+                
+        return self.executeAppleScript(script)
+            
+    def isPlayerRunning(self):
+        """Return whether the app is running, probing at most once per kLivenessTTL for all devices"""
+        with self.livenessLock:
+            if time.time() - self.liveness['checkedAt'] < kLivenessTTL:
+                return self.liveness['running']
+            
+            try:
+                output, error = self.runAppleScript(kScripts['isRunning'])
+            except OSError as e:
+                output, error = '', str(e)
+            if error:
+                self.debugLog(f"Liveness probe failed, assuming the app is running: {error.strip()}")
+                running = True
+            else:
+                running = output.strip() == 'true'
+            self.liveness = {'running': running, 'checkedAt': time.time()}
+            return running
+            
+    def noteLiveness(self, running):
+        """Record liveness learned from a status query, saving the next probe"""
+        with self.livenessLock:
+            self.liveness = {'running': running, 'checkedAt': time.time()}
+            
+    def probePlayer(self):
+        """Return the heartbeat record, used to confirm that an action took effect"""
+        return self.runScript('heartbeat')
+        
+    def breakerChanged(self, state):
+        """Log circuit breaker changes and show them on every device"""
+        if state == 'suspended':
+            self.errorLog(f"{self.pluginDisplayName} is not responding; suspending script calls for {self.breaker.delay} seconds")
+        elif state == 'ok':
+            indigo.server.log(f"{self.pluginDisplayName} is responding again")
+        # This runs on whichever thread made the call, possibly inside a poll
+        # holding its device's lock; each device publishes the new state from
+        # its next poll, brought forward to now
+        now = time.time()
+        for devId in list(self.deviceDict):
+            self.pollScheduler.schedule(devId, now)
+            
+    def runScript(self, name, *args):
+        """Run one of the plugin's named scripts, passing arguments through argv"""
+        return self.executeAppleScript(kScripts[name], [str(arg) for arg in args])
+            
+    def runAppleScript(self, script, language='AppleScript', args=None, timeout=kScriptTimeout):
+        """Run AppleScript (or JavaScript) and return its (output, error) text, guarded by the circuit breaker"""
+        if not self.breaker.allow():
+            return '', kSuspendedError.format(self.pluginDisplayName)
+        try:
+            result = self.invokeScript(script, language, args, timeout)
+        except (ScriptTimeout, ScriptLost) as e:
+            self.breaker.recordFailure()
+            return '', str(e)
+        except Exception:
+            self.breaker.recordFailure()
+            raise
+        self.breaker.recordSuccess()
+        return result
+            
+    def invokeScript(self, script, language, args, timeout):
+        """Run a script in the worker or a one-shot osascript, raising ScriptTimeout past the deadline
+        
+        A script whose worker died after reading it raises ScriptLost instead of
+        running again in a one-shot osascript.
+        """
+        if self.scriptRunner:
+            result = self.scriptRunner.run(script, language, args, timeout)
+            if result is not None:
+                return result
+            
+        # No worker available - fall back to a one-shot osascript process,
+        # running a compiled copy of the script when one is available
+        if language == 'JavaScript':
+            command = ['osascript', '-l', 'JavaScript', '-e', script]
+        else:
+            compiledPath = self.compileScript(script)
+            if compiledPath:
+                command = ['osascript', '-s', 's', compiledPath]
+            else:
+                command = ['osascript', '-s', 's', '-e', script]
+        command += args or []
+        process = subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise ScriptTimeout(f"Script timed out after {timeout:g} seconds")
+        return stdout.decode('utf-8'), stderr.decode('utf-8')
+            
+    def compileScript(self, script):
+        """Compile a script to a .scpt file once and return its path, or None"""
+        with self.compileLock:
+            return self.compileScriptLocked(script)
+            
+    def compileScriptLocked(self, script):
+        """Compile a script unless already compiled; the caller holds compileLock"""
+        if script in self.compiledScripts:
+            return self.compiledScripts[script]
+        
+        path = None
+        try:
+            if not self.scriptFolder:
+                self.scriptFolder = tempfile.mkdtemp(prefix='SpotifyScripts')
+            path = os.path.join(self.scriptFolder, f"{len(self.compiledScripts)}.scpt")
+            subprocess.run(['osacompile', '-o', path, '-e', script],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.debugLog(f"Could not compile script, running from source: {str(e)}")
+            path = None
+        
+        self.compiledScripts[script] = path
+        return path
+            
+    def parseAppleScriptRecord(self, record_string):
+        """Parse AppleScript record format into Python dictionary"""
+        try:
+            return AppleScriptParser(record_string).parseRecord()
+        except ValueError as e:
             self.errorLog(f"Error parsing AppleScript record: {str(e)}")
             return {}
             
@@ -323,81 +1103,57 @@ class Plugin(indigo.PluginBase):
     
     def actionPlay(self, pluginAction, dev):
         """Play action"""
-        script = 'tell application "Spotify" to play'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.queueAction(dev, 'play', expect=('equals', 'playerState', 'playing'))
         
     def actionPause(self, pluginAction, dev):
         """Pause action"""
-        script = 'tell application "Spotify" to pause'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.queueAction(dev, 'pause', expect=('equals', 'playerState', 'paused'))
         
     def actionPlayPause(self, pluginAction, dev):
         """Play/Pause toggle action"""
-        script = 'tell application "Spotify" to playpause'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        # Repeated toggles cancel out in pairs
+        self.coalescer.update(dev, 'playPause', lambda count: (count or 0) + 1)
         
     def actionStop(self, pluginAction, dev):
         """Stop action"""
-        script = 'tell application "Spotify" to pause'
-        self.executeAppleScript(script)
-        # Also set position to 0
-        script = 'tell application "Spotify" to set player position to 0'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        # Pause and rewind in one script
+        self.queueAction(dev, 'stop', expect=('equals', 'playerState', 'paused'))
         
     def actionNextTrack(self, pluginAction, dev):
         """Next track action"""
-        script = 'tell application "Spotify" to next track'
-        self.executeAppleScript(script)
-        time.sleep(0.5)  # Give Spotify time to switch tracks
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'skip', lambda count: (count or 0) + 1)
         
     def actionPreviousTrack(self, pluginAction, dev):
         """Previous track action"""
-        script = 'tell application "Spotify" to previous track'
-        self.executeAppleScript(script)
-        time.sleep(0.5)  # Give Spotify time to switch tracks
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'skip', lambda count: (count or 0) - 1)
         
     def actionSetVolume(self, pluginAction, dev):
         """Set volume action"""
         volume = int(pluginAction.props.get('volume', 50))
-        volume = max(0, min(100, volume))  # Clamp between 0-100
-        script = f'tell application "Spotify" to set sound volume to {volume}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: volume)
         
     def actionVolumeUp(self, pluginAction, dev):
         """Volume up action"""
         amount = int(pluginAction.props.get('amount', 10))
-        currentVolume = int(dev.states.get('soundVolume', 50))
-        newVolume = min(100, currentVolume + amount)
-        script = f'tell application "Spotify" to set sound volume to {newVolume}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: self.pendingOrState(pending, dev, 'soundVolume', 50) + amount)
         
     def actionVolumeDown(self, pluginAction, dev):
         """Volume down action"""
         amount = int(pluginAction.props.get('amount', 10))
-        currentVolume = int(dev.states.get('soundVolume', 50))
-        newVolume = max(0, currentVolume - amount)
-        script = f'tell application "Spotify" to set sound volume to {newVolume}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: self.pendingOrState(pending, dev, 'soundVolume', 50) - amount)
         
     def actionMute(self, pluginAction, dev):
         """Mute action"""
         devInfo = self.deviceDict.get(dev.id)
-        if devInfo:
-            # Store current volume
-            currentVolume = int(dev.states.get('soundVolume', 50))
-            devInfo['previousVolume'] = currentVolume
-        script = 'tell application "Spotify" to set sound volume to 0'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        
+        def mute(pending):
+            # Unmute restores a volume change still being coalesced, not the
+            # last one published; muting twice keeps the volume from before
+            currentVolume = self.pendingOrState(pending, dev, 'soundVolume', 50)
+            if devInfo and currentVolume:
+                devInfo['previousVolume'] = currentVolume
+            return 0
+        self.coalescer.update(dev, 'volume', mute)
         
     def actionUnmute(self, pluginAction, dev):
         """Unmute action"""
@@ -405,60 +1161,80 @@ class Plugin(indigo.PluginBase):
         previousVolume = 50  # Default
         if devInfo and devInfo.get('previousVolume'):
             previousVolume = devInfo['previousVolume']
-        script = f'tell application "Spotify" to set sound volume to {previousVolume}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: previousVolume)
         
     def actionSetPosition(self, pluginAction, dev):
         """Set playback position action"""
         position = int(pluginAction.props.get('position', 0))
-        script = f'tell application "Spotify" to set player position to {position}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'position', lambda pending: position)
         
     def actionSkipForward(self, pluginAction, dev):
         """Skip forward action"""
         seconds = int(pluginAction.props.get('seconds', 10))
-        currentPos = int(dev.states.get('playerPosition', 0))
-        newPos = currentPos + seconds
-        script = f'tell application "Spotify" to set player position to {newPos}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'position', lambda pending: self.pendingOrState(pending, dev, 'playerPosition', 0) + seconds)
         
     def actionSkipBackward(self, pluginAction, dev):
         """Skip backward action"""
         seconds = int(pluginAction.props.get('seconds', 10))
-        currentPos = int(dev.states.get('playerPosition', 0))
-        newPos = max(0, currentPos - seconds)
-        script = f'tell application "Spotify" to set player position to {newPos}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+        self.coalescer.update(dev, 'position', lambda pending: self.pendingOrState(pending, dev, 'playerPosition', 0) - seconds)
         
     def actionSetShuffle(self, pluginAction, dev):
         """Set shuffle action"""
         shuffleState = pluginAction.props.get('shuffleState', 'toggle')
         
         if shuffleState == 'toggle':
-            currentShuffle = dev.states.get('shuffling', False)
-            shuffleState = 'off' if currentShuffle else 'on'
-        
-        shuffleBool = 'true' if shuffleState == 'on' else 'false'
-        script = f'tell application "Spotify" to set shuffling to {shuffleBool}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+            # Toggle the pending value if a toggle is already waiting
+            self.coalescer.update(dev, 'shuffling', lambda pending: not self.pendingOrState(pending, dev, 'shuffling', False))
+        else:
+            self.coalescer.update(dev, 'shuffling', lambda pending: shuffleState == 'on')
         
     def actionSetRepeat(self, pluginAction, dev):
         """Set repeat action"""
         repeatState = pluginAction.props.get('repeatState', 'toggle')
         
         if repeatState == 'toggle':
-            currentRepeat = dev.states.get('repeating', False)
-            repeatState = 'off' if currentRepeat else 'on'
+            self.coalescer.update(dev, 'repeating', lambda pending: not self.pendingOrState(pending, dev, 'repeating', False))
+        else:
+            self.coalescer.update(dev, 'repeating', lambda pending: repeatState == 'on')
+        
+    def pendingOrState(self, pending, dev, key, default):
+        """Return a pending coalesced value, or the mirrored state when nothing is pending"""
+        if pending is not None:
+            return pending
+        return self.mirrorState(dev, key, default)
+        
+    def mirrorState(self, dev, key, default):
+        """Return a state from the in-memory mirror: the value a queued command will set,
+        else the last value published, else the server's copy"""
+        devInfo = self.deviceDict.get(dev.id)
+        with self.mirrorLock:
+            if devInfo and key in devInfo['optimistic']:
+                value = devInfo['optimistic'][key]
+            elif devInfo and key in devInfo['publishedStates']:
+                value = devInfo['publishedStates'][key]
+            else:
+                value = dev.states.get(key, default)
+        return type(default)(value)
         
-        repeatBool = 'true' if repeatState == 'on' else 'false'
-        script = f'tell application "Spotify" to set repeating to {repeatBool}'
-        self.executeAppleScript(script)
-        self.updateSpotifyStatus(dev)
+    def sendCoalesced(self, dev, slot, value):
+        """Queue the settled value of a coalesced command burst"""
+        if slot == 'volume':
+            volume = max(0, min(100, value))
+            self.queueAction(dev, 'setVolume', volume, optimistic={'soundVolume': volume, 'muted': volume == 0})
+        elif slot == 'position':
+            self.queueAction(dev, 'setPosition', max(0, value), optimistic={'playerPosition': max(0, value)})
+        elif slot == 'skip':
+            if value > 0:
+                self.queueAction(dev, 'nextTrack', value, expect=('changes', 'trackId'))
+            elif value < 0:
+                self.queueAction(dev, 'previousTrack', -value, expect=('changes', 'trackId'))
+        elif slot == 'playPause':
+            if value % 2:
+                self.queueAction(dev, 'playPause', expect=('changes', 'playerState'))
+        elif slot == 'shuffling':
+            self.queueAction(dev, 'setShuffling', 'true' if value else 'false', optimistic={'shuffling': bool(value)})
+        elif slot == 'repeating':
+            self.queueAction(dev, 'setRepeating', 'true' if value else 'false', optimistic={'repeating': bool(value)})
         
     def actionPlayTrack(self, pluginAction, dev):
         """Play specific track action"""
@@ -466,40 +1242,28 @@ class Plugin(indigo.PluginBase):
         if trackUri:
             # Convert URL to URI if needed
             trackUri = self.convertToSpotifyUri(trackUri)
-            script = f'tell application "Spotify" to play track "{trackUri}"'
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateSpotifyStatus(dev)
+            self.queueAction(dev, 'playUri', trackUri, expect=('changes', 'trackId'))
         
     def actionPlayPlaylist(self, pluginAction, dev):
         """Play playlist action"""
         playlistUri = pluginAction.props.get('playlistUri', '')
         if playlistUri:
             playlistUri = self.convertToSpotifyUri(playlistUri)
-            script = f'tell application "Spotify" to play track "{playlistUri}"'
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateSpotifyStatus(dev)
+            self.queueAction(dev, 'playUri', playlistUri, expect=('changes', 'trackId'))
         
     def actionPlayAlbum(self, pluginAction, dev):
         """Play album action"""
         albumUri = pluginAction.props.get('albumUri', '')
         if albumUri:
             albumUri = self.convertToSpotifyUri(albumUri)
-            script = f'tell application "Spotify" to play track "{albumUri}"'
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateSpotifyStatus(dev)
+            self.queueAction(dev, 'playUri', albumUri, expect=('changes', 'trackId'))
         
     def actionPlayArtist(self, pluginAction, dev):
         """Play artist action"""
         artistUri = pluginAction.props.get('artistUri', '')
         if artistUri:
             artistUri = self.convertToSpotifyUri(artistUri)
-            script = f'tell application "Spotify" to play track "{artistUri}"'
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateSpotifyStatus(dev)
+            self.queueAction(dev, 'playUri', artistUri, expect=('changes', 'trackId'))
         
     def actionSearchAndPlay(self, pluginAction, dev):
         """Search and play action"""
@@ -507,14 +1271,11 @@ class Plugin(indigo.PluginBase):
         if searchQuery:
             # Use Spotify's search URI format
             searchUri = f'spotify:search:{searchQuery.replace(" ", "+")}'
-            script = f'tell application "Spotify" to play track "{searchUri}"'
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateSpotifyStatus(dev)
+            self.queueAction(dev, 'playUri', searchUri, expect=('changes', 'trackId'))
         
     def actionUpdateNow(self, pluginAction, dev):
         """Force immediate update"""
-        self.updateSpotifyStatus(dev)
+        self.requestRefresh(dev)
         
     def convertToSpotifyUri(self, uri_or_url):
         """Convert Spotify URL to URI format"""
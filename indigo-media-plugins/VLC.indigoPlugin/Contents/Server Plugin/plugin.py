@@ -8,10 +8,489 @@ Provides comprehensive control and monitoring of VLC media player
 import indigo
 import time
 import subprocess
+import json
+import threading
+import itertools
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 import os
+import select
+import base64
+import http.client
+import urllib.parse
+from mediacontrol import (kScriptTimeout, withStatusQuery, ScriptTimeout, ScriptLost, ScriptRunnerPool,
+                          AppleScriptParser, CircuitBreaker, PollScheduler, ActionWorker, CommandCoalescer)
 
 # Constants
 kUpdateFrequencyKey = "updateFrequency"
+kPersistentRunnerKey = "usePersistentRunner"
+
+# Due devices are polled concurrently by up to kPollWorkers threads, one poll
+# per device at a time. Script calls share up to kScriptRunners persistent
+# workers; extra workers are only started when calls actually overlap
+kPollWorkers = 3
+kScriptRunners = 4
+
+# Each device's last published states are saved here on shutdown and shown
+# again at startup until the first live poll replaces them
+kSnapshotFileSuffix = ".snapshot.json"
+
+# A device saved while playing is restored as paused: it is only known to be
+# playing after the first poll, and a restored "playing" would look like playback
+# starting to the Music Manager, whose auto-exclusive mode pauses the other players
+kSnapshotPausedStates = {'playerState': 'paused', 'isPlaying': False, 'isPaused': True, 'isStopped': False}
+
+# Returned for script calls refused while the circuit breaker (see
+# mediacontrol) has suspended calls to the player
+kSuspendedError = u"{} is not responding; script calls are suspended"
+
+# Longest poll interval (seconds) reached by backing off in each idle state.
+# Polling starts at the device's update frequency and doubles on every poll
+# that finds the player still in the same idle state.
+kIdlePollCaps = {
+    'playing': 0,
+    'paused': 5,
+    'stopped': 15,
+    'notRunning': 30
+}
+kMaxIdlePolls = 10
+
+# Seconds between full state pushes; in between only changed states are sent
+kFullResyncInterval = 60
+
+# States that change every poll; their variables are written at most this often (seconds)
+kHighChurnVariables = ('currentTime', 'currentTimeFormatted', 'progressPercent')
+kHighChurnVariableInterval = 5
+
+# Upper bound on how long the poll thread sleeps when no device is due
+kSchedulerMaxWait = 10.0
+# Golden ratio fraction used to spread device poll phases across the interval
+kPhaseSpread = 0.618
+
+# Consecutive failures of the JavaScript status backend before a device
+# falls back to AppleScript for the rest of the session
+kMaxJavaScriptFailures = 3
+
+# The "http" status backend talks to VLC's web interface instead of AppleScript,
+# for status and commands, over one keep-alive connection per device
+kDefaultHttpPort = 8080
+kHttpTimeout = 2.0
+kStepSizes = {'extrashort': 1, 'short': 2, 'medium': 3, 'long': 4}   # Step Size option -> VLC step size
+kHttpStepSeconds = {1: 3, 2: 10, 3: 60, 4: 300}   # VLC's default jump lengths per step size
+kHttpToggles = {          # script -> (VLC toggle command, status record key)
+    'setFullscreen': ('fullscreen', 'fullscreen'),
+    'setLooping': ('pl_loop', 'looping'),
+    'setRandom': ('pl_random', 'randomMode')
+}
+
+
+# JavaScript for Automation version of the status query (optional "jxa"
+# backend). It returns JSON text with the same keys as the AppleScript record.
+kStatusJavaScript = '''
+(function () {
+    var vlc = Application('VLC');
+    if (!vlc.running()) {
+        return JSON.stringify({playing: false, currentTime: 0, duration: 0, mediaName: '', mediaPath: '',
+                               audioVolume: 50, muted: false, fullscreen: false, looping: false,
+                               randomMode: false, notRunning: true});
+    }
+    try {
+        return JSON.stringify({
+            playing: vlc.playing(),
+            currentTime: vlc.currentTime(),
+            duration: vlc.durationOfCurrentItem(),
+            mediaName: vlc.nameOfCurrentItem(),
+            mediaPath: vlc.pathOfCurrentItem(),
+            audioVolume: vlc.audioVolume(),
+            muted: vlc.muted(),
+            fullscreen: vlc.fullscreen(),
+            looping: vlc.looping(),
+            randomMode: vlc.random()
+        });
+    } catch (e) {
+        return JSON.stringify({errorMsg: String(e)});
+    }
+})()
+'''
+
+
+# Bursts of volume, seek, skip and toggle actions for a device are merged and
+# only the settled value is sent once no new one has arrived for the debounce
+# window (plugin preference, seconds), or after mediacontrol.kMaxDebounceWindows windows
+kCommandDebounceKey = "commandDebounce"
+kDefaultCommandDebounce = 0.25
+
+# After an action, a cheap probe is repeated every kActionProbeInterval seconds
+# until the expected change shows up. The deadline adapts to how long each
+# action has taken to show up before (kActionDeadlineFactor x its average),
+# within kActionMinWait..kActionMaxWait.
+kActionProbeInterval = 0.1
+kActionMinWait = 0.5
+kActionMaxWait = 5.0
+kActionDeadlineFactor = 3.0
+
+# The app liveness probe result is shared by all devices for this long (seconds);
+# while the app is down the status query is skipped and this record is used
+kLivenessTTL = 2.0
+kNotRunningStatus = {
+    'playing': False, 'currentTime': 0, 'duration': 0, 'mediaName': '', 'mediaPath': '', 'audioVolume': 50,
+    'muted': False, 'fullscreen': False, 'looping': False, 'randomMode': False, 'notRunning': True
+}
+
+# Named AppleScript sources. Each is compiled once per session, on its first
+# use (by the script runner, or with osacompile for the one-shot fallback), and
+# values are passed through "on run argv" instead of being spliced into the source.
+kScripts = {
+    'isRunning': 'return application id "org.videolan.vlc" is running',
+    'status': '''
+-- "is running" checks the app by bundle ID without System Events or launching it
+if application id "org.videolan.vlc" is running then
+    tell application "VLC"
+        try
+            set isPlaying to playing
+            set currentPos to current time
+            set totalDuration to duration of current item
+            set mediaName to name of current item
+            set mediaPath to path of current item
+            set volLevel to audio volume
+            set isMuted to muted
+            set isFullscreen to fullscreen
+            set isLooping to looping
+            set isRandom to random
+            
+            return {playing:isPlaying, currentTime:currentPos, duration:totalDuration, mediaName:mediaName, mediaPath:mediaPath, audioVolume:volLevel, muted:isMuted, fullscreen:isFullscreen, looping:isLooping, randomMode:isRandom}
+        on error errMsg
+            return {errorMsg:errMsg}
+        end try
+    end tell
+else
+    return {playing:false, currentTime:0, duration:0, mediaName:"", mediaPath:"", audioVolume:50, muted:false, fullscreen:false, looping:false, randomMode:false, notRunning:true}
+end if
+''',
+    'play': 'tell application "VLC" to play',
+    'pause': 'tell application "VLC" to pause',
+    'playPause': 'tell application "VLC" to play pause',
+    'stop': 'tell application "VLC" to stop',
+    'next': '''
+on run argv
+    tell application "VLC"
+        repeat (item 1 of argv) as integer times
+            next
+        end repeat
+    end tell
+end run
+''',
+    'previous': '''
+on run argv
+    tell application "VLC"
+        repeat (item 1 of argv) as integer times
+            previous
+        end repeat
+    end tell
+end run
+''',
+    'mute': 'tell application "VLC" to mute',
+    'stepForward': '''
+on run argv
+    tell application "VLC"
+        repeat (item 1 of argv) as integer times
+            step forward ((item 2 of argv) as integer)
+        end repeat
+    end tell
+end run
+''',
+    'stepBackward': '''
+on run argv
+    tell application "VLC"
+        repeat (item 1 of argv) as integer times
+            step backward ((item 2 of argv) as integer)
+        end repeat
+    end tell
+end run
+''',
+    'setVolume': '''
+on run argv
+    tell application "VLC" to set audio volume to (item 1 of argv) as integer
+end run
+''',
+    'setCurrentTime': '''
+on run argv
+    tell application "VLC" to set current time to (item 1 of argv) as integer
+end run
+''',
+    'setFullscreen': '''
+on run argv
+    set fullscreenState to item 1 of argv
+    tell application "VLC"
+        if fullscreenState is "toggle" then
+            set fullscreen to (not fullscreen)
+        else
+            set fullscreen to (fullscreenState is "true")
+        end if
+    end tell
+end run
+''',
+    'setLooping': '''
+on run argv
+    tell application "VLC" to set looping to (item 1 of argv is "true")
+end run
+''',
+    'setRandom': '''
+on run argv
+    tell application "VLC" to set random to (item 1 of argv is "true")
+end run
+''',
+    # The rate is passed in hundredths so no decimal separator is involved
+    'setPlaybackRate': '''
+on run argv
+    tell application "VLC" to set playback rate to ((item 1 of argv) as integer) / 100
+end run
+''',
+    'openFile': '''
+on run argv
+    tell application "VLC" to open POSIX file (item 1 of argv)
+end run
+''',
+    'openLocation': '''
+on run argv
+    tell application "VLC" to open location (item 1 of argv)
+end run
+''',
+}
+
+
+# Action scripts with the status query appended, run by the action worker
+kActionScripts = dict((name, withStatusQuery(source, kScripts['status']))
+                      for name, source in kScripts.items()
+                      if name not in ('isRunning', 'status'))
+
+
+class VLCHttpError(Exception):
+    """VLC's web interface refused or failed a request"""
+    pass
+
+
+class VLCHttpClient(object):
+    """Client for VLC's web interface (status.json, playlist.json) over one keep-alive connection"""
+    
+    def __init__(self, host, port, password, timeout=kHttpTimeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        # VLC uses basic authentication with an empty user name
+        credentials = base64.b64encode((u":" + password).encode('utf-8')).decode('ascii')
+        self.headers = {'Authorization': 'Basic ' + credentials}
+        # Guards the connection and the fields below; polls and the action
+        # worker share the client. Reentrant so perform() can hold it across a
+        # read-then-toggle
+        self.lock = threading.RLock()
+        self.connection = None
+        self.playlistId = None    # currentplid that mediaPath belongs to
+        self.mediaPath = ''
+        self.unmuteVolume = 256
+        self.failures = 0         # consecutive requests that failed or timed out
+        
+    @property
+    def state(self):
+        """Connection state for the device's connectionState: 'ok', or 'suspended' while requests fail"""
+        with self.lock:
+            return 'suspended' if self.failures else 'ok'
+        
+    def close(self):
+        """Close the kept-alive connection"""
+        with self.lock:
+            self.disconnect()
+            
+    def disconnect(self):
+        """Drop the connection; the next request opens a new one"""
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+            
+    def get(self, path, params=None):
+        """GET a JSON resource over the kept-alive connection
+        
+        A request that fails on a reused connection is retried once on a new one.
+        A command whose reply was lost may already have run, so it is not sent
+        again; the retry reads the plain status instead and the caller sees from
+        it whether the command took effect.
+        """
+        url = path + ('?' + urllib.parse.urlencode(params) if params else '')
+        command = bool(params) and 'command' in params
+        with self.lock:
+            if self.connection is not None and self.connectionDropped():
+                self.disconnect()
+            for attempt in range(2):
+                reused = self.connection is not None
+                sent = False
+                try:
+                    if self.connection is None:
+                        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+                    self.connection.request('GET', url, headers=self.headers)
+                    sent = True
+                    response = self.connection.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError) as e:
+                    self.disconnect()
+                    # Only a stale kept-alive connection is retried; a timeout
+                    # or refusal would just repeat
+                    if attempt or not reused or isinstance(e, TimeoutError):
+                        raise
+                    if sent and command:
+                        url = path
+                    continue
+                if response.status == 401:
+                    raise VLCHttpError(u"VLC web interface rejected the password")
+                if response.status != 200:
+                    raise VLCHttpError(u"VLC web interface returned HTTP {}".format(response.status))
+                return json.loads(body.decode('utf-8'))
+                
+    def connectionDropped(self):
+        """Return whether VLC has closed the idle kept-alive connection"""
+        sock = self.connection.sock
+        if sock is None:
+            return True
+        try:
+            # An idle connection only turns readable when VLC closes it
+            return bool(select.select([sock], [], [], 0)[0])
+        except (OSError, ValueError):
+            return True
+            
+    def pollStatus(self):
+        """Return the player status, and whether it ended a run of failed requests"""
+        with self.lock:
+            failures = self.failures
+            result = self.status()
+            return result, bool(failures) and not self.failures
+        
+    def status(self, params=None):
+        """Return the player status as a status record, running a status.json command first if given
+        
+        An error record's firstFailure says whether it starts a run of failures.
+        """
+        with self.lock:
+            try:
+                reply = self.get('/requests/status.json', params)
+            except ConnectionRefusedError:
+                # VLC is not running (or its web interface is off)
+                self.failures = 0
+                return dict(kNotRunningStatus)
+            except (VLCHttpError, http.client.HTTPException, OSError, ValueError) as e:
+                self.failures += 1
+                return {'errorMsg': str(e), 'firstFailure': self.failures == 1}
+            self.failures = 0
+            return self.statusRecord(reply)
+        
+    def statusRecord(self, reply):
+        """Translate a status.json reply into the plugin's status record; the caller holds the lock"""
+        information = reply.get('information') or {}
+        category = information.get('category') or {} if isinstance(information, dict) else {}
+        meta = category.get('meta') or {} if isinstance(category, dict) else {}
+        
+        length = reply.get('length') or 0
+        # position is a fraction of the length, finer than the whole seconds in time
+        currentTime = (reply.get('position') or 0) * length if length else (reply.get('time') or 0)
+        volume = int(reply.get('volume') or 0)
+        
+        playlistId = reply.get('currentplid', -1)
+        if playlistId != self.playlistId:
+            self.mediaPath = self.lookupMediaPath(playlistId)
+            self.playlistId = playlistId
+        
+        return {
+            'playing': reply.get('state') == 'playing',
+            'currentTime': currentTime,
+            'duration': length,
+            'mediaName': meta.get('title') or meta.get('filename', ''),
+            'mediaPath': self.mediaPath,
+            'audioVolume': volume,
+            'muted': volume == 0,
+            'fullscreen': bool(reply.get('fullscreen')),
+            'looping': bool(reply.get('loop')),
+            'randomMode': bool(reply.get('random'))
+        }
+        
+    def lookupMediaPath(self, playlistId):
+        """Return the path (or URL) of a playlist item; fetched only when the current item changes"""
+        if playlistId is None or playlistId < 0:
+            return ''
+        try:
+            node = self.get('/requests/playlist.json')
+        except (VLCHttpError, http.client.HTTPException, OSError, ValueError):
+            return ''
+        nodes = [node]
+        while nodes:
+            node = nodes.pop()
+            if str(node.get('id')) == str(playlistId) and 'uri' in node:
+                uri = urllib.parse.urlparse(node['uri'])
+                return urllib.parse.unquote(uri.path) if uri.scheme == 'file' else node['uri']
+            nodes.extend(node.get('children') or [])
+        return ''
+        
+    def perform(self, script, args):
+        """Run one of the plugin's named actions and return the status VLC reports after it"""
+        with self.lock:
+            return self.performLocked(script, args)
+            
+    def performLocked(self, script, args):
+        """Run a named action; the caller holds the lock"""
+        if script in kHttpToggles:
+            # VLC only toggles these; read the current value unless toggling anyway
+            command, key = kHttpToggles[script]
+            if args[0] != 'toggle':
+                current = self.status()
+                if 'errorMsg' in current or current.get('notRunning') or current.get(key) == (args[0] == 'true'):
+                    return current
+            return self.status({'command': command})
+        
+        if script == 'mute':
+            # The web interface has no mute; toggle between 0 and the last volume
+            current = self.status()
+            if 'errorMsg' in current or current.get('notRunning'):
+                return current
+            if current['audioVolume']:
+                self.unmuteVolume = current['audioVolume']
+                return self.status({'command': 'volume', 'val': 0})
+            return self.status({'command': 'volume', 'val': self.unmuteVolume})
+        
+        status = None
+        for params in self.commandParams(script, args):
+            status = self.status(params)
+            if 'errorMsg' in status or status.get('notRunning'):
+                break
+        return status
+        
+    def commandParams(self, script, args):
+        """Return the status.json requests for a named action"""
+        count = int(args[0]) if script in ('next', 'previous', 'stepForward', 'stepBackward') else 1
+        if script == 'play':
+            return [{'command': 'pl_play'}]
+        elif script == 'pause':
+            return [{'command': 'pl_forcepause'}]
+        elif script == 'playPause':
+            return [{'command': 'pl_pause'}]
+        elif script == 'stop':
+            return [{'command': 'pl_stop'}]
+        elif script == 'next':
+            return [{'command': 'pl_next'}] * count
+        elif script == 'previous':
+            return [{'command': 'pl_previous'}] * count
+        elif script == 'stepForward':
+            return [{'command': 'seek', 'val': u"+{}".format(count * kHttpStepSeconds[int(args[1])])}]
+        elif script == 'stepBackward':
+            return [{'command': 'seek', 'val': u"-{}".format(count * kHttpStepSeconds[int(args[1])])}]
+        elif script == 'setVolume':
+            return [{'command': 'volume', 'val': int(args[0])}]
+        elif script == 'setCurrentTime':
+            return [{'command': 'seek', 'val': int(args[0])}]
+        elif script == 'setPlaybackRate':
+            return [{'command': 'rate', 'val': int(args[0]) / 100.0}]
+        elif script == 'openFile':
+            return [{'command': 'in_play', 'input': 'file://' + urllib.parse.quote(args[0])}]
+        elif script == 'openLocation':
+            return [{'command': 'in_play', 'input': args[0]}]
+        raise ValueError(u"No web interface command for {}".format(script))
 
 
 class Plugin(indigo.PluginBase):
@@ -21,14 +500,61 @@ class Plugin(indigo.PluginBase):
         super(Plugin, self).__init__(pluginId, pluginDisplayName, pluginVersion, pluginPrefs)
         self.debug = pluginPrefs.get("showDebugInfo", False)
         self.deviceDict = {}
+        self.scriptRunner = None
+        self.scriptFolder = None
+        self.compiledScripts = {}
+        self.liveness = {'running': None, 'checkedAt': 0}
+        self.livenessLock = threading.Lock()
+        self.pollScheduler = PollScheduler()
+        self.pollPool = ThreadPoolExecutor(max_workers=kPollWorkers)
+        self.flightLock = threading.Lock()   # guards each device's polling/queryStarted/followUp
+        self.readSequence = itertools.count(1)   # orders status reads so an older one never overwrites a newer
+        self.compileLock = threading.Lock()
+        self.breaker = CircuitBreaker(self.breakerChanged)
+        self.actionWorker = ActionWorker(self)
+        self.coalescer = CommandCoalescer(self.sendCoalesced, self.getCommandDebounce(pluginPrefs))
+        self.mirrorLock = threading.Lock()
+        self.snapshot = {}        # str(devId) -> {state key: value} from the last run
+        self.snapshotPath = None
+        self.actionLatency = {}   # script name -> average seconds until its effect showed up
         
     def startup(self):
         """Called when plugin starts"""
         self.debugLog(u"VLC Plugin startup called")
+        self.loadSnapshot()
+        if self.pluginPrefs.get(kPersistentRunnerKey, True):
+            self.scriptRunner = ScriptRunnerPool(self, kScriptRunners)
+        self.actionWorker.start()
         
     def shutdown(self):
         """Called when plugin shuts down"""
         self.debugLog(u"VLC Plugin shutdown called")
+        self.coalescer.flushAll()
+        self.actionWorker.stop(kActionMaxWait + 1)
+        self.pollPool.shutdown(wait=True)
+        self.saveSnapshot()
+        for devInfo in list(self.deviceDict.values()):
+            if devInfo['http']:
+                devInfo['http'].close()
+        if self.scriptRunner:
+            self.scriptRunner.stop()
+        if self.scriptFolder:
+            shutil.rmtree(self.scriptFolder, ignore_errors=True)
+        
+    def closedPrefsConfigUi(self, valuesDict, userCancelled):
+        """Apply preference changes that do not need a restart"""
+        if not userCancelled:
+            self.debug = valuesDict.get("showDebugInfo", False)
+            self.coalescer.window = self.getCommandDebounce(valuesDict)
+            
+    def getCommandDebounce(self, prefs):
+        """Return the command debounce window from the plugin preferences, in seconds"""
+        value = prefs.get(kCommandDebounceKey, kDefaultCommandDebounce)
+        try:
+            return max(0.0, float(value))
+        except (TypeError, ValueError):
+            self.errorLog(u"Invalid command debounce '{}', using {}".format(value, kDefaultCommandDebounce))
+            return kDefaultCommandDebounce
         
     def deviceStartComm(self, dev):
         """Called when device communication starts"""
@@ -42,80 +568,332 @@ class Plugin(indigo.PluginBase):
             'device': dev,
             'updateFrequency': updateFreq,
             'lastUpdate': 0,
-            'previousVolume': None  # For mute/unmute
+            'pollInterval': updateFreq,
+            'idlePolls': 0,
+            'lastPlayerState': None,
+            'resetPending': False,
+            'statusBackend': dev.pluginProps.get('statusBackend', 'applescript'),
+            'http': self.makeHttpClient(dev),
+            'javaScriptFailures': 0,
+            'lastStatus': None,
+            'optimistic': {},   # state key -> value expected from a queued command
+            'pollLock': threading.Lock(),   # one publish per device at a time
+            'polling': False,        # a poll is queued or running
+            'queryStarted': False,   # ...and has started its query
+            'followUp': False,       # refresh requested while the query was running
+            'publishedRead': 0,      # readSequence stamp of the last status published
+            'publishedStates': {},
+            'lastFullSync': 0,
+            'variables': None
         }
         
-        # Do initial update
-        self.updateVLCStatus(dev)
+        # Show the last known states at once; the first live poll runs in the
+        # background, offset from the other devices
+        devInfo = self.deviceDict[dev.id]
+        with devInfo['pollLock']:
+            self.restoreSnapshot(dev)
+            self.publishStates(dev, [{'key': 'connectionState', 'value': self.connectionState(devInfo)}])
+        phase = (len(self.deviceDict) * kPhaseSpread) % 1.0
+        devInfo['resetPending'] = True
+        self.pollScheduler.schedule(dev.id, time.time() + devInfo['pollInterval'] * phase)
         
     def deviceStopComm(self, dev):
         """Called when device communication stops"""
         self.debugLog(u"Stopping device: " + dev.name)
-        if dev.id in self.deviceDict:
-            del self.deviceDict[dev.id]
+        devInfo = self.deviceDict.pop(dev.id, None)
+        if devInfo:
+            # Kept for the snapshot written at shutdown
+            with self.mirrorLock:
+                self.snapshot[str(dev.id)] = dict(devInfo['publishedStates'])
+            if devInfo['http']:
+                devInfo['http'].close()
+        self.pollScheduler.cancel(dev.id)
+        
+    def makeHttpClient(self, dev):
+        """Return a web interface client for a device using the HTTP backend, else None"""
+        if dev.pluginProps.get('statusBackend', 'applescript') != 'http':
+            return None
+        try:
+            port = int(dev.pluginProps.get('httpPort', kDefaultHttpPort))
+        except (TypeError, ValueError):
+            self.errorLog(u"Invalid web interface port for {}, using {}".format(dev.name, kDefaultHttpPort))
+            port = kDefaultHttpPort
+        return VLCHttpClient(dev.pluginProps.get('httpHost', '') or '127.0.0.1', port,
+                             dev.pluginProps.get('httpPassword', ''))
+        
+    def loadSnapshot(self):
+        """Read the state snapshot saved by the last run, if any"""
+        self.snapshotPath = os.path.join(indigo.server.getInstallFolderPath(), 'Preferences', 'Plugins',
+                                         self.pluginId + kSnapshotFileSuffix)
+        try:
+            with open(self.snapshotPath) as snapshotFile:
+                self.snapshot = json.load(snapshotFile)
+        except FileNotFoundError:
+            self.snapshot = {}
+        except (OSError, ValueError) as e:
+            self.debugLog(u"Could not read state snapshot: {}".format(str(e)))
+            self.snapshot = {}
+            
+    def restoreSnapshot(self, dev):
+        """Publish a device's states from the snapshot so they show before the first poll"""
+        states = self.snapshot.pop(str(dev.id), None)
+        if states:
+            states.pop('connectionState', None)
+            if states.get('isPlaying'):
+                states.update(kSnapshotPausedStates)
+                if states.get('status', '').startswith(u"▶"):
+                    states['status'] = u"⏸" + states['status'][1:]
+            self.publishStates(dev, [{'key': key, 'value': value} for key, value in states.items()])
+            
+    def saveSnapshot(self):
+        """Write every device's last published states for the next startup"""
+        if not self.snapshotPath:
+            return
+        for devId, devInfo in list(self.deviceDict.items()):
+            with self.mirrorLock:
+                self.snapshot[str(devId)] = dict(devInfo['publishedStates'])
+        # Drop devices that have been deleted
+        deviceIds = set(str(dev.id) for dev in indigo.devices.iter('self'))
+        snapshot = dict((devId, states) for devId, states in self.snapshot.items() if devId in deviceIds)
+        try:
+            tempPath = self.snapshotPath + '.tmp'
+            with open(tempPath, 'w') as snapshotFile:
+                json.dump(snapshot, snapshotFile, separators=(',', ':'))
+            os.replace(tempPath, self.snapshotPath)
+        except (OSError, TypeError, ValueError) as e:
+            self.errorLog(u"Could not save state snapshot: {}".format(str(e)))
             
     def runConcurrentThread(self):
-        """Main plugin loop - updates device states"""
+        """Main plugin loop - updates device states as their poll deadlines come due"""
         try:
             while True:
-                currentTime = time.time()
-                
-                for devId, devInfo in list(self.deviceDict.items()):
-                    dev = devInfo['device']
-                    updateFreq = devInfo['updateFrequency']
-                    lastUpdate = devInfo['lastUpdate']
-                    
-                    # Check if it's time to update this device
-                    if currentTime - lastUpdate >= updateFreq:
-                        self.updateVLCStatus(dev)
-                        devInfo['lastUpdate'] = currentTime
+                for devId in self.pollScheduler.waitForDue(kSchedulerMaxWait):
+                    devInfo = self.deviceDict.get(devId)
+                    if devInfo and self.startFlight(devInfo):
+                        self.pollPool.submit(self.pollTask, devInfo)
                 
-                self.sleep(0.1)  # Short sleep to prevent CPU spinning
+                if self.stopThread:
+                    raise self.StopThread
                 
         except self.StopThread:
             pass
             
-    def updateVLCStatus(self, dev):
-        """Update all VLC status information"""
+    def stopConcurrentThread(self):
+        """Called when the plugin is stopping - wake the poll thread so it can exit"""
+        super(Plugin, self).stopConcurrentThread()
+        self.pollScheduler.wake()
+            
+    def requestRefresh(self, dev):
+        """Ask the poll thread to refresh a device now at the fast poll rate"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo:
+            devInfo['resetPending'] = True
+            self.pollScheduler.schedule(dev.id, time.time())
+            
+    def queueAction(self, dev, script, *args, expect=None, after=None, optimistic=None):
+        """Queue a named script for the action worker so the action handler returns at once
+        
+        expect describes the change that confirms the action in the probe record:
+        ('equals', key, value) or ('changes', key). after runs once the script has run.
+        optimistic maps state keys to the values the command will set; handlers
+        see them in the state mirror until the action has run.
+        """
+        # Coalesced commands given earlier (a toggle still in its debounce
+        # window) go first, so a play, pause or stop cannot overtake them. The
+        # coalescer sends through here too; its own slot is no longer pending
+        self.coalescer.flushDevice(dev.id)
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and optimistic:
+            with self.mirrorLock:
+                devInfo['optimistic'].update(optimistic)
+        self.actionWorker.submit(dev, {'script': script, 'args': args, 'expect': expect, 'after': after,
+                                       'optimistic': optimistic})
+        
+    def settleAction(self, dev, action):
+        """Action worker: drop an action's optimistic values once it has run, unless a later command replaced them"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and action['optimistic']:
+            with self.mirrorLock:
+                for key, value in action['optimistic'].items():
+                    if devInfo['optimistic'].get(key) == value:
+                        del devInfo['optimistic'][key]
+        
+    def performAction(self, dev, action):
+        """Action worker: run one action, wait until its effect shows up, then publish the status"""
+        expect = action['expect']
+        # Skip the confirmation wait when more actions for this device are queued
+        confirm = expect is not None and not self.actionWorker.hasPending(dev.id)
+        before = None
+        if confirm and expect[0] == 'changes':
+            devInfo = self.deviceDict.get(dev.id)
+            before = devInfo and devInfo['lastStatus'] or self.probeDevice(dev)
+        
+        # The action script returns the status read right after the command,
+        # so no separate status query is needed
+        started = time.time()
+        status = self.runAction(dev, action['script'], [str(arg) for arg in action['args']])
+        readStamp = next(self.readSequence)
+        if action['after']:
+            action['after']()
+        
+        if confirm:
+            average = self.actionLatency.get(action['script'], kActionMinWait / kActionDeadlineFactor)
+            deadline = min(kActionMaxWait, max(kActionMinWait, average * kActionDeadlineFactor))
+            while True:
+                elapsed = time.time() - started
+                if status is not None and self.expectationMet(expect, before, status):
+                    self.debugLog(u"{} on {} showed up after {:.2f}s".format(action['script'], dev.name, elapsed))
+                    break
+                if elapsed >= deadline or self.actionWorker.hasPending(dev.id):
+                    self.debugLog(u"{} on {} not confirmed within {:.2f}s".format(action['script'], dev.name, deadline))
+                    break
+                time.sleep(kActionProbeInterval)
+                status = self.probeDevice(dev)
+                readStamp = next(self.readSequence)
+            self.actionLatency[action['script']] = 0.8 * average + 0.2 * elapsed
+            
+        if status is not None:
+            self.pollDevice(dev, reset=True, status=status, readStamp=readStamp)
+        else:
+            self.requestRefresh(dev)
+        
+    def expectationMet(self, expect, before, probe):
+        """Return whether a probe record shows the change an action expects"""
+        if expect[0] == 'equals':
+            return probe.get(expect[1]) == expect[2]
+        return before is not None and probe.get(expect[1]) != before.get(expect[1])
+        
+    def startFlight(self, devInfo):
+        """Claim a due device for the poll pool; returns False if a poll is already in flight
+        
+        Refreshes requested while a poll is queued are served by that poll; one
+        requested while its query is running gets exactly one follow-up query.
+        """
+        with self.flightLock:
+            if not devInfo['polling']:
+                devInfo['polling'] = True
+                devInfo['queryStarted'] = False
+                return True
+            if devInfo['queryStarted']:
+                devInfo['followUp'] = True
+            return False
+            
+    def pollTask(self, devInfo):
+        """Poll pool: poll one device (plus one follow-up if requested meanwhile), then release it"""
+        dev = devInfo['device']
         try:
-            # Build comprehensive AppleScript to get all VLC data
-            script = '''
-            tell application "System Events"
-                set vlcRunning to (name of processes) contains "VLC"
-            end tell
-            
-            if vlcRunning then
-                tell application "VLC"
-                    try
-                        set isPlaying to playing
-                        set currentPos to current time
-                        set totalDuration to duration of current item
-                        set mediaName to name of current item
-                        set mediaPath to path of current item
-                        set volLevel to audio volume
-                        set isMuted to muted
-                        set isFullscreen to fullscreen
-                        set isLooping to looping
-                        set isRandom to random
-                        
-                        return {playing:isPlaying, currentTime:currentPos, duration:totalDuration, mediaName:mediaName, mediaPath:mediaPath, audioVolume:volLevel, muted:isMuted, fullscreen:isFullscreen, looping:isLooping, randomMode:isRandom}
-                    on error errMsg
-                        return {errorMsg:errMsg}
-                    end try
-                end tell
-            else
-                return {playing:false, currentTime:0, duration:0, mediaName:"", mediaPath:"", audioVolume:50, muted:false, fullscreen:false, looping:false, randomMode:false, notRunning:true}
-            end if
-            '''
-            
-            # Execute AppleScript
-            result = self.executeAppleScript(script)
+            while True:
+                with self.flightLock:
+                    devInfo['queryStarted'] = True
+                    devInfo['followUp'] = False
+                self.pollDevice(dev)
+                with self.flightLock:
+                    if not devInfo['followUp']:
+                        devInfo['polling'] = False
+                        return
+        except Exception as e:
+            self.errorLog(u"Exception polling {}: {}".format(dev.name, str(e)))
+            with self.flightLock:
+                devInfo['polling'] = False
+            # popDue already dropped the device's deadline; without a new one it
+            # would never be polled again
+            if self.deviceDict.get(dev.id) is devInfo:
+                self.pollScheduler.schedule(dev.id, time.time() + devInfo['pollInterval'])
+            
+    def pollDevice(self, dev, reset=False, status=None, readStamp=None):
+        """Update status (or publish a record already read) and schedule the next poll from player activity
+        
+        readStamp is the readSequence value taken when status was read; a status
+        read before the last one published is dropped.
+        """
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo is None:
+            return
+        
+        # The status query runs outside the device's lock so the action worker
+        # and notifications are not held up while it waits on the player; the
+        # read stamp taken before it still keeps it from overwriting a newer read
+        if status is None:
+            readStamp = next(self.readSequence)
+            status = self.readVLCStatus(dev)
+        elif readStamp is None:
+            readStamp = next(self.readSequence)
+        
+        # The action worker and notifications publish too; the device's lock
+        # keeps its updates in order
+        with devInfo['pollLock']:
+            if readStamp < devInfo['publishedRead']:
+                # A newer read was published while this one was on its way
+                return
+            devInfo['publishedRead'] = readStamp
+            
+            playerState = None if status is None else self.processStatus(dev, status)
+            
+            if dev.id in self.deviceDict:
+                # Circuit breaker changes show up here, under the device's lock
+                self.publishStates(dev, [{'key': 'connectionState', 'value': self.connectionState(devInfo)}])
+                reset = reset or devInfo['resetPending']
+                devInfo['resetPending'] = False
+                devInfo['lastUpdate'] = time.time()
+                self.adjustPollInterval(devInfo, playerState, reset)
+                self.pollScheduler.schedule(dev.id, devInfo['lastUpdate'] + devInfo['pollInterval'])
+            
+    def adjustPollInterval(self, devInfo, playerState, reset=False):
+        """Back off polling while the player stays idle, snap back on any change"""
+        updateFreq = devInfo['updateFrequency']
+        
+        if reset or playerState == 'playing' or playerState != devInfo['lastPlayerState']:
+            devInfo['idlePolls'] = 0
+        else:
+            devInfo['idlePolls'] = min(kMaxIdlePolls, devInfo['idlePolls'] + 1)
+        devInfo['lastPlayerState'] = playerState
+        
+        # Unknown states (errors) back off like a player that isn't running
+        cap = max(updateFreq, kIdlePollCaps.get(playerState, kIdlePollCaps['notRunning']))
+        devInfo['pollInterval'] = min(cap, updateFreq * (2 ** devInfo['idlePolls']))
+            
+    def readVLCStatus(self, dev):
+        """Read the player's status record, or None while the circuit breaker blocks calls"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and devInfo['http']:
+            result, recovered = devInfo['http'].pollStatus()
+            if recovered:
+                indigo.server.log(u"VLC web interface for {} is responding again".format(dev.name))
+            return result
+        
+        # Leave a player that keeps timing out alone until the breaker retries
+        if self.breaker.blocking():
+            return None
+        
+        # Execute with the device's status backend
+        if self.isPlayerRunning():
+            result = self.queryPlayer(dev, kScripts['status'], kStatusJavaScript)
+        else:
+            # Known to be down - no need to ask. The record is marked so it does
+            # not renew the cached liveness, or a launch would never be seen
+            result = dict(kNotRunningStatus, livenessCached=True)
+        return result
+        
+    def processStatus(self, dev, result):
+        """Publish a status record from a poll or an action and return the player state"""
+        try:
+            if result is not None:
+                devInfo = self.deviceDict.get(dev.id)
+                # A web interface device may be another VLC instance; it says
+                # nothing about the local app. Nor does a record made up from
+                # the cached liveness
+                isRemote = devInfo and devInfo['http']
+                if not (isRemote or result.get('livenessCached')):
+                    self.noteLiveness(not result.get('notRunning', False))
+                if devInfo:
+                    devInfo['lastStatus'] = result
             
             if result and 'errorMsg' not in result:
                 stateList = []
                 
                 # Check if VLC is not running
                 if result.get('notRunning', False):
+                    playerState = 'notRunning'
                     stateList.append({'key': 'playerState', 'value': 'stopped'})
                     stateList.append({'key': 'isPlaying', 'value': False})
                     stateList.append({'key': 'isPaused', 'value': False})
@@ -168,7 +946,10 @@ class Plugin(indigo.PluginBase):
                     
                     # Duration and position
                     duration = int(result.get('duration', 0))
-                    currentTime = int(result.get('currentTime', 0))
+                    # Whole seconds from AppleScript; tenths from the web interface
+                    currentTime = round(float(result.get('currentTime', 0)), 1)
+                    if currentTime.is_integer():
+                        currentTime = int(currentTime)
                     
                     stateList.append({'key': 'duration', 'value': duration})
                     stateList.append({'key': 'durationFormatted', 'value': self.formatTime(duration)})
@@ -210,37 +991,134 @@ class Plugin(indigo.PluginBase):
                     stateList.append({'key': 'status', 'value': status})
                 
                 # Update all states at once
-                dev.updateStatesOnServer(stateList)
+                self.publishStates(dev, stateList)
                 
                 # Update variables if enabled
                 if dev.pluginProps.get('updateVariables', False):
                     self.updateVariables(dev, stateList)
                 
+                return playerState
+                
             else:
                 # Error getting VLC status
                 if result and 'errorMsg' in result:
-                    self.errorLog(u"Error getting VLC status: {}".format(result['errorMsg']))
+                    if not result.get('firstFailure', True):
+                        # Only the first of a run of web interface failures is an error;
+                        # the rest would repeat it on every poll
+                        self.debugLog(u"Error getting VLC status: {}".format(result['errorMsg']))
+                    else:
+                        self.errorLog(u"Error getting VLC status: {}".format(result['errorMsg']))
                 
         except Exception as e:
-            self.errorLog(u"Exception in updateVLCStatus: {}".format(str(e)))
+            self.errorLog(u"Exception in processStatus: {}".format(str(e)))
+        return None
+            
+    def publishStates(self, dev, stateList):
+        """Send only the states that changed since the last update, with a periodic full resync"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo is None:
+            dev.updateStatesOnServer(stateList)
+            return stateList
+        
+        published = devInfo['publishedStates']
+        now = time.time()
+        if now - devInfo['lastFullSync'] >= kFullResyncInterval:
+            changed = stateList
+            devInfo['lastFullSync'] = now
+        else:
+            changed = [state for state in stateList
+                       if state['key'] not in published or published[state['key']] != state['value']]
+        
+        if changed:
+            dev.updateStatesOnServer(changed)
+            # Publishers are serialized by the device's poll lock; the mirror
+            # lock keeps action handlers from reading the cache mid-update
+            with self.mirrorLock:
+                for state in changed:
+                    published[state['key']] = state['value']
+        return changed
             
     def updateVariables(self, dev, stateList):
-        """Update Indigo variables with current states"""
+        """Update Indigo variables with current states, writing only values that changed"""
         try:
-            prefix = dev.pluginProps.get('variablePrefix', 'VLC')
+            devInfo = self.deviceDict.get(dev.id)
+            if devInfo is None:
+                return
             
+            variables = devInfo['variables']
+            if variables is None:
+                variables = devInfo['variables'] = {
+                    'prefix': dev.pluginProps.get('variablePrefix', 'VLC'),
+                    'useFolder': dev.pluginProps.get('variableFolder', False),
+                    'folderId': None,
+                    'names': {},       # state key -> variable name
+                    'ids': {},         # variable name -> variable ID
+                    'values': {},      # variable name -> last written value
+                    'writeTimes': {}   # variable name -> time of last write
+                }
+            
+            now = time.time()
             for state in stateList:
-                varName = prefix + state['key'][0].upper() + state['key'][1:]
+                varName = variables['names'].get(state['key'])
+                if varName is None:
+                    varName = variables['prefix'] + state['key'][0].upper() + state['key'][1:]
+                    variables['names'][state['key']] = varName
                 
-                # Create variable if it doesn't exist
-                if varName not in indigo.variables:
-                    indigo.variable.create(varName, value=str(state['value']), folder=0)
-                else:
-                    indigo.variable.updateValue(varName, value=str(state['value']))
+                varValue = str(state['value'])
+                if variables['values'].get(varName) == varValue:
+                    continue
+                
+                # Fast-moving values are written at most once per interval; the
+                # latest value goes out on the first poll after the interval
+                if (state['key'] in kHighChurnVariables and
+                        now - variables['writeTimes'].get(varName, 0) < kHighChurnVariableInterval):
+                    continue
+                
+                try:
+                    self.writeVariable(variables, varName, varValue)
+                    variables['values'][varName] = varValue
+                    variables['writeTimes'][varName] = now
+                except Exception as e:
+                    # Variable was probably deleted - resolve it again next time
+                    variables['ids'].pop(varName, None)
+                    self.errorLog(u"Exception updating variable {}: {}".format(varName, str(e)))
                     
         except Exception as e:
             self.errorLog(u"Exception in updateVariables: {}".format(str(e)))
             
+    def writeVariable(self, variables, varName, varValue):
+        """Write a variable by cached ID, creating or filing it (and its folder) on first use"""
+        varId = variables['ids'].get(varName)
+        if varId is None:
+            folderId = self.getVariableFolderId(variables)
+            if varName in indigo.variables:
+                var = indigo.variables[varName]
+                # Variables created before the folder option was enabled move into the folder
+                if variables['useFolder'] and var.folderId != folderId:
+                    indigo.variable.moveToFolder(var, value=folderId)
+                varId = var.id
+            else:
+                var = indigo.variable.create(varName, value=varValue, folder=folderId)
+                variables['ids'][varName] = var.id
+                return
+            variables['ids'][varName] = varId
+        
+        indigo.variable.updateValue(varId, value=varValue)
+        
+    def getVariableFolderId(self, variables):
+        """Return the folder for new variables, creating the device's folder once if enabled"""
+        if not variables['useFolder']:
+            return 0
+        
+        if variables['folderId'] is None:
+            folderName = variables['prefix']
+            if folderName in indigo.variables.folders:
+                variables['folderId'] = indigo.variables.folders[folderName].id
+            else:
+                variables['folderId'] = indigo.variables.folder.create(folderName).id
+                self.debugLog(u"Created variable folder {}".format(folderName))
+        return variables['folderId']
+            
     def formatTime(self, seconds):
         """Format seconds as HH:MM:SS or MM:SS"""
         try:
@@ -256,123 +1134,243 @@ class Plugin(indigo.PluginBase):
         except:
             return "0:00"
             
-    def executeAppleScript(self, script):
+    def executeAppleScript(self, script, args=None):
         """Execute AppleScript and return result"""
         try:
-            process = subprocess.Popen(['osascript', '-e', script],
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.PIPE)
-            output, error = process.communicate()
+            output, error = self.runAppleScript(script, args=args)
             
             if error:
-                self.debugLog(u"AppleScript error: {}".format(error.decode('utf-8')))
+                self.debugLog(u"AppleScript error: {}".format(error))
                 return None
             
             # Parse the output
-            result_str = output.decode('utf-8').strip()
+            result_str = output.strip()
             
             if not result_str:
                 return {}
             
             # Parse AppleScript record format
-            result = {}
-            
-            # Remove outer braces
-            if result_str.startswith('{') and result_str.endswith('}'):
-                result_str = result_str[1:-1]
-            
-            # Split by comma, but be careful with nested content
-            parts = []
-            current = ""
-            depth = 0
-            for char in result_str:
-                if char == '{':
-                    depth += 1
-                elif char == '}':
-                    depth -= 1
-                elif char == ',' and depth == 0:
-                    parts.append(current.strip())
-                    current = ""
-                    continue
-                current += char
-            if current:
-                parts.append(current.strip())
-            
-            # Parse each key:value pair
-            for part in parts:
-                if ':' in part:
-                    key, value = part.split(':', 1)
-                    key = key.strip()
-                    value = value.strip()
-                    
-                    # Remove quotes from strings
-                    if value.startswith('"') and value.endswith('"'):
-                        value = value[1:-1]
-                    
-                    # Convert to appropriate type
-                    if value == 'true':
-                        value = True
-                    elif value == 'false':
-                        value = False
-                    elif value.replace('.', '', 1).replace('-', '', 1).isdigit():
-                        if '.' in value:
-                            value = float(value)
-                        else:
-                            value = int(value)
-                    
-                    result[key] = value
-            
-            return result
+            return self.parseAppleScriptRecord(result_str)
             
         except Exception as e:
             self.errorLog(u"Exception in executeAppleScript: {}".format(str(e)))
             return None
             
+    def parseAppleScriptRecord(self, result_str):
+        """Parse AppleScript record output into a dictionary"""
+        try:
+            return AppleScriptParser(result_str).parseRecord()
+        except ValueError as e:
+            self.errorLog(u"Error parsing AppleScript record: {}".format(str(e)))
+            return {}
+            
+    def executeJavaScript(self, script):
+        """Execute a JavaScript for Automation script that returns JSON, as a dictionary"""
+        try:
+            output, error = self.runAppleScript(script, language='JavaScript')
+            
+            if error:
+                self.debugLog(u"JavaScript error: {}".format(error))
+                return None
+            
+            output = output.strip()
+            if not output:
+                return None
+            
+            result = json.loads(output)
+            # The worker reports a returned string in quoted form
+            if isinstance(result, str):
+                result = json.loads(result)
+            return result if isinstance(result, dict) else None
+            
+        except ValueError as e:
+            self.debugLog(u"Invalid JSON from JavaScript: {}".format(str(e)))
+            return None
+        except Exception as e:
+            self.errorLog(u"Exception in executeJavaScript: {}".format(str(e)))
+            return None
+            
+    def queryPlayer(self, dev, script, javaScript):
+        """Run a status query with the device's backend, falling back to AppleScript"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and devInfo['statusBackend'] == 'jxa':
+            result = self.executeJavaScript(javaScript)
+            if result is not None:
+                devInfo['javaScriptFailures'] = 0
+                return result
+            
+            devInfo['javaScriptFailures'] += 1
+            if devInfo['javaScriptFailures'] >= kMaxJavaScriptFailures:
+                self.errorLog(u"JavaScript status queries keep failing for {}, using AppleScript".format(dev.name))
+                devInfo['statusBackend'] = 'applescript'
+                
+        return self.executeAppleScript(script)
+            
+    def isPlayerRunning(self):
+        """Return whether the app is running, probing at most once per kLivenessTTL for all devices"""
+        with self.livenessLock:
+            if time.time() - self.liveness['checkedAt'] < kLivenessTTL:
+                return self.liveness['running']
+            
+            try:
+                output, error = self.runAppleScript(kScripts['isRunning'])
+            except OSError as e:
+                output, error = '', str(e)
+            if error:
+                self.debugLog(u"Liveness probe failed, assuming the app is running: {}".format(error.strip()))
+                running = True
+            else:
+                running = output.strip() == 'true'
+            self.liveness = {'running': running, 'checkedAt': time.time()}
+            return running
+            
+    def noteLiveness(self, running):
+        """Record liveness learned from a status query, saving the next probe"""
+        with self.livenessLock:
+            self.liveness = {'running': running, 'checkedAt': time.time()}
+            
+    def probePlayer(self):
+        """Return the status record, used to confirm that an action took effect"""
+        return self.runScript('status')
+        
+    def probeDevice(self, dev):
+        """Return a device's status record from its web interface, or from AppleScript"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and devInfo['http']:
+            return devInfo['http'].status()
+        return self.probePlayer()
+        
+    def runAction(self, dev, script, args):
+        """Run a named action on a device and return the status read right after it"""
+        devInfo = self.deviceDict.get(dev.id)
+        if devInfo and devInfo['http']:
+            return devInfo['http'].perform(script, args)
+        return self.executeAppleScript(kActionScripts[script], args)
+        
+    def connectionState(self, devInfo):
+        """Return a device's connectionState: its web interface's for the HTTP backend, else the circuit breaker's"""
+        if devInfo['http']:
+            return devInfo['http'].state
+        return self.breaker.state
+        
+    def breakerChanged(self, state):
+        """Log circuit breaker changes and show them on every device"""
+        if state == 'suspended':
+            self.errorLog(u"{} is not responding; suspending script calls for {} seconds".format(self.pluginDisplayName, self.breaker.delay))
+        elif state == 'ok':
+            indigo.server.log(u"{} is responding again".format(self.pluginDisplayName))
+        # This runs on whichever thread made the call, possibly inside a poll
+        # holding its device's lock; each device publishes the new state from
+        # its next poll, brought forward to now
+        now = time.time()
+        for devId, devInfo in list(self.deviceDict.items()):
+            if not devInfo['http']:
+                self.pollScheduler.schedule(devId, now)
+            
+    def runScript(self, name, *args):
+        """Run one of the plugin's named scripts, passing arguments through argv"""
+        return self.executeAppleScript(kScripts[name], [str(arg) for arg in args])
+            
+    def runAppleScript(self, script, language='AppleScript', args=None, timeout=kScriptTimeout):
+        """Run AppleScript (or JavaScript) and return its (output, error) text, guarded by the circuit breaker"""
+        if not self.breaker.allow():
+            return '', kSuspendedError.format(self.pluginDisplayName)
+        try:
+            result = self.invokeScript(script, language, args, timeout)
+        except (ScriptTimeout, ScriptLost) as e:
+            self.breaker.recordFailure()
+            return '', str(e)
+        except Exception:
+            self.breaker.recordFailure()
+            raise
+        self.breaker.recordSuccess()
+        return result
+            
+    def invokeScript(self, script, language, args, timeout):
+        """Run a script in the worker or a one-shot osascript, raising ScriptTimeout past the deadline
+        
+        A script whose worker died after reading it raises ScriptLost instead of
+        running again in a one-shot osascript.
+        """
+        if self.scriptRunner:
+            result = self.scriptRunner.run(script, language, args, timeout)
+            if result is not None:
+                return result
+            
+        # No worker available - fall back to a one-shot osascript process,
+        # running a compiled copy of the script when one is available
+        if language == 'JavaScript':
+            command = ['osascript', '-l', 'JavaScript', '-e', script]
+        else:
+            compiledPath = self.compileScript(script)
+            if compiledPath:
+                command = ['osascript', '-s', 's', compiledPath]
+            else:
+                command = ['osascript', '-s', 's', '-e', script]
+        command += args or []
+        process = subprocess.Popen(command,
+                                 stdout=subprocess.PIPE,
+                                 stderr=subprocess.PIPE)
+        try:
+            output, error = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise ScriptTimeout(u"Script timed out after {:g} seconds".format(timeout))
+        return output.decode('utf-8'), error.decode('utf-8')
+            
+    def compileScript(self, script):
+        """Compile a script to a .scpt file once and return its path, or None"""
+        with self.compileLock:
+            return self.compileScriptLocked(script)
+            
+    def compileScriptLocked(self, script):
+        """Compile a script unless already compiled; the caller holds compileLock"""
+        if script in self.compiledScripts:
+            return self.compiledScripts[script]
+        
+        path = None
+        try:
+            if not self.scriptFolder:
+                self.scriptFolder = tempfile.mkdtemp(prefix='VLCScripts')
+            path = os.path.join(self.scriptFolder, u"{}.scpt".format(len(self.compiledScripts)))
+            subprocess.run(['osacompile', '-o', path, '-e', script],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            self.debugLog(u"Could not compile script, running from source: {}".format(str(e)))
+            path = None
+        
+        self.compiledScripts[script] = path
+        return path
+            
     ########################################
     # Action Handlers
     ########################################
     
     def actionPlay(self, pluginAction, dev):
         """Play action"""
-        script = 'tell application "VLC" to play'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        self.queueAction(dev, 'play', expect=('equals', 'playing', True))
         
     def actionPause(self, pluginAction, dev):
         """Pause action"""
-        script = 'tell application "VLC" to pause'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        self.queueAction(dev, 'pause', expect=('equals', 'playing', False))
         
     def actionPlayPause(self, pluginAction, dev):
         """Play/Pause toggle action"""
-        script = 'tell application "VLC" to play pause'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        # Repeated toggles cancel out in pairs
+        self.coalescer.update(dev, 'playPause', lambda count: (count or 0) + 1)
         
     def actionStop(self, pluginAction, dev):
         """Stop action"""
-        script = 'tell application "VLC" to stop'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        self.queueAction(dev, 'stop', expect=('equals', 'playing', False))
         
     def actionNext(self, pluginAction, dev):
         """Next action"""
-        script = 'tell application "VLC" to next'
-        self.executeAppleScript(script)
-        time.sleep(0.5)
-        self.updateVLCStatus(dev)
+        self.coalescer.update(dev, 'skip', lambda count: (count or 0) + 1)
         
     def actionPrevious(self, pluginAction, dev):
         """Previous action"""
-        script = 'tell application "VLC" to previous'
-        self.executeAppleScript(script)
-        time.sleep(0.5)
-        self.updateVLCStatus(dev)
+        self.coalescer.update(dev, 'skip', lambda count: (count or 0) - 1)
         
     def actionSetVolume(self, pluginAction, dev):
         """Set volume action"""
@@ -380,129 +1378,85 @@ class Plugin(indigo.PluginBase):
         volume = max(0, min(100, volume))
         # VLC volume is 0-256, so convert from 0-100
         vlcVolume = int((volume / 100.0) * 256)
-        script = f'tell application "VLC" to set audio volume to {vlcVolume}'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        self.coalescer.update(dev, 'volume', lambda pending: vlcVolume)
         
     def actionVolumeUp(self, pluginAction, dev):
         """Volume up action"""
         amount = int(pluginAction.props.get('amount', 10))
-        script = 'tell application "VLC" to volumeUp'
-        # Execute multiple times for larger increases
-        times = amount // 10
-        for _ in range(max(1, times)):
-            self.executeAppleScript(script)
-            time.sleep(0.1)
-        self.updateVLCStatus(dev)
+        # One absolute volume command instead of repeated volumeUp steps
+        step = int((amount / 100.0) * 256)
+        self.coalescer.update(dev, 'volume', lambda pending: self.pendingOrState(pending, dev, 'audioVolume', 128) + step)
         
     def actionVolumeDown(self, pluginAction, dev):
         """Volume down action"""
         amount = int(pluginAction.props.get('amount', 10))
-        script = 'tell application "VLC" to volumeDown'
-        # Execute multiple times for larger decreases
-        times = amount // 10
-        for _ in range(max(1, times)):
-            self.executeAppleScript(script)
-            time.sleep(0.1)
-        self.updateVLCStatus(dev)
+        step = int((amount / 100.0) * 256)
+        self.coalescer.update(dev, 'volume', lambda pending: self.pendingOrState(pending, dev, 'audioVolume', 128) - step)
         
     def actionMute(self, pluginAction, dev):
         """Mute action"""
-        devInfo = self.deviceDict.get(dev.id)
-        if devInfo:
-            currentVolume = int(dev.states.get('audioVolume', 50))
-            devInfo['previousVolume'] = currentVolume
-        script = 'tell application "VLC" to mute'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        # A volume change still being coalesced goes out first, so the mute
+        # applies to it and unmute restores it
+        self.coalescer.flush((dev.id, 'volume'))
+        # VLC toggles mute, so only send it if not already muted
+        if not self.mirrorState(dev, 'muted', False):
+            self.queueAction(dev, 'mute', optimistic={'muted': True})
+        else:
+            self.requestRefresh(dev)
         
     def actionUnmute(self, pluginAction, dev):
         """Unmute action"""
-        script = 'tell application "VLC" to mute'  # VLC toggles mute
-        # Check if currently muted
-        if dev.states.get('muted', False):
-            self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        # VLC toggles mute, so only send it if currently muted
+        if self.mirrorState(dev, 'muted', False):
+            self.queueAction(dev, 'mute', optimistic={'muted': False})
+        else:
+            self.requestRefresh(dev)
         
     def actionStepForward(self, pluginAction, dev):
         """Step forward action"""
         step = pluginAction.props.get('step', 'short')
         
-        if step == 'extrashort':
-            script = 'tell application "VLC" to step forward'
-        elif step == 'short':
-            script = 'tell application "VLC" to step forward'
-        elif step == 'medium':
-            script = 'tell application "VLC" to step forward'
-        elif step == 'long':
-            script = 'tell application "VLC" to step forward'
-        
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        # Steps of each size add up separately
+        self.coalescer.update(dev, 'step.' + step, lambda count: (count or 0) + 1)
         
     def actionStepBackward(self, pluginAction, dev):
         """Step backward action"""
         step = pluginAction.props.get('step', 'short')
         
-        script = 'tell application "VLC" to step backward'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        self.coalescer.update(dev, 'step.' + step, lambda count: (count or 0) - 1)
         
     def actionJumpTo(self, pluginAction, dev):
         """Jump to position action"""
         position = int(pluginAction.props.get('position', 0))
-        script = f'tell application "VLC" to set current time to {position}'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        self.coalescer.update(dev, 'position', lambda pending: position)
         
     def actionSetFullscreen(self, pluginAction, dev):
         """Set fullscreen action"""
         fullscreenState = pluginAction.props.get('fullscreenState', 'toggle')
         
         if fullscreenState == 'toggle':
-            script = 'tell application "VLC" to set fullscreen to (not fullscreen)'
-        elif fullscreenState == 'on':
-            script = 'tell application "VLC" to set fullscreen to true'
+            # Toggle the pending value if a toggle is already waiting
+            self.coalescer.update(dev, 'fullscreen', lambda pending: not self.pendingOrState(pending, dev, 'fullscreen', False))
         else:
-            script = 'tell application "VLC" to set fullscreen to false'
-        
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+            self.coalescer.update(dev, 'fullscreen', lambda pending: fullscreenState == 'on')
         
     def actionSetLoop(self, pluginAction, dev):
         """Set loop action"""
         loopState = pluginAction.props.get('loopState', 'toggle')
         
         if loopState == 'toggle':
-            currentLoop = dev.states.get('looping', False)
-            loopState = 'off' if currentLoop else 'on'
-        
-        loopBool = 'true' if loopState == 'on' else 'false'
-        script = f'tell application "VLC" to set looping to {loopBool}'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+            self.coalescer.update(dev, 'looping', lambda pending: not self.pendingOrState(pending, dev, 'looping', False))
+        else:
+            self.coalescer.update(dev, 'looping', lambda pending: loopState == 'on')
         
     def actionSetRandom(self, pluginAction, dev):
         """Set random action"""
         randomState = pluginAction.props.get('randomState', 'toggle')
         
         if randomState == 'toggle':
-            currentRandom = dev.states.get('random', False)
-            randomState = 'off' if currentRandom else 'on'
-        
-        randomBool = 'true' if randomState == 'on' else 'false'
-        script = f'tell application "VLC" to set random to {randomBool}'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+            self.coalescer.update(dev, 'random', lambda pending: not self.pendingOrState(pending, dev, 'random', False))
+        else:
+            self.coalescer.update(dev, 'random', lambda pending: randomState == 'on')
         
     def actionOpenMedia(self, pluginAction, dev):
         """Open media file action"""
@@ -510,19 +1464,13 @@ class Plugin(indigo.PluginBase):
         if mediaPath:
             # Expand home directory if needed
             mediaPath = os.path.expanduser(mediaPath)
-            script = f'tell application "VLC" to open POSIX file "{mediaPath}"'
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateVLCStatus(dev)
+            self.queueAction(dev, 'openFile', mediaPath, expect=('changes', 'mediaPath'))
         
     def actionOpenURL(self, pluginAction, dev):
         """Open URL action"""
         url = pluginAction.props.get('url', '')
         if url:
-            script = f'tell application "VLC" to open location "{url}"'
-            self.executeAppleScript(script)
-            time.sleep(0.5)
-            self.updateVLCStatus(dev)
+            self.queueAction(dev, 'openLocation', url, expect=('changes', 'mediaPath'))
         
     def actionSetPlaybackRate(self, pluginAction, dev):
         """Set playback rate action"""
@@ -537,11 +1485,55 @@ class Plugin(indigo.PluginBase):
         }
         
         playback_rate = rate_map.get(rate, 1.0)
-        script = f'tell application "VLC" to set playback rate to {playback_rate}'
-        self.executeAppleScript(script)
-        time.sleep(0.2)
-        self.updateVLCStatus(dev)
+        self.queueAction(dev, 'setPlaybackRate', int(round(playback_rate * 100)))
+        
+    def pendingOrState(self, pending, dev, key, default):
+        """Return a pending coalesced value, or the mirrored state when nothing is pending"""
+        if pending is not None:
+            return pending
+        return self.mirrorState(dev, key, default)
+        
+    def mirrorState(self, dev, key, default):
+        """Return a state from the in-memory mirror: the value a queued command will set,
+        else the last value published, else the server's copy"""
+        devInfo = self.deviceDict.get(dev.id)
+        with self.mirrorLock:
+            if devInfo and key in devInfo['optimistic']:
+                value = devInfo['optimistic'][key]
+            elif devInfo and key in devInfo['publishedStates']:
+                value = devInfo['publishedStates'][key]
+            else:
+                value = dev.states.get(key, default)
+        return type(default)(value)
+        
+    def sendCoalesced(self, dev, slot, value):
+        """Queue the settled value of a coalesced command burst"""
+        if slot == 'volume':
+            volume = max(0, min(256, value))
+            self.queueAction(dev, 'setVolume', volume, optimistic={'audioVolume': volume})
+        elif slot == 'position':
+            self.queueAction(dev, 'setCurrentTime', max(0, value), optimistic={'currentTime': max(0, value)})
+        elif slot == 'skip':
+            if value > 0:
+                self.queueAction(dev, 'next', value, expect=('changes', 'mediaPath'))
+            elif value < 0:
+                self.queueAction(dev, 'previous', -value, expect=('changes', 'mediaPath'))
+        elif slot.startswith('step.'):
+            size = kStepSizes.get(slot[len('step.'):], kStepSizes['short'])
+            if value > 0:
+                self.queueAction(dev, 'stepForward', value, size)
+            elif value < 0:
+                self.queueAction(dev, 'stepBackward', -value, size)
+        elif slot == 'playPause':
+            if value % 2:
+                self.queueAction(dev, 'playPause', expect=('changes', 'playing'))
+        elif slot == 'fullscreen':
+            self.queueAction(dev, 'setFullscreen', 'true' if value else 'false', optimistic={'fullscreen': bool(value)})
+        elif slot == 'looping':
+            self.queueAction(dev, 'setLooping', 'true' if value else 'false', optimistic={'looping': bool(value)})
+        elif slot == 'random':
+            self.queueAction(dev, 'setRandom', 'true' if value else 'false', optimistic={'random': bool(value)})
         
     def actionUpdateNow(self, pluginAction, dev):
         """Force immediate update"""
-        self.updateVLCStatus(dev)
+        self.requestRefresh(dev)
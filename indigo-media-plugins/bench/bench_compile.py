@@ -0,0 +1,60 @@
+"""Time named scripts compiled once against scripts recompiled on every call
+
+The named-script scheme passes values through "on run argv", so the worker
+compiles each script once and reuses it. Before it, values were spliced into
+the source, so every new value meant a new script to compile. Both run here
+through one persistent ScriptRunner, so the difference is compile time only.
+
+On macOS the real JXA worker compiles real AppleScript. Elsewhere the
+stand-in worker from tests/standins sleeps for the given compile time on each
+request that carries a source (default 10 ms).
+
+Run with: python bench/bench_compile.py [calls] [stand-in compile seconds]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from support import LogRecorder, loadShared, standIn
+
+kNamedScript = '''
+on run argv
+    return {soundVolume:(item 1 of argv) as integer}
+end run
+'''
+kSplicedScript = 'return {{soundVolume:{} as integer}}'
+
+
+def timeCalls(call, calls):
+    """Return the mean seconds per call, after one warm-up call"""
+    call(-1)
+    started = time.perf_counter()
+    for i in range(calls):
+        call(i)
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    compileTime = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    shared = loadShared()
+    onMac = sys.platform == 'darwin'
+    command = None if onMac else standIn('script_worker.py', 0, f'compile={compileTime}')
+
+    runner = shared.ScriptRunner(LogRecorder(), command=command)
+    try:
+        named = timeCalls(lambda value: runner.run(kNamedScript, args=[str(value)]), calls)
+        spliced = timeCalls(lambda value: runner.run(kSplicedScript.format(value)), calls)
+    finally:
+        runner.stop()
+
+    print(f"{calls} calls, {'osascript' if onMac else f'stand-in worker, {compileTime * 1000:g} ms per compile'}")
+    print(f"  compiled once, argv values     {named * 1000:8.2f} ms per call")
+    print(f"  recompiled, spliced values     {spliced * 1000:8.2f} ms per call")
+
+
+if __name__ == '__main__':
+    main()
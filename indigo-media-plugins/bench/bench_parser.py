@@ -0,0 +1,125 @@
+"""Time AppleScriptParser against the character-loop parsers it replaced
+
+Run with: python bench/bench_parser.py
+"""
+
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from support import loadShared
+
+
+def oldSpotifyParser(record_string):
+    """Spotify's parseAppleScriptRecord before the shared parser"""
+    record_string = record_string.strip()
+    if record_string.startswith('{') and record_string.endswith('}'):
+        record_string = record_string[1:-1]
+
+    result = {}
+    parts = []
+    current = ""
+    depth = 0
+    in_quotes = False
+
+    for char in record_string:
+        if char == '"' and (not current or current[-1] != '\\'):
+            in_quotes = not in_quotes
+        elif not in_quotes:
+            if char in '{[':
+                depth += 1
+            elif char in '}]':
+                depth -= 1
+            elif char == ',' and depth == 0:
+                parts.append(current.strip())
+                current = ""
+                continue
+        current += char
+
+    if current:
+        parts.append(current.strip())
+
+    for part in parts:
+        if ':' in part:
+            key, value = part.split(':', 1)
+            key = key.strip()
+            value = value.strip()
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1]
+            if value.lower() == 'true':
+                value = True
+            elif value.lower() == 'false':
+                value = False
+            elif value.replace('.', '', 1).replace('-', '', 1).isdigit():
+                value = float(value) if '.' in value else int(value)
+            result[key] = value
+    return result
+
+
+def oldLoopParser(result_str):
+    """The inline parser in Apple Music's (and, nearly identical, VLC's) executeAppleScript"""
+    result = {}
+    if result_str.startswith('{') and result_str.endswith('}'):
+        result_str = result_str[1:-1]
+
+    parts = []
+    current = ""
+    depth = 0
+    for char in result_str:
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        current += char
+    if current:
+        parts.append(current.strip())
+
+    for part in parts:
+        if ':' in part:
+            key, value = part.split(':', 1)
+            key = key.strip()
+            value = value.strip()
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1]
+            if value == 'true':
+                value = True
+            elif value == 'false':
+                value = False
+            elif value.replace('.', '', 1).isdigit():
+                value = float(value) if '.' in value else int(value)
+            result[key] = value
+    return result
+
+
+kRecords = {
+    'Spotify status': '{playerState:"playing", trackName:"Song, with comma", trackArtist:"A \\"quoted\\" one", '
+                      'trackAlbum:"X", trackDuration:200000, playerPosition:12.5, trackNumber:3, discNumber:1, '
+                      'popularity:40, artworkUrl:"https://i.scdn.co/image/ab67616d0000b273", albumArtist:"AA", '
+                      'spotifyUrl:"spotify:track:1", trackId:"spotify:track:1", soundVolume:60, '
+                      'shuffling:false, repeating:true}',
+    'long values': '{comment:"' + 'x' * 4000 + '", lyrics:"' + 'la, ' * 1000 + '", rating:80}',
+}
+
+
+def main():
+    parser = loadShared().AppleScriptParser
+    candidates = [
+        ('AppleScriptParser', lambda text: parser(text).parseRecord()),
+        ('old Spotify parser', oldSpotifyParser),
+        ('old Apple Music loop', oldLoopParser),
+    ]
+    for label, text in kRecords.items():
+        print(f"{label} ({len(text)} characters)")
+        for name, parse in candidates:
+            runs, total = timeit.Timer(lambda: parse(text)).autorange()
+            print(f"  {name:22s} {total / runs * 1e6:9.1f} us")
+
+
+if __name__ == '__main__':
+    main()
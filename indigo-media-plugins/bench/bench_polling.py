@@ -0,0 +1,73 @@
+"""Poll several devices from the PollScheduler one at a time and through the poll pool
+
+Each poll is a script call through the stand-in worker with a fixed delay,
+standing in for a slow AppleScript query. The report shows how many polls ran
+and how late the latest one started against its deadline.
+
+Run with: python bench/bench_polling.py [devices] [interval] [query seconds] [duration]
+"""
+
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from support import LogRecorder, loadPlugin, loadShared, standIn
+
+
+def poll(shared, devices, interval, query, duration, workers):
+    """Run the scheduler for duration seconds; return (polls, worst lateness)"""
+    scheduler = shared.PollScheduler()
+    runner = shared.ScriptRunnerPool(LogRecorder(), workers, command=standIn('script_worker.py', query))
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    deadlines = {}
+    lateness = []
+    lock = threading.Lock()
+
+    def pollTask(devId):
+        with lock:
+            lateness.append(time.time() - deadlines[devId])
+        runner.run('return 1')
+        deadlines[devId] = time.time() + interval
+        scheduler.schedule(devId, deadlines[devId])
+
+    # Start every worker before timing
+    with ThreadPoolExecutor(max_workers=workers) as warmUp:
+        list(warmUp.map(lambda runner: runner.run('return 1'), runner.runners))
+
+    started = time.time()
+    for devId in range(devices):
+        deadlines[devId] = started + interval * devId / devices
+        scheduler.schedule(devId, deadlines[devId])
+    try:
+        while time.time() - started < duration:
+            for devId in scheduler.waitForDue(0.1):
+                if pool:
+                    pool.submit(pollTask, devId)
+                else:
+                    pollTask(devId)
+    finally:
+        if pool:
+            pool.shutdown(wait=True)
+        runner.stop()
+    return len(lateness), max(lateness)
+
+
+def main():
+    devices = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    interval = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    query = float(sys.argv[3]) if len(sys.argv) > 3 else 0.2
+    duration = float(sys.argv[4]) if len(sys.argv) > 4 else 3
+    plugin = loadPlugin('Spotify')
+
+    print(f"{devices} devices every {interval}s, {query}s per query, {duration}s")
+    for label, workers in (('one at a time', 1), (f'pool of {plugin.kPollWorkers}', plugin.kPollWorkers)):
+        polls, worst = poll(loadShared(), devices, interval, query, duration, workers)
+        print(f"  {label:16} {polls:4} polls, latest start {worst * 1000:7.0f} ms after its deadline")
+
+
+if __name__ == '__main__':
+    main()
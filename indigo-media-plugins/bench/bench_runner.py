@@ -0,0 +1,59 @@
+"""Time script calls through the persistent ScriptRunner worker against one process per call
+
+On macOS this runs a real AppleScript through the JXA worker and through a
+one-shot osascript, as the plugins do. Elsewhere the stand-in worker from
+tests/standins takes osascript's place, which measures the process start-up
+the worker saves but not AppleScript's own compile time.
+
+Run with: python bench/bench_runner.py [calls]
+"""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tests'))
+
+from support import LogRecorder, loadShared, standIn
+
+kScript = 'return {playerState:"playing", soundVolume:60}'
+
+
+def timeCalls(call, calls):
+    """Return the mean seconds per call, after one warm-up call"""
+    call()
+    started = time.perf_counter()
+    for i in range(calls):
+        call()
+    return (time.perf_counter() - started) / calls
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    shared = loadShared()
+    onMac = sys.platform == 'darwin'
+
+    if onMac:
+        runner = shared.ScriptRunner(LogRecorder())
+        oneShot = lambda: subprocess.run(['osascript', '-s', 's', '-e', kScript], capture_output=True, check=True)
+    else:
+        command = standIn('script_worker.py')
+        runner = shared.ScriptRunner(LogRecorder(), command=command)
+        request = json.dumps({'id': 1, 'key': 'bench', 'language': 'AppleScript', 'source': kScript}) + '\n'
+        oneShot = lambda: subprocess.run(command, input=request.encode('utf-8'), capture_output=True, check=True)
+
+    try:
+        worker = timeCalls(lambda: runner.run(kScript), calls)
+    finally:
+        runner.stop()
+    process = timeCalls(oneShot, calls)
+
+    print(f"{calls} calls, {'osascript' if onMac else 'stand-in worker'}")
+    print(f"  persistent worker    {worker * 1000:8.2f} ms per call")
+    print(f"  process per call     {process * 1000:8.2f} ms per call")
+
+
+if __name__ == '__main__':
+    main()
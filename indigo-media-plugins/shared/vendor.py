@@ -0,0 +1,49 @@
+"""Copy the shared helper module into every player plugin bundle
+
+Indigo loads each .indigoPlugin on its own, so every bundle ships its own copy
+of mediacontrol.py next to plugin.py. This file's folder holds the single
+source; run this after changing it. With --check, only report copies that
+differ (exit status 1).
+
+Run with: python shared/vendor.py [--check]
+"""
+
+import os
+import sys
+
+kSharedFolder = os.path.dirname(os.path.abspath(__file__))
+kRepoRoot = os.path.dirname(kSharedFolder)
+kSharedModules = ('mediacontrol.py',)
+kPlayerBundles = ('Spotify', 'AppleMusic', 'VLC')
+
+
+def vendoredPaths(module):
+    """Path of each bundle's copy of a shared module"""
+    return [os.path.join(kRepoRoot, bundle + '.indigoPlugin', 'Contents', 'Server Plugin', module)
+            for bundle in kPlayerBundles]
+
+
+def main():
+    check = '--check' in sys.argv[1:]
+    stale = []
+    for module in kSharedModules:
+        with open(os.path.join(kSharedFolder, module), 'rb') as sourceFile:
+            source = sourceFile.read()
+        for path in vendoredPaths(module):
+            try:
+                with open(path, 'rb') as copyFile:
+                    if copyFile.read() == source:
+                        continue
+            except FileNotFoundError:
+                pass
+            stale.append(path)
+            if not check:
+                with open(path, 'wb') as copyFile:
+                    copyFile.write(source)
+    for path in stale:
+        print(('stale: ' if check else 'updated: ') + os.path.relpath(path, kRepoRoot))
+    return 1 if check and stale else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,32 @@
+"""pytest fixtures for the plugin bundles; run with python -m pytest tests"""
+
+import pytest
+
+from support import LogRecorder, kPlayerBundles, loadPlugin, loadShared, standIn
+
+
+@pytest.fixture
+def shared():
+    """The mediacontrol module holding the helpers every player plugin shares"""
+    return loadShared()
+
+
+@pytest.fixture(params=kPlayerBundles)
+def player(request):
+    """Each player plugin module in turn"""
+    return loadPlugin(request.param)
+
+
+@pytest.fixture
+def recorder():
+    return LogRecorder()
+
+
+@pytest.fixture
+def plugin(player, shared):
+    """A player Plugin (not started) whose scripts go to the stand-in worker"""
+    plugin = player.Plugin('test', 'Test', '1.0', {})
+    plugin.scriptRunner = shared.ScriptRunner(plugin, command=standIn('script_worker.py'))
+    yield plugin
+    plugin.scriptRunner.stop()
+    plugin.pollPool.shutdown()
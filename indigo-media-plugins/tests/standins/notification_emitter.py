@@ -0,0 +1,14 @@
+"""Stand-in for the notification observer: prints each argument as a line, then waits
+
+Arguments are expected to be JSON payloads, as the observer prints them; anything
+else is printed as-is so tests can check that it is skipped.
+
+Usage: notification_emitter.py [line ...]
+"""
+
+import sys
+import time
+
+for line in sys.argv[1:]:
+    print(line, flush=True)
+time.sleep(3600)
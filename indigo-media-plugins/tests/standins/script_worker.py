@@ -0,0 +1,67 @@
+"""Stand-in for the JXA script worker, speaking the same line-delimited JSON protocol
+
+Each reply's output is an AppleScript record (as osascript -s s prints it)
+describing the request, so tests can see whether the source was sent and which
+arguments arrived. Scripts containing CRASH exit the worker and scripts
+containing FAIL return an error. With compile=<seconds>, every request that
+carries a source waits that long, standing in for AppleScript's compile time.
+With log=<path>, the key of every request read is appended to that file.
+
+Usage: script_worker.py [delay seconds] [hang] [compile=seconds] [log=path]
+"""
+
+import json
+import sys
+import time
+
+delay = float(sys.argv[1]) if len(sys.argv) > 1 else 0
+hang = 'hang' in sys.argv[2:]
+compileDelay = 0
+logPath = None
+for option in sys.argv[2:]:
+    if option.startswith('compile='):
+        compileDelay = float(option[len('compile='):])
+    elif option.startswith('log='):
+        logPath = option[len('log='):]
+compiled = {}
+
+
+def asAppleScript(value):
+    """Format a value in AppleScript source form"""
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if value is None:
+        return 'missing value'
+    if isinstance(value, (list, tuple)):
+        return '{' + ', '.join(asAppleScript(item) for item in value) + '}'
+    if isinstance(value, dict):
+        return '{' + ', '.join(key + ':' + asAppleScript(item) for key, item in value.items()) + '}'
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+for line in sys.stdin:
+    request = json.loads(line)
+    if logPath:
+        with open(logPath, 'a') as logFile:
+            logFile.write(request['key'] + '\n')
+    if hang:
+        time.sleep(3600)
+    sourceSent = 'source' in request
+    if sourceSent:
+        time.sleep(compileDelay)
+        compiled[request['key']] = request['source']
+    elif request['key'] not in compiled:
+        reply = {'id': request['id'], 'ok': False, 'error': 'script was never compiled'}
+        print(json.dumps(reply), flush=True)
+        continue
+
+    source = compiled[request['key']]
+    if 'CRASH' in source:
+        sys.exit(1)
+    time.sleep(delay)
+    if 'FAIL' in source:
+        reply = {'id': request['id'], 'ok': False, 'error': 'script failed'}
+    else:
+        output = {'sourceSent': sourceSent, 'language': request['language'], 'args': request.get('args')}
+        reply = {'id': request['id'], 'ok': True, 'output': asAppleScript(output)}
+    print(json.dumps(reply), flush=True)
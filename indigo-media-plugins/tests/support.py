@@ -0,0 +1,110 @@
+"""Helpers for loading the plugin bundles outside Indigo, shared by the tests and bench scripts"""
+
+import importlib.util
+import os
+import sys
+import types
+
+kRepoRoot = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+kStandIns = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'standins')
+kSharedModule = os.path.join(kRepoRoot, 'shared', 'mediacontrol.py')
+kPlayerBundles = ('Spotify', 'AppleMusic', 'VLC')
+
+_plugins = {}
+
+
+class _PluginBase(object):
+    """Just enough of indigo.PluginBase to import plugin.py and construct a Plugin"""
+
+    def __init__(self, pluginId, pluginDisplayName, pluginVersion, pluginPrefs):
+        self.pluginId = pluginId
+        self.pluginDisplayName = pluginDisplayName
+        self.pluginPrefs = pluginPrefs
+        self.debugMessages = []
+        self.errorMessages = []
+
+    def debugLog(self, message):
+        self.debugMessages.append(message)
+
+    def errorLog(self, message):
+        self.errorMessages.append(message)
+
+    def deviceCreated(self, dev):
+        pass
+
+    def deviceUpdated(self, origDev, newDev):
+        pass
+
+    def deviceDeleted(self, dev):
+        pass
+
+
+def installIndigo():
+    """Register a bare indigo module unless the real one is importable (inside Indigo)"""
+    if 'indigo' not in sys.modules:
+        indigo = types.ModuleType('indigo')
+        indigo.PluginBase = _PluginBase
+        sys.modules['indigo'] = indigo
+
+
+def loadShared():
+    """Import shared/mediacontrol.py, the source every bundle vendors, as the mediacontrol module"""
+    if 'mediacontrol' not in sys.modules:
+        spec = importlib.util.spec_from_file_location('mediacontrol', kSharedModule)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        sys.modules['mediacontrol'] = module
+    return sys.modules['mediacontrol']
+
+
+def loadPlugin(name):
+    """Import a bundle's plugin.py (e.g. 'Spotify') as a module, once per session
+
+    Every bundle imports the shared source rather than its vendored copy;
+    test_shared.py checks that the copies match it.
+    """
+    if name not in _plugins:
+        installIndigo()
+        loadShared()
+        path = os.path.join(kRepoRoot, name + '.indigoPlugin', 'Contents', 'Server Plugin', 'plugin.py')
+        spec = importlib.util.spec_from_file_location(name + 'Plugin', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _plugins[name] = module
+    return _plugins[name]
+
+
+def standIn(script, *args):
+    """Command line running one of the stand-in processes in tests/standins"""
+    return [sys.executable, os.path.join(kStandIns, script)] + [str(arg) for arg in args]
+
+
+class LogRecorder(object):
+    """Stands in for the plugin object the helper classes log through"""
+
+    def __init__(self):
+        self.debugMessages = []
+        self.errorMessages = []
+
+    def debugLog(self, message):
+        self.debugMessages.append(message)
+
+    def errorLog(self, message):
+        self.errorMessages.append(message)
+
+
+class StandInDevice(object):
+    """Stands in for an indigo.Device: props in, published states out"""
+
+    def __init__(self, devId, props=None, name=None, pluginId='test', states=None):
+        self.id = devId
+        self.name = name or 'Device {}'.format(devId)
+        self.pluginId = pluginId
+        self.pluginProps = props or {}
+        self.states = dict(states or {})
+        self.updates = []
+
+    def updateStatesOnServer(self, stateList):
+        self.updates.append(stateList)
+        for state in stateList:
+            self.states[state['key']] = state['value']
@@ -0,0 +1,44 @@
+"""Action scripts that return the player status, so an action needs no separate status query"""
+
+from support import StandInDevice
+
+
+def test_status_query_is_appended_as_a_handler(shared):
+    script = shared.withStatusQuery('tell application "Music" to play', 'return {playerState:"playing"}')
+    assert script == ('on run argv\ntell application "Music" to play\n    return playerStatus()\nend run\n\n'
+                      'on playerStatus()\nreturn {playerState:"playing"}\nend playerStatus\n')
+
+
+def test_run_handlers_keep_their_arguments(shared):
+    source = 'on run argv\n    set volume to item 1 of argv\nend run\n'
+    script = shared.withStatusQuery(source, 'return 1')
+    assert script.startswith('on run argv\n    set volume to item 1 of argv\n    return playerStatus()\nend run\n')
+
+
+def test_every_action_script_returns_the_status(player):
+    assert player.kActionScripts
+    for name, script in player.kActionScripts.items():
+        assert script.count('on run argv') == 1, name
+        assert script.count('return playerStatus()') == 1, name
+        assert script.rstrip().endswith('end playerStatus'), name
+
+
+def test_an_action_publishes_the_status_its_script_returned(plugin, monkeypatch):
+    scripts = []
+
+    def invokeScript(script, language, args, timeout):
+        scripts.append(script)
+        return '{playerState:"paused", soundVolume:30}', ''
+
+    monkeypatch.setattr(plugin, 'invokeScript', invokeScript)
+    published = []
+    monkeypatch.setattr(plugin, 'processStatus', lambda dev, status, *metadata: published.append(status))
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    plugin.queueAction(dev, 'pause')
+    plugin.actionWorker.queue.put(None)
+    plugin.actionWorker.run()
+
+    # One script call for the command and its status
+    assert len(scripts) == 1 and 'playerStatus()' in scripts[0]
+    assert published == [{'playerState': 'paused', 'soundVolume': 30}]
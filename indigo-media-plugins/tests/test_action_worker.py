@@ -0,0 +1,111 @@
+"""Queued actions: run off the caller's thread, confirmed with a probe instead of a fixed sleep"""
+
+import threading
+import time
+
+from support import StandInDevice
+
+
+class Player(object):
+    """Stands in for the action scripts and probes: each returns the next record given"""
+
+    def __init__(self, actionResult, probes=()):
+        self.actionResult = actionResult
+        self.probes = list(probes)
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def executeAppleScript(self, script, args=None):
+        self.calls.append(('action', threading.current_thread().name))
+        self.release.wait(5)
+        return self.actionResult
+
+    def probePlayer(self):
+        self.calls.append(('probe', threading.current_thread().name))
+        return self.probes.pop(0) if self.probes else self.actionResult
+
+
+def startDevice(plugin, player, monkeypatch):
+    monkeypatch.setattr(plugin, 'executeAppleScript', player.executeAppleScript)
+    monkeypatch.setattr(plugin, 'probePlayer', player.probePlayer)
+    published = []
+    monkeypatch.setattr(plugin, 'processStatus',
+                        lambda dev, status, *metadata: published.append(status) or status.get('playerState'))
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    return dev, published
+
+
+def test_handlers_return_before_the_action_runs(plugin, monkeypatch):
+    player = Player({'playerState': 'playing'})
+    player.release.clear()
+    dev, published = startDevice(plugin, player, monkeypatch)
+    plugin.actionWorker.start()
+    try:
+        started = time.time()
+        plugin.queueAction(dev, 'play')
+        assert time.time() - started < 0.5
+        assert plugin.actionWorker.hasPending(dev.id) or player.calls
+    finally:
+        player.release.set()
+        plugin.actionWorker.stop(5)
+    assert player.calls == [('action', 'ActionWorker')]
+    assert published == [{'playerState': 'playing'}]
+
+
+def test_an_action_is_confirmed_by_probing(plugin, monkeypatch):
+    player = Player({'playerState': 'paused'}, probes=[{'playerState': 'paused'}, {'playerState': 'playing'}])
+    dev, published = startDevice(plugin, player, monkeypatch)
+    plugin.queueAction(dev, 'playPause', expect=('equals', 'playerState', 'playing'))
+    plugin.actionWorker.queue.put(None)
+    plugin.actionWorker.run()
+    assert [call for call, thread in player.calls] == ['action', 'probe', 'probe']
+    # Only the confirmed status is published
+    assert published == [{'playerState': 'playing'}]
+    assert any('showed up' in message for message in plugin.debugMessages)
+
+
+def test_an_unconfirmed_action_gives_up_at_the_deadline(plugin, player, monkeypatch):
+    stub = Player({'playerState': 'paused'}, probes=[{'playerState': 'paused'}] * 100)
+    dev, published = startDevice(plugin, stub, monkeypatch)
+    monkeypatch.setattr(player, 'kActionMaxWait', 0.3)
+    started = time.time()
+    plugin.queueAction(dev, 'playPause', expect=('equals', 'playerState', 'playing'))
+    plugin.actionWorker.queue.put(None)
+    plugin.actionWorker.run()
+    assert time.time() - started < 1
+    assert any('not confirmed' in message for message in plugin.debugMessages)
+    assert published == [{'playerState': 'paused'}]
+
+
+def test_a_change_is_measured_against_the_last_status(plugin, monkeypatch):
+    player = Player({'track': 'a'}, probes=[{'track': 'b'}])
+    dev, published = startDevice(plugin, player, monkeypatch)
+    plugin.deviceDict[dev.id]['lastStatus'] = {'track': 'a'}
+    plugin.queueAction(dev, 'play', expect=('changes', 'track'))
+    plugin.actionWorker.queue.put(None)
+    plugin.actionWorker.run()
+    assert published == [{'track': 'b'}]
+
+
+def test_queued_actions_skip_the_confirmation_wait(plugin, monkeypatch):
+    player = Player({'playerState': 'paused'})
+    dev, published = startDevice(plugin, player, monkeypatch)
+    for i in range(3):
+        plugin.queueAction(dev, 'playPause', expect=('equals', 'playerState', 'playing'))
+    plugin.actionWorker.queue.put(None)
+    plugin.actionWorker.run()
+    # Only the last action waits for its probes
+    assert [call for call, thread in player.calls][:3] == ['action', 'action', 'action']
+    assert len(published) == 3
+
+
+def test_a_lost_status_asks_for_a_poll(plugin, monkeypatch):
+    player = Player(None)
+    dev, published = startDevice(plugin, player, monkeypatch)
+    plugin.queueAction(dev, 'play')
+    plugin.actionWorker.queue.put(None)
+    plugin.actionWorker.run()
+    assert published == []
+    assert plugin.deviceDict[dev.id]['resetPending']
@@ -0,0 +1,81 @@
+"""Script timeouts and the CircuitBreaker around script calls"""
+
+import time
+
+import pytest
+
+from support import StandInDevice, standIn
+
+
+def test_breaker_opens_after_repeated_failures_and_backs_off(shared):
+    changes = []
+    breaker = shared.CircuitBreaker(changes.append)
+    for i in range(shared.kBreakerThreshold - 1):
+        breaker.recordFailure()
+    assert breaker.allow() and changes == []
+
+    breaker.recordFailure()
+    assert changes == ['suspended']
+    assert breaker.blocking() and not breaker.allow()
+
+    # Once the backoff has passed a single trial call goes through
+    breaker.retryAt = time.time() - 1
+    assert breaker.allow()
+    assert not breaker.allow()
+    assert changes == ['suspended', 'retrying']
+
+    breaker.recordFailure()
+    assert breaker.state == 'suspended'
+    assert breaker.delay == shared.kBreakerBaseDelay * 2
+
+    breaker.retryAt = time.time() - 1
+    breaker.allow()
+    breaker.recordSuccess()
+    assert changes[-1] == 'ok'
+    assert breaker.delay == shared.kBreakerBaseDelay and breaker.allow()
+
+
+def test_hung_worker_times_out_and_is_killed(shared, recorder):
+    runner = shared.ScriptRunner(recorder, command=standIn('script_worker.py', 0, 'hang'))
+    try:
+        started = time.time()
+        with pytest.raises(shared.ScriptTimeout):
+            runner.run('return 1', timeout=0.3)
+        assert time.time() - started < 2
+        assert runner.process is None
+    finally:
+        runner.stop()
+
+
+@pytest.fixture
+def hungPlugin(plugin, shared):
+    plugin.scriptRunner.stop()
+    plugin.scriptRunner = shared.ScriptRunner(plugin, command=standIn('script_worker.py', 0, 'hang'))
+    return plugin
+
+
+def trip(plugin, shared):
+    for i in range(shared.kBreakerThreshold):
+        plugin.runAppleScript('return 1', timeout=0.2)
+
+
+def test_refused_calls_are_logged_once(hungPlugin, shared):
+    trip(hungPlugin, shared)
+    assert hungPlugin.breaker.state == 'suspended'
+    errors = len(hungPlugin.errorMessages)
+    for i in range(5):
+        assert hungPlugin.executeAppleScript('return 1') is None
+    assert len(hungPlugin.errorMessages) == errors
+
+
+def test_breaker_state_is_published_by_the_next_poll(hungPlugin, shared):
+    dev = StandInDevice(1, {'updateFrequency': '10'})
+    hungPlugin.deviceStartComm(dev)
+    assert dev.states['connectionState'] == 'ok'
+
+    trip(hungPlugin, shared)
+    # breakerChanged only brings the poll forward; the poll publishes
+    assert dev.states['connectionState'] == 'ok'
+    assert hungPlugin.pollScheduler.popDue(time.time()) == [1]
+    hungPlugin.pollDevice(dev)
+    assert dev.states['connectionState'] == 'suspended'
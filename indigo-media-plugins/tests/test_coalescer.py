@@ -0,0 +1,165 @@
+"""CommandCoalescer: bursts of commands merge into one settled value per device and slot"""
+
+import threading
+import time
+
+import pytest
+
+from support import StandInDevice, loadPlugin
+
+
+class Device(object):
+    def __init__(self, devId):
+        self.id = devId
+
+
+class Sent(object):
+    """Records what the coalescer sends"""
+
+    def __init__(self):
+        self.calls = []
+        self.event = threading.Event()
+
+    def __call__(self, dev, slot, value):
+        self.calls.append((dev.id, slot, value, time.time()))
+        self.event.set()
+
+    def values(self):
+        return sorted(call[:3] for call in self.calls)
+
+
+class Action(object):
+    def __init__(self, **props):
+        self.props = props
+
+
+def add(step):
+    return lambda pending: (pending or 0) + step
+
+
+def test_no_window_sends_each_command_at_once(shared):
+    sent = Sent()
+    coalescer = shared.CommandCoalescer(sent, 0)
+    coalescer.update(Device(1), 'volume', add(5))
+    coalescer.update(Device(1), 'volume', add(5))
+    assert sent.values() == [(1, 'volume', 5), (1, 'volume', 5)]
+
+
+def test_burst_is_sent_once_with_the_merged_value(shared):
+    sent = Sent()
+    coalescer = shared.CommandCoalescer(sent, 0.1)
+    for i in range(5):
+        coalescer.update(Device(1), 'skip', add(1))
+    coalescer.update(Device(1), 'skip', add(-1))
+    assert sent.calls == []
+    assert sent.event.wait(1)
+    time.sleep(0.15)
+    assert sent.values() == [(1, 'skip', 4)]
+
+
+def test_devices_and_slots_are_kept_apart(shared):
+    sent = Sent()
+    coalescer = shared.CommandCoalescer(sent, 0.05)
+    coalescer.update(Device(1), 'volume', add(1))
+    coalescer.update(Device(2), 'volume', add(2))
+    coalescer.update(Device(1), 'skip', add(3))
+    time.sleep(0.2)
+    assert sent.values() == [(1, 'skip', 3), (1, 'volume', 1), (2, 'volume', 2)]
+
+
+def test_a_steady_stream_is_not_held_back_indefinitely(shared):
+    sent = Sent()
+    window = 0.05
+    coalescer = shared.CommandCoalescer(sent, window)
+    started = time.time()
+    while not sent.calls and time.time() - started < 1:
+        coalescer.update(Device(1), 'volume', add(1))
+        time.sleep(window / 5)
+    assert sent.calls
+    assert sent.calls[0][3] - started < window * (shared.kMaxDebounceWindows + 1)
+
+
+def test_flush_all_sends_pending_values_now(shared):
+    sent = Sent()
+    coalescer = shared.CommandCoalescer(sent, 10)
+    coalescer.update(Device(1), 'position', lambda pending: 42)
+    coalescer.flushAll()
+    assert sent.values() == [(1, 'position', 42)]
+    coalescer.flushAll()
+    assert len(sent.calls) == 1
+
+
+def test_flush_device_sends_only_that_devices_values_oldest_first(shared):
+    sent = Sent()
+    coalescer = shared.CommandCoalescer(sent, 10)
+    coalescer.update(Device(1), 'volume', add(1))
+    coalescer.update(Device(2), 'volume', add(2))
+    coalescer.update(Device(1), 'skip', add(3))
+    coalescer.flushDevice(1)
+    assert [call[:3] for call in sent.calls] == [(1, 'volume', 1), (1, 'skip', 3)]
+    coalescer.flushAll()
+    assert sent.calls[-1][:3] == (2, 'volume', 2)
+
+
+def test_vlc_steps_keep_their_size():
+    vlc = loadPlugin('VLC')
+    plugin = vlc.Plugin('test', 'Test', '1.0', {vlc.kCommandDebounceKey: '0'})
+    queued = []
+    plugin.queueAction = lambda dev, script, *args, **kwargs: queued.append((script,) + args)
+    try:
+        plugin.actionStepForward(Action(step='long'), Device(1))
+        plugin.actionStepBackward(Action(step='extrashort'), Device(1))
+    finally:
+        plugin.pollPool.shutdown()
+    assert queued == [('stepForward', 1, vlc.kStepSizes['long']), ('stepBackward', 1, vlc.kStepSizes['extrashort'])]
+
+
+@pytest.fixture
+def debounced(request):
+    """A player plugin with a long debounce window, recording the actions it queues"""
+    module = loadPlugin(request.param)
+    plugin = module.Plugin('test', 'Test', '1.0', {module.kCommandDebounceKey: '10'})
+    plugin.queued = []
+    plugin.queueAction = lambda dev, script, *args, **kwargs: plugin.queued.append((script,) + args)
+    yield plugin
+    plugin.pollPool.shutdown()
+
+
+@pytest.mark.parametrize('debounced', ['Spotify', 'AppleMusic'], indirect=True)
+def test_unmute_restores_a_volume_still_being_coalesced(debounced):
+    plugin = debounced
+    dev = StandInDevice(1, states={'soundVolume': 30})
+    plugin.deviceStartComm(dev)
+    plugin.actionSetVolume(Action(volume=70), dev)
+    plugin.actionMute(Action(), dev)
+    plugin.actionMute(Action(), dev)
+    plugin.coalescer.flushAll()
+    plugin.actionUnmute(Action(), dev)
+    plugin.coalescer.flushAll()
+    assert plugin.queued == [('setVolume', 0), ('setVolume', 70)]
+
+
+@pytest.mark.parametrize('debounced', ['VLC'], indirect=True)
+def test_vlc_sends_a_pending_volume_before_muting(debounced):
+    plugin = debounced
+    dev = StandInDevice(1, states={'audioVolume': 128, 'muted': False})
+    plugin.deviceStartComm(dev)
+    plugin.actionSetVolume(Action(volume=50), dev)
+    plugin.actionMute(Action(), dev)
+    assert plugin.queued == [('setVolume', 128), ('mute',)]
+
+
+def test_a_command_sent_at_once_runs_after_a_pending_toggle(player):
+    plugin = player.Plugin('test', 'Test', '1.0', {player.kCommandDebounceKey: '10'})
+    submitted = []
+    plugin.actionWorker.submit = lambda dev, action: submitted.append(action['script'])
+    try:
+        dev = StandInDevice(1)
+        plugin.deviceStartComm(dev)
+        plugin.actionPlayPause(Action(), dev)
+        plugin.actionStop(Action(), dev)
+    finally:
+        plugin.pollPool.shutdown()
+    # The toggle is not held back behind the stop
+    assert submitted == ['playPause', 'stop']
+    assert plugin.coalescer.pending == {}
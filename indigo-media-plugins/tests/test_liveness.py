@@ -0,0 +1,78 @@
+"""App liveness: one probe shared by all devices, and no status query while the app is down"""
+
+from support import StandInDevice
+
+
+class Probe(object):
+    """Stands in for runAppleScript answering the isRunning script"""
+
+    def __init__(self, output='false'):
+        self.output = output
+        self.error = ''
+        self.calls = 0
+
+    def __call__(self, script, *args, **kwargs):
+        self.calls += 1
+        return self.output, self.error
+
+
+def startDevice(plugin):
+    probe = Probe()
+    plugin.runAppleScript = probe
+    queries = []
+    plugin.queryPlayer = lambda dev, script, javaScript: queries.append(dev.id) or {'playerState': 'playing'}
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    return dev, probe, queries
+
+
+def expire(plugin, player):
+    plugin.liveness['checkedAt'] -= player.kLivenessTTL
+
+
+def test_probe_is_shared_until_it_expires(plugin, player):
+    dev, probe, queries = startDevice(plugin)
+    assert not plugin.isPlayerRunning()
+    assert not plugin.isPlayerRunning()
+    assert probe.calls == 1
+
+    expire(plugin, player)
+    probe.output = 'true'
+    assert plugin.isPlayerRunning()
+    assert probe.calls == 2
+
+
+def test_a_failed_probe_assumes_the_app_is_running(plugin):
+    dev, probe, queries = startDevice(plugin)
+    probe.error = 'execution error'
+    assert plugin.isPlayerRunning()
+    assert any('Liveness probe failed' in message for message in plugin.debugMessages)
+
+
+def test_polls_skip_the_query_while_the_app_is_down(plugin):
+    dev, probe, queries = startDevice(plugin)
+    for i in range(3):
+        plugin.pollDevice(dev)
+    assert probe.calls == 1 and queries == []
+    assert plugin.deviceDict[dev.id]['lastStatus']['notRunning']
+
+
+def test_cached_not_running_status_does_not_renew_the_probe(plugin, player):
+    dev, probe, queries = startDevice(plugin)
+    plugin.pollDevice(dev)
+    checkedAt = plugin.liveness['checkedAt']
+    plugin.pollDevice(dev)
+    assert plugin.liveness['checkedAt'] == checkedAt
+
+    # Once the probe expires, the next poll sees the app that was launched
+    expire(plugin, player)
+    probe.output = 'true'
+    plugin.pollDevice(dev)
+    assert probe.calls == 2 and queries == [dev.id]
+
+
+def test_a_real_status_saves_the_next_probe(plugin, player):
+    dev, probe, queries = startDevice(plugin)
+    plugin.processStatus(dev, {'playerState': 'playing'})
+    assert plugin.isPlayerRunning()
+    assert probe.calls == 0
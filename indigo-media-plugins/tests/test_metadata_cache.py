@@ -0,0 +1,105 @@
+"""Track metadata: fetched once per track and kept in a small LRU cache"""
+
+import pytest
+
+from support import StandInDevice, loadPlugin
+
+# Per plugin: the status record key identifying the track, and the key of a failed query
+kTrackKeys = {'Spotify': ('trackId', 'error'), 'AppleMusic': ('persistentId', 'errorMsg')}
+
+
+class Player(object):
+    """Answers metadata queries for the current track and counts them"""
+
+    def __init__(self, plugin, idKey, errorKey):
+        self.plugin = plugin
+        self.idKey = idKey
+        self.errorKey = errorKey
+        self.track = None
+        self.failing = False
+        self.queries = []
+
+    def __call__(self, dev, script, javaScript):
+        self.queries.append(self.track)
+        if self.failing:
+            return {self.errorKey: 'Player got an error'}
+        return {self.idKey: self.track, 'trackName': 'Song ' + self.track, 'trackArtist': 'Band'}
+
+    def poll(self, dev, track):
+        """Publish a heartbeat record for a track, as a poll does"""
+        self.track = track
+        status = {'playerState': 'playing', self.idKey: track}
+        self.plugin.pollDevice(dev, status=status, readStamp=next(self.plugin.readSequence))
+
+
+@pytest.fixture(params=sorted(kTrackKeys))
+def metadataPlayer(request, monkeypatch):
+    plugin = loadPlugin(request.param).Plugin('test', 'Test', '1.0', {})
+    player = Player(plugin, *kTrackKeys[request.param])
+    monkeypatch.setattr(plugin, 'queryPlayer', player)
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    yield player, dev
+    plugin.pollPool.shutdown()
+
+
+def test_lru_cache_evicts_the_least_recently_used(shared):
+    cache = shared.LRUCache(2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    cache.discard('a')
+    assert cache.get('a') is None
+
+
+def test_metadata_is_fetched_once_per_track(metadataPlayer):
+    player, dev = metadataPlayer
+    for track in ('1', '1', '1', '2', '2', '1'):
+        player.poll(dev, track)
+    assert player.queries == ['1', '2']
+    assert dev.states['trackName'] == 'Song 1'
+
+
+def test_failed_fetches_are_not_cached(metadataPlayer):
+    player, dev = metadataPlayer
+    player.failing = True
+    player.poll(dev, '1')
+    player.failing = False
+    player.poll(dev, '1')
+    player.poll(dev, '1')
+    assert player.queries == ['1', '1']
+    assert dev.states['trackName'] == 'Song 1'
+
+
+def test_cache_is_bounded(metadataPlayer):
+    player, dev = metadataPlayer
+    size = player.plugin.metadataCache.maxSize
+    for track in range(size + 1):
+        player.poll(dev, str(track))
+    player.poll(dev, '0')
+    assert player.queries == [str(track) for track in range(size + 1)] + ['0']
+
+
+def test_setting_a_rating_drops_the_cached_metadata(monkeypatch):
+    plugin = loadPlugin('AppleMusic').Plugin('test', 'Test', '1.0', {})
+    player = Player(plugin, *kTrackKeys['AppleMusic'])
+    monkeypatch.setattr(plugin, 'queryPlayer', player)
+    queued = []
+    monkeypatch.setattr(plugin, 'queueAction', lambda dev, script, *args, **kwargs: queued.append(kwargs))
+    dev = StandInDevice(1)
+    try:
+        plugin.deviceStartComm(dev)
+        player.poll(dev, '1')
+
+        class Action(object):
+            props = {'rating': 80}
+
+        plugin.actionSetRating(Action(), dev)
+        queued[0]['after']()
+        player.poll(dev, '1')
+    finally:
+        plugin.pollPool.shutdown()
+    assert player.queries == ['1', '1']
@@ -0,0 +1,269 @@
+"""MusicManager: source device changes, auto-exclusive pauses, source lookups, device pickers and fan-out"""
+
+import copy
+import sys
+import threading
+import time
+
+import pytest
+
+from support import StandInDevice, loadPlugin
+
+kSpotify = 'com.indigodomo.spotify'
+kAppleMusic = 'com.indigodomo.applemusic'
+kVLC = 'com.indigodomo.vlc'
+
+
+class Server(object):
+    """Stands in for indigo.devices, indigo.device and indigo.server"""
+
+    def __init__(self):
+        self.devices = {}
+        self.fetches = []     # device IDs passed to indigo.devices.get
+        self.iterations = []  # plugin IDs passed to indigo.devices.iter
+        self.executed = []    # (device ID, action, thread name)
+        self.executeDelay = 0
+        self.executedEvent = threading.Event()
+
+    def add(self, dev):
+        self.devices[dev.id] = dev
+        return dev
+
+    # indigo.devices
+    def get(self, devId):
+        self.fetches.append(devId)
+        return self.devices.get(devId)
+
+    def iter(self, pluginId):
+        self.iterations.append(pluginId)
+        return [dev for dev in self.devices.values() if dev.pluginId == pluginId]
+
+    def subscribeToChanges(self):
+        pass
+
+    # indigo.device
+    def execute(self, dev, action, props=None):
+        time.sleep(self.executeDelay)
+        self.executed.append((dev.id, action, threading.current_thread().name))
+        self.executedEvent.set()
+
+    # indigo.server
+    def getPlugin(self, pluginId):
+        return self
+
+    def isEnabled(self):
+        return True
+
+
+@pytest.fixture
+def server(monkeypatch):
+    loadPlugin('MusicManager')
+    server = Server()
+    indigo = sys.modules['indigo']
+    for name in ('devices', 'device', 'server'):
+        monkeypatch.setattr(indigo, name, server, raising=False)
+    return server
+
+
+@pytest.fixture
+def manager(server):
+    manager = loadPlugin('MusicManager').Plugin('test', 'Test', '1.0', {})
+    yield manager
+    manager.actionPool.shutdown(wait=True)
+
+
+def sources(server, spotify=None, appleMusic=None, vlc=None):
+    """Add one source device per service, with the given states"""
+    return (server.add(StandInDevice(1, pluginId=kSpotify, states=spotify or {'isPlaying': False})),
+            server.add(StandInDevice(2, pluginId=kAppleMusic, states=appleMusic or {'isPlaying': False})),
+            server.add(StandInDevice(3, pluginId=kVLC, states=vlc or {'isPlaying': False})))
+
+
+def startManager(manager, server, devId=100, **props):
+    props = dict({'spotifyDeviceId': '1', 'appleMusicDeviceId': '2', 'vlcDeviceId': '3'}, **props)
+    dev = server.add(StandInDevice(devId, props))
+    manager.deviceStartComm(dev)
+    return dev
+
+
+def update(manager, server, dev, **states):
+    """Change a source device's states on the server and report it as Indigo does"""
+    newDev = copy.deepcopy(dev)
+    newDev.states.update(states)
+    server.devices[dev.id] = newDev
+    manager.deviceUpdated(dev, newDev)
+    return newDev
+
+
+def test_a_source_change_is_read_from_the_update_itself(manager, server):
+    spotify, appleMusic, vlc = sources(server)
+    dev = startManager(manager, server)
+    del server.fetches[:]
+
+    update(manager, server, spotify, isPlaying=True, trackName='Song')
+    assert dev.states['spotifyPlaying'] and dev.states['trackName'] == 'Song'
+    # The changed device comes from the callback, the others from the cache
+    assert server.fetches == []
+
+
+def test_auto_exclusive_pauses_do_not_block_the_callback(manager, server):
+    spotify, appleMusic, vlc = sources(server, appleMusic={'isPlaying': True})
+    dev = startManager(manager, server)
+    server.executeDelay = 0.5
+
+    started = time.time()
+    update(manager, server, spotify, isPlaying=True)
+    assert time.time() - started < server.executeDelay
+    assert dev.states['activeService'] == 'spotify' and not dev.states['appleMusicPlaying']
+
+    assert server.executedEvent.wait(5)
+    assert [(devId, action) for devId, action, thread in server.executed] == [(2, 'pause')]
+    assert server.executed[0][2] != threading.current_thread().name
+
+
+def test_safety_pass_fetches_sources_again(manager, server):
+    spotify, appleMusic, vlc = sources(server)
+    dev = startManager(manager, server)
+    # An update the manager never heard about
+    server.devices[1] = StandInDevice(1, pluginId=kSpotify, states={'isPlaying': True})
+    manager.updateMusicStatus(dev)
+    assert not dev.states['spotifyPlaying']
+
+    manager.sourceDevices = {}
+    manager.updateMusicStatus(dev)
+    assert dev.states['spotifyPlaying']
+
+
+def test_source_changes_reach_exactly_the_managers_using_them(manager, server):
+    spotify, appleMusic, vlc = sources(server)
+    both = startManager(manager, server, 100)
+    spotifyOnly = startManager(manager, server, 101, appleMusicDeviceId='', vlcDeviceId='')
+    vlcOnly = startManager(manager, server, 102, spotifyDeviceId='', appleMusicDeviceId='')
+    assert manager.sourceIndex == {1: {100, 101}, 2: {100}, 3: {100, 102}}
+
+    update(manager, server, spotify, isPlaying=True)
+    assert both.states['spotifyPlaying'] and spotifyOnly.states['spotifyPlaying']
+    assert not vlcOnly.states['spotifyPlaying']
+
+    # Unwatched states do not recompute anything
+    updates = len(both.updates)
+    update(manager, server, server.devices[1], popularity=10)
+    assert len(both.updates) == updates
+
+
+def test_editing_a_manager_moves_it_in_the_index(manager, server):
+    sources(server)
+    dev = startManager(manager, server)
+    newDev = copy.deepcopy(dev)
+    newDev.pluginProps = dict(dev.pluginProps, spotifyDeviceId='')
+    manager.deviceUpdated(dev, newDev)
+    assert 1 not in manager.sourceIndex and manager.sourceIndex[2] == {100}
+
+    manager.deviceStopComm(newDev)
+    assert manager.sourceIndex == {}
+
+
+def test_devices_of_other_plugins_are_ignored(manager, server):
+    sources(server)
+    dev = startManager(manager, server)
+    updates = len(dev.updates)
+    # Same ID as an indexed source, but not a player plugin's device
+    other = StandInDevice(1, pluginId='com.example.other', states={'isPlaying': False})
+    manager.deviceUpdated(other, StandInDevice(1, pluginId='com.example.other', states={'isPlaying': True}))
+    assert len(dev.updates) == updates
+    assert 1 not in manager.sourceDevices or manager.sourceDevices[1].pluginId == kSpotify
+
+
+def test_invalid_source_setting_is_logged_not_fatal(manager, server):
+    sources(server)
+    dev = startManager(manager, server, spotifyDeviceId='garbled')
+    assert any('spotifyDeviceId' in message for message in manager.errorMessages)
+    assert manager.sourceIndex == {2: {100}, 3: {100}}
+    assert dev.states['activeService'] == 'applemusic'
+
+
+def test_device_pickers_are_cached_per_plugin(manager, server):
+    sources(server)
+    assert manager.getSpotifyDeviceList() == [(1, 'Device 1')]
+    assert manager.getSpotifyDeviceList() == [(1, 'Device 1')]
+    assert manager.getVLCDeviceList() == [(3, 'Device 3')]
+    assert server.iterations == [kSpotify, kVLC]
+
+    # Callers get a copy they may change
+    manager.getSpotifyDeviceList().append((9, 'Other'))
+    assert manager.getSpotifyDeviceList() == [(1, 'Device 1')]
+
+
+def test_creating_or_deleting_a_device_refreshes_its_plugins_picker(manager, server):
+    spotify, appleMusic, vlc = sources(server)
+    manager.getSpotifyDeviceList()
+    manager.getVLCDeviceList()
+
+    manager.deviceCreated(server.add(StandInDevice(4, pluginId=kSpotify)))
+    assert manager.getSpotifyDeviceList() == [(1, 'Device 1'), (4, 'Device 4')]
+    del server.devices[1]
+    manager.deviceDeleted(spotify)
+    assert manager.getSpotifyDeviceList() == [(4, 'Device 4')]
+    manager.getVLCDeviceList()
+    assert server.iterations == [kSpotify, kVLC, kSpotify, kSpotify]
+
+
+def test_renaming_a_device_refreshes_its_plugins_picker(manager, server):
+    spotify, appleMusic, vlc = sources(server)
+    manager.getAppleMusicDeviceList()
+    update(manager, server, appleMusic, isPlaying=True)
+    manager.getAppleMusicDeviceList()
+    assert server.iterations == [kAppleMusic]
+
+    renamed = copy.deepcopy(server.devices[2])
+    renamed.name = 'Living Room'
+    server.devices[2] = renamed
+    manager.deviceUpdated(appleMusic, renamed)
+    assert manager.getAppleMusicDeviceList() == [(2, 'Living Room')]
+
+
+class Action(object):
+    def __init__(self, **props):
+        self.props = props
+
+
+def test_stop_reaches_every_service_at_once(manager, server):
+    sources(server)
+    dev = startManager(manager, server)
+    server.executeDelay = 0.3
+    started = time.time()
+    manager.actionStop(Action(), dev)
+    assert time.time() - started < 2 * server.executeDelay
+    assert sorted((devId, action) for devId, action, thread in server.executed) == [
+        (1, 'stop'), (2, 'stop'), (3, 'stop')]
+    assert len(set(thread for devId, action, thread in server.executed)) == 3
+
+
+def test_switching_pauses_the_other_services(manager, server):
+    sources(server)
+    dev = startManager(manager, server)
+    manager.actionSwitchToVLC(Action(), dev)
+    assert sorted((devId, action) for devId, action, thread in server.executed) == [(1, 'pause'), (2, 'pause')]
+    assert dev.states['activeService'] == 'vlc'
+
+    del server.executed[:]
+    manager.actionSwitchToSpotify(Action(pauseOther=False), dev)
+    assert server.executed == []
+
+
+def test_a_single_target_runs_on_the_callers_thread(manager, server):
+    sources(server)
+    dev = startManager(manager, server, spotifyDeviceId='', appleMusicDeviceId='')
+    manager.actionStop(Action(), dev)
+    assert server.executed == [(3, 'stop', threading.current_thread().name)]
+
+
+def test_slow_services_are_given_up_on_at_the_deadline(manager, server, monkeypatch):
+    sources(server)
+    dev = startManager(manager, server)
+    monkeypatch.setattr(loadPlugin('MusicManager'), 'kFanOutDeadline', 0.1)
+    server.executeDelay = 0.5
+    started = time.time()
+    manager.actionStop(Action(), dev)
+    assert time.time() - started < server.executeDelay
+    assert len([message for message in manager.errorMessages if 'Timed out sending stop' in message]) == 3
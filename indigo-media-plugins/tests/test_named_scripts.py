@@ -0,0 +1,22 @@
+"""Named scripts: constant sources run by name, with values passed through argv"""
+
+import re
+
+
+def test_every_queued_action_has_a_script(player):
+    with open(player.__file__) as source:
+        names = set(re.findall(r"queueAction\(dev, '(\w+)'", source.read()))
+    assert names
+    assert names <= set(player.kActionScripts)
+
+
+def test_arguments_go_through_argv_and_the_source_compiles_once(plugin):
+    first = plugin.runScript('setVolume', 40)
+    second = plugin.runScript('setVolume', 55)
+    assert first == {'sourceSent': True, 'language': 'AppleScript', 'args': ['40']}
+    assert second == {'sourceSent': False, 'language': 'AppleScript', 'args': ['55']}
+
+
+def test_quotes_in_values_reach_the_script_intact(plugin):
+    value = 'Rock "n" Roll, Vol. 2'
+    assert plugin.runScript('setVolume', value)['args'] == [value]
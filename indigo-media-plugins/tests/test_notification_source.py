@@ -0,0 +1,86 @@
+"""NotificationSource driven by a stand-in emitter instead of the JXA observer"""
+
+import json
+import threading
+
+import pytest
+
+from support import StandInDevice, loadPlugin, standIn
+
+
+@pytest.fixture(params=('Spotify', 'AppleMusic'))
+def notifier(request):
+    return loadPlugin(request.param)
+
+
+class Received(object):
+    """Collects payloads until the expected number have arrived"""
+
+    def __init__(self, expected):
+        self.payloads = []
+        self.expected = expected
+        self.event = threading.Event()
+
+    def __call__(self, payload):
+        self.payloads.append(payload)
+        if len(self.payloads) >= self.expected:
+            self.event.set()
+
+
+def emitter(*payloads):
+    return standIn('notification_emitter.py', *[json.dumps(payload) for payload in payloads])
+
+
+def test_payloads_reach_the_callback(shared, recorder):
+    received = Received(2)
+    command = emitter({'Player State': 'Playing'}, {'Player State': 'Paused'})
+    command.insert(-1, 'not json')
+    source = shared.NotificationSource(recorder, 'test', received, command=command)
+    source.start()
+    try:
+        assert received.event.wait(5)
+    finally:
+        source.stop()
+    assert received.payloads == [{'Player State': 'Playing'}, {'Player State': 'Paused'}]
+
+
+def test_stop_kills_the_observer_and_restart_runs_it_again(shared, recorder):
+    received = Received(1)
+    source = shared.NotificationSource(recorder, 'test', received, command=emitter({'n': 1}))
+    source.start()
+    assert received.event.wait(5)
+    process = source.process
+    source.stop()
+    assert source.thread is None
+    assert process.wait(5) is not None
+
+    received.expected = 2
+    received.event.clear()
+    source.start()
+    try:
+        assert received.event.wait(5)
+    finally:
+        source.stop()
+    assert source.process is not process
+
+
+def test_observer_stops_with_the_last_events_device(notifier, shared):
+    plugin = notifier.Plugin('test', 'Test', '1.0', {})
+    received = Received(1)
+    plugin.notificationSource = shared.NotificationSource(plugin, 'test', received, command=emitter({'n': 1}))
+    events = [StandInDevice(devId, {'updateMode': 'events'}) for devId in (1, 2)]
+    polled = StandInDevice(3, {'updateMode': 'poll'})
+    try:
+        for dev in events + [polled]:
+            plugin.deviceStartComm(dev)
+        assert received.event.wait(5)
+        process = plugin.notificationSource.process
+
+        plugin.deviceStopComm(events[0])
+        assert process.poll() is None
+        plugin.deviceStopComm(events[1])
+        assert plugin.notificationSource.thread is None
+        assert process.wait(5) is not None
+    finally:
+        plugin.notificationSource.stop()
+        plugin.pollPool.shutdown()
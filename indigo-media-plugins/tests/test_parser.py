@@ -0,0 +1,51 @@
+"""AppleScriptParser: the record parser shared by the shared plugins"""
+
+import pytest
+
+
+def parse(shared, text):
+    return shared.AppleScriptParser(text).parseRecord()
+
+
+def test_typed_values(shared):
+    record = parse(shared, '{playerState:"playing", trackNumber:3, playerPosition:12.5, '
+                           'shuffling:false, repeating:true, rating:missing value, volume:-1}')
+    assert record == {'playerState': 'playing', 'trackNumber': 3, 'playerPosition': 12.5,
+                      'shuffling': False, 'repeating': True, 'rating': None, 'volume': -1}
+    assert isinstance(record['trackNumber'], int)
+
+
+def test_strings_keep_commas_braces_and_escaped_quotes(shared):
+    record = parse(shared, r'{trackName:"Song, with {braces}", trackArtist:"A \"quoted\" one\\", album:"Line\nTwo"}')
+    assert record == {'trackName': 'Song, with {braces}', 'trackArtist': 'A "quoted" one\\', 'album': 'Line\nTwo'}
+
+
+def test_numbers_inside_strings_stay_strings(shared):
+    assert parse(shared, '{trackName:"1999", persistentId:"00AB12"}') == {'trackName': '1999', 'persistentId': '00AB12'}
+
+
+def test_nested_lists_and_records(shared):
+    record = parse(shared, '{items:{1, "two", {3, 4}}, inner:{a:1, b:{c:"d"}}, empty:{}}')
+    assert record == {'items': [1, 'two', [3, 4]], 'inner': {'a': 1, 'b': {'c': 'd'}}, 'empty': []}
+
+
+def test_piped_keys_and_typed_literals(shared):
+    record = parse(shared, '{|track name|:"x", added:date "Monday, 1 January 2024 at 10:00:00", kind:«constant ****kPSP»}')
+    assert record == {'track name': 'x', 'added': 'Monday, 1 January 2024 at 10:00:00', 'kind': '«constant ****kPSP»'}
+
+
+def test_bare_key_value_output(shared):
+    # osascript without -s s prints records without braces or quotes
+    assert parse(shared, 'playerState:playing, soundVolume:60') == {'playerState': 'playing', 'soundVolume': 60}
+
+
+def test_empty_and_non_record_output(shared):
+    assert parse(shared, '') == {}
+    assert parse(shared, '  {}  ') == {}
+    assert parse(shared, '{1, 2}') == {}
+
+
+@pytest.mark.parametrize('text', ['{name:"unterminated}', '{name:"a" "b"}'])
+def test_malformed_output_raises(shared, text):
+    with pytest.raises(ValueError):
+        parse(shared, text)
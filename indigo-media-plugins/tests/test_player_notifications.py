@@ -0,0 +1,107 @@
+"""Playback notifications published as device states, without a metadata query"""
+
+import pytest
+
+from support import StandInDevice, loadPlugin, standIn
+
+
+def startEventsDevice(name, shared, monkeypatch):
+    """A plugin with one event mode device; status queries are recorded, not run"""
+    plugin = loadPlugin(name).Plugin('test', 'Test', '1.0', {})
+    plugin.notificationSource = shared.NotificationSource(
+        plugin, 'test', plugin.playerNotified, command=standIn('notification_emitter.py'))
+    queries = []
+    monkeypatch.setattr(plugin, 'queryPlayer', lambda dev, script, javaScript: queries.append(script))
+    dev = StandInDevice(1, {'updateMode': 'events'})
+    plugin.deviceStartComm(dev)
+    return plugin, dev, queries
+
+
+@pytest.fixture
+def spotify(shared, monkeypatch):
+    plugin, dev, queries = startEventsDevice('Spotify', shared, monkeypatch)
+    yield plugin, dev, queries
+    plugin.notificationSource.stop()
+    plugin.pollPool.shutdown()
+
+
+@pytest.fixture
+def appleMusic(shared, monkeypatch):
+    plugin, dev, queries = startEventsDevice('AppleMusic', shared, monkeypatch)
+    yield plugin, dev, queries
+    plugin.notificationSource.stop()
+    plugin.pollPool.shutdown()
+
+
+def test_spotify_payload_becomes_states(spotify):
+    plugin, dev, queries = spotify
+    plugin.playerNotified({
+        'Player State': 'Playing', 'Track ID': 'spotify:track:abc', 'Playback Position': 42.5,
+        'Name': 'Song', 'Artist': 'Band', 'Album': 'Record', 'Album Artist': 'Band',
+        'Duration': 185000, 'Track Number': 3, 'Disc Number': 1, 'Popularity': 61})
+
+    assert queries == []
+    states = dev.states
+    assert states['playerState'] == 'playing' and states['isPlaying']
+    assert (states['trackName'], states['artist'], states['album']) == ('Song', 'Band', 'Record')
+    assert states['trackId'] == 'spotify:track:abc'
+    assert states['duration'] == 185 and states['playerPosition'] == 42
+    assert (states['trackNumber'], states['popularity']) == (3, 61)
+    assert states['status'] == u"▶ Band - Song"
+
+
+def test_spotify_payload_uses_cached_extras(spotify):
+    plugin, dev, queries = spotify
+    plugin.metadataCache.put('spotify:track:abc', {'trackId': 'spotify:track:abc', 'trackName': 'Old name',
+                                                   'artworkUrl': 'https://example.com/a.jpg'})
+    plugin.playerNotified({'Player State': 'Paused', 'Track ID': 'spotify:track:abc', 'Name': 'Song',
+                           'Artist': 'Band', 'Album': 'Record', 'Duration': 185000})
+
+    assert queries == []
+    assert dev.states['artworkUrl'] == 'https://example.com/a.jpg'
+    assert dev.states['trackName'] == 'Song' and dev.states['isPaused']
+
+
+def test_spotify_payload_without_track_details_is_queried(spotify):
+    plugin, dev, queries = spotify
+    plugin.playerNotified({'Player State': 'Playing', 'Track ID': 'spotify:track:abc'})
+    assert len(queries) == 1
+
+
+def test_apple_music_payload_becomes_states(appleMusic):
+    plugin, dev, queries = appleMusic
+    plugin.playerNotified({
+        'Player State': 'Playing', 'PersistentID': -6224068366474337000, 'Name': 'Song',
+        'Artist': 'Band', 'Album': 'Record', 'Album Artist': 'Band', 'Total Time': 241632,
+        'Track Number': 7, 'Disc Number': 2, 'Genre': 'Rock', 'Composer': 'Writer', 'Year': 1999})
+
+    assert queries == []
+    states = dev.states
+    assert states['playerState'] == 'playing'
+    assert (states['trackName'], states['artist'], states['album']) == ('Song', 'Band', 'Record')
+    # Milliseconds in the payload, whole seconds in the states
+    assert states['duration'] == 241 and states['durationFormatted'] == plugin.formatTime(241.632)
+    assert (states['trackNumber'], states['discNumber'], states['year']) == (7, 2, 1999)
+    assert (states['genre'], states['composer']) == ('Rock', 'Writer')
+    # The signed decimal ID is stored as the 16 hex digits AppleScript reports
+    assert plugin.deviceDict[dev.id]['persistentId'] == 'A99FAACC168D2518'
+
+
+def test_apple_music_persistent_id_matches_applescript(appleMusic):
+    plugin, dev, queries = appleMusic
+    status = plugin.statusFromNotification({'PersistentID': 1234567890123, 'Total Time': 1500})
+    assert status == {'persistentId': '0000011F71FB04CB', 'trackDuration': 1.5}
+    assert plugin.statusFromNotification({'PersistentID': -1})['persistentId'] == 'F' * 16
+
+
+def test_apple_music_stop_clears_the_track(appleMusic):
+    plugin, dev, queries = appleMusic
+    plugin.playerNotified({'Player State': 'Playing', 'PersistentID': 5, 'Name': 'Song', 'Artist': 'Band',
+                           'Album': 'Record', 'Total Time': 1000})
+    plugin.playerNotified({'Player State': 'Stopped'})
+
+    assert queries == []
+    assert dev.states['isStopped'] and dev.states['playerPosition'] == 0
+    assert plugin.deviceDict[dev.id]['persistentId'] == ''
+    # Track details of the earlier notification are not carried over
+    assert dev.states['trackName'] == '' and dev.states['status'] == u"⏹ Not Playing"
@@ -0,0 +1,71 @@
+"""Adaptive polling: idle players are polled less often, any change snaps back"""
+
+import time
+
+from support import StandInDevice
+
+
+def startDevice(plugin, updateFrequency=1):
+    dev = StandInDevice(1, {'updateFrequency': str(updateFrequency)})
+    plugin.deviceStartComm(dev)
+    return plugin.deviceDict[dev.id]
+
+
+def intervals(plugin, devInfo, *playerStates):
+    result = []
+    for playerState in playerStates:
+        plugin.adjustPollInterval(devInfo, playerState)
+        result.append(devInfo['pollInterval'])
+    return result
+
+
+def test_playing_is_polled_at_the_update_frequency(plugin):
+    devInfo = startDevice(plugin)
+    assert intervals(plugin, devInfo, *['playing'] * 5) == [1] * 5
+
+
+def test_idle_polls_double_up_to_the_cap(plugin, player):
+    devInfo = startDevice(plugin)
+    cap = player.kIdlePollCaps['paused']
+    polled = intervals(plugin, devInfo, *['paused'] * 6)
+    # The first paused poll is a change; the doubling starts after it
+    assert polled[:4] == [1, 2, 4, min(8, cap)]
+    assert polled[-1] == cap
+
+
+def test_a_stopped_or_missing_player_backs_off_further(plugin, player):
+    devInfo = startDevice(plugin)
+    stopped = intervals(plugin, devInfo, *['stopped'] * 10)
+    assert stopped[-1] == player.kIdlePollCaps['stopped']
+
+    devInfo = startDevice(plugin)
+    # Errors back off like a player that is not running
+    failed = intervals(plugin, devInfo, *[None] * 10)
+    assert failed[-1] == player.kIdlePollCaps['notRunning']
+
+
+def test_any_change_or_reset_snaps_back(plugin):
+    devInfo = startDevice(plugin)
+    intervals(plugin, devInfo, *['paused'] * 6)
+    assert intervals(plugin, devInfo, 'stopped') == [1]
+
+    intervals(plugin, devInfo, *['stopped'] * 6)
+    plugin.adjustPollInterval(devInfo, 'stopped', reset=True)
+    assert devInfo['pollInterval'] == 1
+
+
+def test_a_slow_update_frequency_is_never_polled_faster(plugin):
+    devInfo = startDevice(plugin, updateFrequency=60)
+    assert intervals(plugin, devInfo, 'playing', 'paused', 'paused', 'stopped') == [60] * 4
+
+
+def test_the_next_poll_is_scheduled_after_the_interval(plugin, player):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    plugin.processStatus = lambda dev, status, *metadata: status['playerState']
+    for i in range(6):
+        plugin.pollDevice(dev, status={'playerState': 'paused'}, readStamp=next(plugin.readSequence))
+    cap = player.kIdlePollCaps['paused']
+    now = time.time()
+    assert plugin.pollScheduler.popDue(now + cap - 0.5) == []
+    assert plugin.pollScheduler.popDue(now + cap + 0.5) == [dev.id]
@@ -0,0 +1,214 @@
+"""PollScheduler deadlines, single-flight polling and the ScriptRunnerPool"""
+
+import threading
+import time
+
+from support import StandInDevice, standIn
+
+
+def test_devices_come_due_in_deadline_order(shared):
+    scheduler = shared.PollScheduler()
+    scheduler.schedule(1, 30)
+    scheduler.schedule(2, 10)
+    scheduler.schedule(3, 20)
+    assert scheduler.popDue(5) == []
+    assert scheduler.popDue(25) == [2, 3]
+    assert scheduler.popDue(35) == [1]
+    assert scheduler.popDue(100) == []
+
+
+def test_rescheduling_moves_the_deadline(shared):
+    scheduler = shared.PollScheduler()
+    scheduler.schedule(1, 10)
+    scheduler.schedule(1, 50)
+    assert scheduler.popDue(20) == []
+    scheduler.schedule(1, 15)
+    # Only the current deadline counts; the stale entries are dropped
+    assert scheduler.popDue(20) == [1]
+    assert scheduler.popDue(100) == []
+    assert scheduler.queue == []
+
+
+def test_cancelled_devices_never_come_due(shared):
+    scheduler = shared.PollScheduler()
+    scheduler.schedule(1, 10)
+    scheduler.schedule(2, 10)
+    scheduler.cancel(1)
+    assert scheduler.popDue(20) == [2]
+
+
+def test_waiting_ends_when_a_device_is_scheduled_or_woken(shared):
+    scheduler = shared.PollScheduler()
+    scheduler.schedule(1, time.time() + 60)
+    threading.Timer(0.05, scheduler.schedule, (2, time.time())).start()
+    started = time.time()
+    assert scheduler.waitForDue(5) == [2]
+
+    threading.Timer(0.05, scheduler.wake).start()
+    assert scheduler.waitForDue(5) == []
+    assert time.time() - started < 2
+
+
+def test_a_refresh_during_a_query_gets_one_follow_up(plugin):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    devInfo = plugin.deviceDict[dev.id]
+    queried = threading.Event()
+    release = threading.Event()
+    polls = []
+
+    def pollDevice(dev):
+        polls.append(dev.id)
+        queried.set()
+        release.wait(5)
+
+    plugin.pollDevice = pollDevice
+    assert plugin.startFlight(devInfo)
+    assert not plugin.startFlight(devInfo)
+    task = plugin.pollPool.submit(plugin.pollTask, devInfo)
+    assert queried.wait(5)
+    # Claimed twice while the query runs: served by a single follow-up
+    assert not plugin.startFlight(devInfo)
+    assert not plugin.startFlight(devInfo)
+    release.set()
+    task.result(5)
+    assert polls == [1, 1]
+    assert not devInfo['polling']
+
+
+def test_a_refresh_before_the_query_starts_needs_no_follow_up(plugin):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    devInfo = plugin.deviceDict[dev.id]
+    polls = []
+    plugin.pollDevice = lambda dev: polls.append(dev.id)
+
+    assert plugin.startFlight(devInfo)
+    # Still queued: the poll about to run serves these
+    assert not plugin.startFlight(devInfo)
+    assert not plugin.startFlight(devInfo)
+    plugin.pollTask(devInfo)
+    assert polls == [1]
+    assert not devInfo['polling'] and not devInfo['followUp']
+
+
+def test_concurrent_refreshes_share_one_query(plugin):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    devInfo = plugin.deviceDict[dev.id]
+    queried = threading.Event()
+    release = threading.Event()
+    polls = []
+
+    def pollDevice(dev):
+        polls.append(dev.id)
+        queried.set()
+        release.wait(5)
+
+    plugin.pollDevice = pollDevice
+    assert plugin.startFlight(devInfo)
+    task = plugin.pollPool.submit(plugin.pollTask, devInfo)
+    assert queried.wait(5)
+    claims = []
+    threads = [threading.Thread(target=lambda: claims.append(plugin.startFlight(devInfo))) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    release.set()
+    task.result(5)
+    assert claims == [False] * 20
+    assert polls == [1, 1]
+
+
+def test_a_failed_poll_releases_the_device(plugin):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    devInfo = plugin.deviceDict[dev.id]
+
+    def pollDevice(dev):
+        raise RuntimeError('player went away')
+
+    plugin.pollDevice = pollDevice
+    # As the poll thread does: the device's deadline goes when it comes due
+    assert plugin.pollScheduler.popDue(time.time() + devInfo['pollInterval'] + 1) == [dev.id]
+    assert plugin.startFlight(devInfo)
+    started = time.time()
+    plugin.pollTask(devInfo)
+    assert not devInfo['polling']
+    assert any('player went away' in message for message in plugin.errorMessages)
+    # ...and the failed poll sets a new one, so the device is polled again
+    assert plugin.pollScheduler.deadlines[dev.id] >= started + devInfo['pollInterval']
+    assert plugin.pollScheduler.popDue(time.time() + devInfo['pollInterval'] + 1) == [dev.id]
+    assert plugin.startFlight(devInfo)
+
+
+def test_status_read_before_the_last_published_one_is_dropped(plugin):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    published = []
+    plugin.processStatus = lambda dev, status, *metadata: published.append(status) or status.get('playerState')
+
+    older = next(plugin.readSequence)
+    newer = next(plugin.readSequence)
+    plugin.pollDevice(dev, status={'playerState': 'playing'}, readStamp=newer)
+    plugin.pollDevice(dev, status={'playerState': 'paused'}, readStamp=older)
+    assert published == [{'playerState': 'playing'}]
+
+
+def test_a_slow_status_query_does_not_hold_up_publishing(plugin, player):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    queried = threading.Event()
+    release = threading.Event()
+    published = []
+
+    def queryPlayer(dev, script, javaScript):
+        queried.set()
+        release.wait(5)
+        return dict(player.kNotRunningStatus, polled=True)
+
+    plugin.isPlayerRunning = lambda: True
+    plugin.queryPlayer = queryPlayer
+    plugin.processStatus = lambda dev, status, *metadata: published.append(status) or 'stopped'
+    poll = threading.Thread(target=plugin.pollDevice, args=(dev,))
+    poll.start()
+    try:
+        assert queried.wait(5)
+        # An action's status goes out while the poll waits on the player...
+        started = time.time()
+        plugin.pollDevice(dev, status={'action': True}, readStamp=next(plugin.readSequence))
+        assert time.time() - started < 1
+        assert published == [{'action': True}]
+    finally:
+        release.set()
+        poll.join(5)
+    # ...and the older poll result is dropped
+    assert published == [{'action': True}]
+
+
+def test_pool_runs_overlapping_calls_on_separate_workers(shared, recorder):
+    pool = shared.ScriptRunnerPool(recorder, 3, command=standIn('script_worker.py', 0.3))
+    try:
+        pool.run('return 1')   # starts one worker
+        threads = [threading.Thread(target=pool.run, args=('return 1',)) for i in range(3)]
+        started = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - started
+    finally:
+        pool.stop()
+    # The two cold workers also start up, but the calls overlap
+    assert elapsed < 0.3 * 3
+
+
+def test_pool_reuses_the_most_recent_worker(shared, recorder):
+    pool = shared.ScriptRunnerPool(recorder, 3, command=standIn('script_worker.py'))
+    try:
+        for i in range(5):
+            pool.run('return 1')
+        assert sum(runner.process is not None for runner in pool.runners) == 1
+    finally:
+        pool.stop()
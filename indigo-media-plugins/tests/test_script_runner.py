@@ -0,0 +1,82 @@
+"""ScriptRunner driven by the stand-in worker instead of osascript"""
+
+import time
+
+import pytest
+
+from support import standIn
+
+
+def reply(shared, result):
+    output, error = result
+    assert error == ''
+    return shared.AppleScriptParser(output).parseRecord()
+
+
+def test_scripts_compile_once_and_take_arguments(shared, recorder):
+    runner = shared.ScriptRunner(recorder, command=standIn('script_worker.py'))
+    try:
+        first = reply(shared, runner.run('return 1', args=['a', '2']))
+        second = reply(shared, runner.run('return 1', args=['b']))
+        other = reply(shared, runner.run('return 2', language='JavaScript'))
+    finally:
+        runner.stop()
+    assert first == {'sourceSent': True, 'language': 'AppleScript', 'args': ['a', '2']}
+    assert second == {'sourceSent': False, 'language': 'AppleScript', 'args': ['b']}
+    assert other['sourceSent'] and other['language'] == 'JavaScript'
+
+
+def test_script_errors_are_returned(shared, recorder):
+    runner = shared.ScriptRunner(recorder, command=standIn('script_worker.py'))
+    try:
+        assert runner.run('FAIL') == ('', 'script failed')
+    finally:
+        runner.stop()
+
+
+def test_dead_worker_is_restarted_transparently(shared, recorder):
+    runner = shared.ScriptRunner(recorder, command=standIn('script_worker.py'))
+    try:
+        reply(shared, runner.run('return 1'))
+        runner.process.kill()
+        runner.process.wait()
+        # The new worker has not seen the script, so the source is sent again
+        assert reply(shared, runner.run('return 1'))['sourceSent']
+    finally:
+        runner.stop()
+
+
+def test_script_is_not_sent_again_once_the_worker_read_it(shared, recorder, tmp_path):
+    log = tmp_path / 'requests.log'
+    runner = shared.ScriptRunner(recorder, command=standIn('script_worker.py', 0, 'log=' + str(log)))
+    try:
+        # The worker dies after reading the script, which may already have run
+        with pytest.raises(shared.ScriptLost):
+            runner.run('CRASH')
+        assert len(log.read_text().splitlines()) == 1
+        assert runner.process is None and runner.retryAfter == 0
+        # The next call starts a fresh worker
+        assert reply(shared, runner.run('return 1'))['sourceSent']
+    finally:
+        runner.stop()
+
+
+def test_worker_that_cannot_start_is_left_alone_for_a_while(shared, recorder, tmp_path):
+    runner = shared.ScriptRunner(recorder, command=[str(tmp_path / 'missing-worker')])
+    try:
+        assert runner.run('return 1') is None
+        assert runner.retryAfter > time.time()
+        # Callers fall back to one-shot osascript without a worker being started
+        assert runner.run('return 1') is None
+        assert runner.process is None
+    finally:
+        runner.stop()
+
+
+def test_plugins_report_a_lost_script_instead_of_running_it_again(plugin, shared, tmp_path):
+    log = tmp_path / 'requests.log'
+    plugin.scriptRunner = shared.ScriptRunner(plugin, command=standIn('script_worker.py', 0, 'log=' + str(log)))
+    # No one-shot osascript fallback either
+    output, error = plugin.runAppleScript('CRASH')
+    assert output == '' and 'lost the reply' in error
+    assert len(log.read_text().splitlines()) == 1
@@ -0,0 +1,30 @@
+"""The mediacontrol module: one source in shared/, vendored into every player bundle"""
+
+import os
+import re
+import subprocess
+import sys
+
+from support import kPlayerBundles, kRepoRoot, kSharedModule
+
+
+def test_every_bundle_ships_the_shared_source():
+    with open(kSharedModule, 'rb') as sourceFile:
+        source = sourceFile.read()
+    for bundle in kPlayerBundles:
+        path = os.path.join(kRepoRoot, bundle + '.indigoPlugin', 'Contents', 'Server Plugin', 'mediacontrol.py')
+        with open(path, 'rb') as copyFile:
+            assert copyFile.read() == source, f"{bundle} copy is stale; run python shared/vendor.py"
+
+
+def test_vendor_check_reports_up_to_date_copies():
+    result = subprocess.run([sys.executable, os.path.join(kRepoRoot, 'shared', 'vendor.py'), '--check'],
+                            capture_output=True, text=True)
+    assert result.returncode == 0, result.stdout
+
+
+def test_plugins_only_import_names_the_module_defines(player, shared):
+    with open(player.__file__) as pluginFile:
+        match = re.search(r'from mediacontrol import \(([^)]*)\)', pluginFile.read())
+    names = [name.strip() for name in match.group(1).split(',')]
+    assert names and all(hasattr(shared, name) for name in names)
@@ -0,0 +1,104 @@
+"""State snapshot: last known states shown at startup, first polls spread out"""
+
+import json
+import os
+import sys
+import time
+import types
+
+import pytest
+
+from support import StandInDevice
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Stands in for indigo.server and indigo.devices; devices() lists the plugin's devices"""
+    os.makedirs(os.path.join(str(tmp_path), 'Preferences', 'Plugins'))
+    devices = []
+    indigo = sys.modules['indigo']
+    monkeypatch.setattr(indigo, 'server', types.SimpleNamespace(getInstallFolderPath=lambda: str(tmp_path)),
+                        raising=False)
+    monkeypatch.setattr(indigo, 'devices', types.SimpleNamespace(iter=lambda pluginId: list(devices)),
+                        raising=False)
+    return devices
+
+
+def newPlugin(player):
+    plugin = player.Plugin('test', 'Test', '1.0', {})
+    plugin.loadSnapshot()
+    return plugin
+
+
+def test_states_survive_a_restart(player, server):
+    dev = StandInDevice(1)
+    server.append(dev)
+    plugin = newPlugin(player)
+    plugin.deviceStartComm(dev)
+    plugin.publishStates(dev, [{'key': 'trackName', 'value': 'Song'}, {'key': 'status', 'value': 'Playing'},
+                               {'key': 'connectionState', 'value': 'suspended'}])
+    plugin.saveSnapshot()
+    plugin.pollPool.shutdown()
+
+    restarted = newPlugin(player)
+    dev = StandInDevice(1)
+    restarted.deviceStartComm(dev)
+    restarted.pollPool.shutdown()
+    assert dev.states['trackName'] == 'Song' and dev.states['status'] == 'Playing'
+    # The connection state is always the current one
+    assert dev.states['connectionState'] == 'ok'
+
+
+def test_a_device_saved_while_playing_is_restored_as_paused(player, server):
+    dev = StandInDevice(1)
+    server.append(dev)
+    plugin = newPlugin(player)
+    plugin.deviceStartComm(dev)
+    plugin.publishStates(dev, [{'key': 'playerState', 'value': 'playing'}, {'key': 'isPlaying', 'value': True},
+                               {'key': 'isPaused', 'value': False}, {'key': 'isStopped', 'value': False},
+                               {'key': 'status', 'value': u'\u25b6 Song'}, {'key': 'trackName', 'value': 'Song'}])
+    plugin.saveSnapshot()
+    plugin.pollPool.shutdown()
+
+    restarted = newPlugin(player)
+    dev = StandInDevice(1)
+    restarted.deviceStartComm(dev)
+    restarted.pollPool.shutdown()
+    # Not known to be playing until the first poll says so
+    assert dev.states['isPlaying'] is False and dev.states['isPaused'] is True
+    assert dev.states['playerState'] == 'paused' and dev.states['status'] == u'\u23f8 Song'
+    assert dev.states['trackName'] == 'Song'
+
+
+def test_deleted_devices_are_dropped(player, server):
+    kept, deleted = StandInDevice(1), StandInDevice(2)
+    server.append(kept)
+    plugin = newPlugin(player)
+    for dev in (kept, deleted):
+        plugin.deviceStartComm(dev)
+        plugin.publishStates(dev, [{'key': 'trackName', 'value': 'Song'}])
+    plugin.saveSnapshot()
+    plugin.pollPool.shutdown()
+    with open(plugin.snapshotPath) as snapshotFile:
+        assert list(json.load(snapshotFile)) == ['1']
+
+
+def test_a_damaged_snapshot_is_ignored(player, server):
+    plugin = newPlugin(player)
+    with open(plugin.snapshotPath, 'w') as snapshotFile:
+        snapshotFile.write('{"1": {"trackName"')
+    plugin.loadSnapshot()
+    assert plugin.snapshot == {}
+    assert any('snapshot' in message for message in plugin.debugMessages)
+
+
+def test_first_polls_are_spread_over_the_update_interval(player, server):
+    plugin = newPlugin(player)
+    started = time.time()
+    for devId in (1, 2, 3):
+        plugin.deviceStartComm(StandInDevice(devId))
+    plugin.pollPool.shutdown()
+    # Each device's first poll is offset by a different fraction of its interval
+    assert plugin.pollScheduler.popDue(started + 0.2) == []
+    assert plugin.pollScheduler.popDue(started + 0.3) == [2]
+    assert sorted(plugin.pollScheduler.popDue(started + 1.1)) == [1, 3]
@@ -0,0 +1,51 @@
+"""publishStates: only changed states go to the server, with a periodic full resync"""
+
+import time
+
+from support import StandInDevice
+
+
+def states(**values):
+    return [{'key': key, 'value': value} for key, value in values.items()]
+
+
+def startDevice(plugin):
+    dev = StandInDevice(1)
+    plugin.deviceStartComm(dev)
+    del dev.updates[:]
+    return dev
+
+
+def test_only_changed_states_are_sent(plugin):
+    dev = startDevice(plugin)
+    plugin.publishStates(dev, states(trackName='Song', artist='Band', volume=40))
+    plugin.publishStates(dev, states(trackName='Song', artist='Band', volume=45))
+    plugin.publishStates(dev, states(trackName='Song', artist='Band', volume=45))
+    assert dev.updates[1:] == [states(volume=45)]
+
+
+def test_everything_is_sent_again_after_the_resync_interval(plugin, player, monkeypatch):
+    dev = startDevice(plugin)
+    now = [time.time()]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    plugin.publishStates(dev, states(trackName='Song', volume=40))
+    plugin.publishStates(dev, states(trackName='Song', volume=40))
+    assert len(dev.updates) == 1
+
+    now[0] += player.kFullResyncInterval
+    plugin.publishStates(dev, states(trackName='Song', volume=40))
+    assert dev.updates[-1] == states(trackName='Song', volume=40)
+
+
+def test_the_published_values_are_mirrored(plugin):
+    dev = startDevice(plugin)
+    plugin.publishStates(dev, states(trackName='Song'))
+    assert plugin.deviceDict[dev.id]['publishedStates']['trackName'] == 'Song'
+    assert plugin.mirrorState(dev, 'trackName', '') == 'Song'
+
+
+def test_unknown_devices_get_every_state(plugin):
+    dev = StandInDevice(2)
+    plugin.publishStates(dev, states(trackName='Song'))
+    plugin.publishStates(dev, states(trackName='Song'))
+    assert dev.updates == [states(trackName='Song')] * 2
@@ -0,0 +1,80 @@
+"""State mirror: action handlers read queued and published values instead of dev.states"""
+
+import pytest
+
+from support import StandInDevice
+
+# Per plugin: the volume state key, and the volume step for a 10% volume up
+kVolume = {'SpotifyPlugin': ('soundVolume', 10), 'AppleMusicPlugin': ('soundVolume', 10),
+           'VLCPlugin': ('audioVolume', 25)}
+
+
+class Action(object):
+    def __init__(self, **props):
+        self.props = props
+
+
+@pytest.fixture
+def mirror(player):
+    """A player plugin sending each command at once, with the action worker's queue recorded"""
+    plugin = player.Plugin('test', 'Test', '1.0', {player.kCommandDebounceKey: '0'})
+    submitted = []
+    plugin.actionWorker.submit = lambda dev, action: submitted.append(action)
+    dev = StandInDevice(1, states={kVolume[player.__name__][0]: 10})
+    plugin.deviceStartComm(dev)
+    yield plugin, dev, submitted
+    plugin.pollPool.shutdown()
+
+
+def publishVolume(plugin, dev, volume):
+    key = kVolume[type(plugin).__module__][0]
+    plugin.publishStates(dev, [{'key': key, 'value': volume}])
+    return key
+
+
+def test_published_values_win_over_the_servers_copy(mirror):
+    plugin, dev, submitted = mirror
+    key = kVolume[type(plugin).__module__][0]
+    assert plugin.mirrorState(dev, key, 0) == 10
+    publishVolume(plugin, dev, 50)
+    dev.states[key] = 10
+    assert plugin.mirrorState(dev, key, 0) == 50
+
+
+def test_queued_commands_build_on_each_other(mirror):
+    plugin, dev, submitted = mirror
+    key, step = kVolume[type(plugin).__module__]
+    publishVolume(plugin, dev, 50)
+    plugin.actionVolumeUp(Action(amount=10), dev)
+    plugin.actionVolumeUp(Action(amount=10), dev)
+    # The second command starts from the value the first will set
+    assert [action['args'] for action in submitted] == [(50 + step,), (50 + 2 * step,)]
+    assert plugin.mirrorState(dev, key, 0) == 50 + 2 * step
+
+
+def test_optimistic_values_are_dropped_once_the_action_has_run(mirror):
+    plugin, dev, submitted = mirror
+    key, step = kVolume[type(plugin).__module__]
+    publishVolume(plugin, dev, 50)
+    plugin.actionVolumeUp(Action(amount=10), dev)
+    plugin.actionVolumeUp(Action(amount=10), dev)
+
+    # The first action has run; the second one's value still stands
+    plugin.settleAction(dev, submitted[0])
+    assert plugin.mirrorState(dev, key, 0) == 50 + 2 * step
+    plugin.settleAction(dev, submitted[1])
+    assert plugin.mirrorState(dev, key, 0) == 50
+    publishVolume(plugin, dev, 50 + 2 * step)
+    assert plugin.mirrorState(dev, key, 0) == 50 + 2 * step
+
+
+def test_toggles_flip_the_mirrored_value(mirror, player):
+    plugin, dev, submitted = mirror
+    toggles = {'SpotifyPlugin': ('actionSetShuffle', 'shuffling'),
+               'AppleMusicPlugin': ('actionSetShuffle', 'shuffleEnabled'),
+               'VLCPlugin': ('actionSetRandom', 'random')}
+    handler, key = toggles[player.__name__]
+    plugin.publishStates(dev, [{'key': key, 'value': False}])
+    getattr(plugin, handler)(Action(), dev)
+    getattr(plugin, handler)(Action(), dev)
+    assert [action['args'] for action in submitted] == [('true',), ('false',)]
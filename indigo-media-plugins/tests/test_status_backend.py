@@ -0,0 +1,74 @@
+"""JavaScript for Automation status queries, and the fallback to AppleScript when they keep failing"""
+
+import json
+
+from support import StandInDevice
+
+
+class Scripts(object):
+    """Stands in for invokeScript: answers each language with the configured output"""
+
+    def __init__(self):
+        self.javaScript = json.dumps(json.dumps({'playerState': 'playing', 'trackName': 'Song "1", {live}'}))
+        self.appleScript = '{playerState:"paused", trackName:"Song"}'
+        self.languages = []
+
+    def __call__(self, script, language, args, timeout):
+        self.languages.append(language)
+        if language == 'JavaScript':
+            return self.javaScript, ''
+        return self.appleScript, ''
+
+
+def startDevice(plugin, backend='jxa'):
+    scripts = Scripts()
+    plugin.invokeScript = scripts
+    dev = StandInDevice(1, {'statusBackend': backend})
+    plugin.deviceStartComm(dev)
+    return dev, scripts
+
+
+def test_jxa_results_are_read_as_json(plugin):
+    dev, scripts = startDevice(plugin)
+    result = plugin.queryPlayer(dev, 'status', 'javaScript')
+    assert result == {'playerState': 'playing', 'trackName': 'Song "1", {live}'}
+    assert scripts.languages == ['JavaScript']
+
+
+def test_applescript_devices_never_run_javascript(plugin):
+    dev, scripts = startDevice(plugin, 'applescript')
+    assert plugin.queryPlayer(dev, 'status', 'javaScript') == {'playerState': 'paused', 'trackName': 'Song'}
+    assert scripts.languages == ['AppleScript']
+
+
+def test_a_failed_jxa_query_is_answered_by_applescript(plugin):
+    dev, scripts = startDevice(plugin)
+    scripts.javaScript = 'not json'
+    assert plugin.queryPlayer(dev, 'status', 'javaScript') == {'playerState': 'paused', 'trackName': 'Song'}
+    assert scripts.languages == ['JavaScript', 'AppleScript']
+    assert plugin.deviceDict[dev.id]['statusBackend'] == 'jxa'
+
+
+def test_repeated_failures_switch_the_device_to_applescript(plugin, player):
+    dev, scripts = startDevice(plugin)
+    scripts.javaScript = ''
+    for i in range(player.kMaxJavaScriptFailures):
+        plugin.queryPlayer(dev, 'status', 'javaScript')
+    assert plugin.deviceDict[dev.id]['statusBackend'] == 'applescript'
+    assert len(plugin.errorMessages) == 1
+
+    del scripts.languages[:]
+    plugin.queryPlayer(dev, 'status', 'javaScript')
+    assert scripts.languages == ['AppleScript']
+
+
+def test_a_success_resets_the_failure_count(plugin, player):
+    dev, scripts = startDevice(plugin)
+    good = scripts.javaScript
+    for i in range(3):
+        scripts.javaScript = ''
+        for j in range(player.kMaxJavaScriptFailures - 1):
+            plugin.queryPlayer(dev, 'status', 'javaScript')
+        scripts.javaScript = good
+        plugin.queryPlayer(dev, 'status', 'javaScript')
+    assert plugin.deviceDict[dev.id]['statusBackend'] == 'jxa'
@@ -0,0 +1,155 @@
+"""Variable updates: cached IDs, skipped unchanged values, throttled progress and folder filing"""
+
+import sys
+import time
+
+import pytest
+
+from support import StandInDevice
+
+
+class Variable(object):
+
+    def __init__(self, varId, name, value, folderId):
+        self.id = varId
+        self.name = name
+        self.value = value
+        self.folderId = folderId
+
+
+class Folder(object):
+
+    def __init__(self, folderId):
+        self.id = folderId
+
+
+class Folders(dict):
+    """Stands in for indigo.variables.folders and indigo.variables.folder"""
+
+    def create(self, name):
+        folder = self[name] = Folder(100 + len(self))
+        return folder
+
+
+class Variables(object):
+    """Stands in for indigo.variables and indigo.variable"""
+
+    def __init__(self):
+        self.byName = {}
+        self.byId = {}
+        self.folders = self.folder = Folders()
+        self.calls = []    # (call, variable name)
+
+    def add(self, name, value='', folderId=0):
+        var = Variable(len(self.byId) + 1, name, value, folderId)
+        self.byName[name] = self.byId[var.id] = var
+        return var
+
+    # indigo.variables
+    def __contains__(self, name):
+        self.calls.append(('lookup', name))
+        return name in self.byName
+
+    def __getitem__(self, name):
+        return self.byName[name]
+
+    # indigo.variable
+    def create(self, name, value='', folder=0):
+        self.calls.append(('create', name))
+        return self.add(name, value, folder)
+
+    def updateValue(self, varId, value=''):
+        self.calls.append(('update', self.byId[varId].name))
+        self.byId[varId].value = value
+
+    def moveToFolder(self, var, value=0):
+        self.calls.append(('move', var.name))
+        var.folderId = value
+
+
+@pytest.fixture
+def variables(monkeypatch):
+    variables = Variables()
+    indigo = sys.modules['indigo']
+    monkeypatch.setattr(indigo, 'variables', variables, raising=False)
+    monkeypatch.setattr(indigo, 'variable', variables, raising=False)
+    return variables
+
+
+def startDevice(plugin, **props):
+    dev = StandInDevice(1, dict({'updateVariables': True, 'variablePrefix': 'Test'}, **props))
+    plugin.deviceStartComm(dev)
+    return dev
+
+
+def updateVariables(plugin, dev, **states):
+    stateList = [{'key': key, 'value': value} for key, value in states.items()]
+    if 'Spotify' in type(plugin).__module__:
+        plugin.updateVariables(dev, {}, stateList)
+    else:
+        plugin.updateVariables(dev, stateList)
+
+
+def test_unchanged_values_are_not_written(plugin, variables):
+    dev = startDevice(plugin)
+    updateVariables(plugin, dev, trackName='Song', soundVolume=40)
+    updateVariables(plugin, dev, trackName='Song', soundVolume=55)
+    assert variables.byName['TestTrackName'].value == 'Song'
+    assert variables.byName['TestSoundVolume'].value == '55'
+    writes = [call for call in variables.calls if call[0] != 'lookup']
+    assert writes == [('create', 'TestTrackName'), ('create', 'TestSoundVolume'), ('update', 'TestSoundVolume')]
+
+
+def test_variable_ids_are_looked_up_once(plugin, variables):
+    variables.add('TestTrackName', 'Before')
+    dev = startDevice(plugin)
+    for name in ('One', 'Two', 'Three'):
+        updateVariables(plugin, dev, trackName=name)
+    assert variables.byName['TestTrackName'].value == 'Three'
+    assert variables.calls.count(('lookup', 'TestTrackName')) == 1
+
+
+def test_position_is_written_at_most_once_per_interval(plugin, variables, player, monkeypatch):
+    dev = startDevice(plugin)
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    for position in range(4):
+        now[0] += 1
+        updateVariables(plugin, dev, progressPercent=position, trackName='Song {}'.format(position))
+    assert variables.byName['TestProgressPercent'].value == '0'
+    assert variables.byName['TestTrackName'].value == 'Song 3'
+
+    now[0] += player.kHighChurnVariableInterval
+    updateVariables(plugin, dev, progressPercent=9)
+    assert variables.byName['TestProgressPercent'].value == '9'
+
+
+def test_deleted_variable_is_created_again(plugin, variables):
+    dev = startDevice(plugin)
+    updateVariables(plugin, dev, trackName='One')
+    del variables.byId[variables.byName.pop('TestTrackName').id]
+    updateVariables(plugin, dev, trackName='Two')
+    assert any('TestTrackName' in message for message in plugin.errorMessages)
+    updateVariables(plugin, dev, trackName='Three')
+    assert variables.byName['TestTrackName'].value == 'Three'
+
+
+def test_existing_variables_move_into_the_folder(plugin, variables):
+    variables.add('TestTrackName', 'Before', folderId=0)
+    dev = startDevice(plugin, variableFolder=True)
+    updateVariables(plugin, dev, trackName='Song', artist='Band')
+    folderId = variables.folders['Test'].id
+    assert variables.byName['TestTrackName'].folderId == folderId
+    assert variables.byName['TestArtist'].folderId == folderId
+    assert variables.calls.count(('move', 'TestTrackName')) == 1
+
+    updateVariables(plugin, dev, trackName='Next')
+    assert variables.calls.count(('move', 'TestTrackName')) == 1
+
+
+def test_variables_stay_put_without_the_folder_option(plugin, variables):
+    variables.add('TestTrackName', 'Before', folderId=7)
+    dev = startDevice(plugin)
+    updateVariables(plugin, dev, trackName='Song')
+    assert variables.byName['TestTrackName'].folderId == 7
+    assert ('move', 'TestTrackName') not in variables.calls
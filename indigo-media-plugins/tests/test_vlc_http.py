@@ -0,0 +1,275 @@
+"""VLCHttpClient against a local stand-in for VLC's web interface"""
+
+import base64
+import json
+import socket
+import sys
+import threading
+import time
+import types
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from support import StandInDevice, loadPlugin
+
+kPassword = 'secret'
+
+
+class StandInVLC(object):
+    """Just enough of VLC's status.json and playlist.json to drive the client"""
+
+    def __init__(self):
+        self.status = {'state': 'paused', 'time': 12, 'length': 200, 'position': 0.0625, 'volume': 256,
+                       'fullscreen': False, 'loop': False, 'random': False, 'currentplid': 4}
+        self.connections = 0
+        self.requests = []
+        self.dropReply = False    # run the next command, then close without replying
+        self.closeAfter = False   # close the connection after the next reply
+        self.failWith = None      # HTTP status every request fails with
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.port = self.server.server_address[1]
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+
+    def commands(self):
+        return [params['command'] for path, params in self.requests if 'command' in params]
+
+    def run(self, params):
+        status = self.status
+        command = params.get('command')
+        if command == 'pl_pause':
+            status['state'] = 'paused' if status['state'] == 'playing' else 'playing'
+        elif command == 'pl_play':
+            status['state'] = 'playing'
+        elif command == 'volume':
+            status['volume'] = int(params['val'])
+        elif command == 'seek':
+            value = params['val']
+            status['time'] = status['time'] + int(value) if value[0] in '+-' else int(value)
+            status['position'] = status['time'] / status['length']
+        elif command == 'fullscreen':
+            status['fullscreen'] = not status['fullscreen']
+
+    def handler(self):
+        vlc = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                vlc.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body=b''):
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                credentials = base64.b64encode((':' + kPassword).encode('utf-8')).decode('ascii')
+                if self.headers.get('Authorization') != 'Basic ' + credentials:
+                    self.reply(401)
+                    return
+                if vlc.failWith:
+                    self.reply(vlc.failWith)
+                    return
+                url = urllib.parse.urlparse(self.path)
+                params = dict(urllib.parse.parse_qsl(url.query))
+                vlc.requests.append((url.path, params))
+                vlc.run(params)
+                if vlc.dropReply and 'command' in params:
+                    vlc.dropReply = False
+                    self.close_connection = True
+                    self.connection.shutdown(socket.SHUT_RDWR)
+                    return
+                if url.path == '/requests/playlist.json':
+                    items = [{'id': str(i), 'type': 'leaf', 'uri': 'file:///Movies/My%20Film%20{}.mkv'.format(i)}
+                             for i in range(3, 8)]
+                    body = {'id': '1', 'children': [{'id': '2', 'name': 'Playlist', 'children': items}]}
+                else:
+                    filename = 'My Film {}.mkv'.format(vlc.status['currentplid'])
+                    body = dict(vlc.status, information={'category': {'meta': {'filename': filename}}})
+                self.reply(200, json.dumps(body).encode('utf-8'))
+                if vlc.closeAfter:
+                    vlc.closeAfter = False
+                    self.close_connection = True
+
+        return Handler
+
+
+@pytest.fixture
+def vlc():
+    return loadPlugin('VLC')
+
+
+@pytest.fixture
+def server():
+    server = StandInVLC()
+    yield server
+    server.server.shutdown()
+    server.server.server_close()
+
+
+@pytest.fixture
+def client(vlc, server):
+    client = vlc.VLCHttpClient('127.0.0.1', server.port, kPassword)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def plugin(vlc, server, monkeypatch):
+    """A VLC plugin whose server log is recorded"""
+    logged = []
+    monkeypatch.setattr(sys.modules['indigo'], 'server', types.SimpleNamespace(log=logged.append), raising=False)
+    plugin = vlc.Plugin('test', 'Test', '1.0', {})
+    plugin.serverLog = logged
+    yield plugin
+    for devInfo in plugin.deviceDict.values():
+        if devInfo['http']:
+            devInfo['http'].close()
+    plugin.pollPool.shutdown()
+
+
+def startHttpDevice(plugin, server):
+    dev = StandInDevice(1, {'statusBackend': 'http', 'httpPort': str(server.port), 'httpPassword': kPassword})
+    plugin.deviceStartComm(dev)
+    return dev
+
+
+def test_status_is_mapped_to_a_status_record(client, server):
+    server.status['volume'] = 0
+    status = client.status()
+    assert status['playing'] is False
+    assert status['currentTime'] == 12.5   # from position, finer than time
+    assert status['duration'] == 200
+    assert status['mediaName'] == 'My Film 4.mkv'
+    assert status['mediaPath'] == '/Movies/My Film 4.mkv'
+    assert status['muted'] and status['audioVolume'] == 0
+
+
+def test_one_connection_serves_every_request(client, server):
+    for i in range(5):
+        client.status()
+    assert server.connections == 1
+    # The playlist is only fetched when the current item changes
+    assert [path for path, params in server.requests].count('/requests/playlist.json') == 1
+
+
+def test_rejected_password_is_reported(vlc, server):
+    client = vlc.VLCHttpClient('127.0.0.1', server.port, 'wrong')
+    try:
+        assert 'password' in client.status()['errorMsg']
+    finally:
+        client.close()
+
+
+def test_closed_port_means_vlc_is_not_running(vlc):
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    client = vlc.VLCHttpClient('127.0.0.1', port, kPassword)
+    assert client.status().get('notRunning')
+
+
+def test_command_whose_reply_was_lost_is_not_sent_again(client, server):
+    client.status()
+    server.dropReply = True
+    status = client.perform('playPause', [])
+    assert server.commands() == ['pl_pause']
+    assert status['playing'] and server.connections == 2
+
+
+def test_connection_closed_while_idle_is_replaced_before_a_command(client, server):
+    client.status()
+    server.closeAfter = True
+    client.status()
+    time.sleep(0.1)
+    status = client.perform('playPause', [])
+    assert server.commands() == ['pl_pause']
+    assert status['playing'] and server.connections == 2
+
+
+def test_polls_and_actions_share_the_client(client, server):
+    server.failWith = 500
+    results = []
+
+    def request(count):
+        for i in range(count):
+            results.append(client.status())
+
+    threads = [threading.Thread(target=request, args=(20,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Every failure is counted, and only one starts the run
+    assert client.failures == 80
+    assert sum(result['firstFailure'] for result in results) == 1
+
+    server.failWith = None
+    server.status['currentplid'] = 6
+    threads = [threading.Thread(target=request, args=(5,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.mediaPath == '/Movies/My Film 6.mkv' and client.playlistId == 6
+    assert [path for path, params in server.requests].count('/requests/playlist.json') == 1
+
+
+def test_explicit_toggles_only_toggle_when_needed(client, server):
+    client.perform('setFullscreen', ['true'])
+    client.perform('setFullscreen', ['true'])
+    client.perform('setFullscreen', ['toggle'])
+    assert server.commands() == ['fullscreen', 'fullscreen']
+    assert not server.status['fullscreen']
+
+
+def test_mute_remembers_the_volume(client, server):
+    assert client.perform('mute', [])['muted']
+    status = client.perform('mute', [])
+    assert status['audioVolume'] == 256 and not status['muted']
+
+
+def test_steps_seek_by_the_step_size(vlc, client, server):
+    long = vlc.kStepSizes['long']
+    assert client.commandParams('stepForward', ['2', str(long)]) == [{'command': 'seek', 'val': '+600'}]
+    client.perform('stepBackward', [1, vlc.kStepSizes['extrashort']])
+    assert server.status['time'] == 9
+
+
+def test_http_devices_show_their_own_connection_state(plugin, server):
+    # The circuit breaker only guards script calls
+    plugin.breaker.state = 'suspended'
+    dev = startHttpDevice(plugin, server)
+    assert dev.states['connectionState'] == 'ok'
+
+    server.failWith = 500
+    plugin.pollDevice(dev)
+    assert dev.states['connectionState'] == 'suspended'
+    server.failWith = None
+    plugin.pollDevice(dev)
+    assert dev.states['connectionState'] == 'ok'
+
+
+def test_a_run_of_poll_failures_is_logged_once(plugin, server):
+    dev = startHttpDevice(plugin, server)
+    server.failWith = 500
+    for i in range(4):
+        plugin.pollDevice(dev)
+    assert len(plugin.errorMessages) == 1 and 'HTTP 500' in plugin.errorMessages[0]
+    assert sum('HTTP 500' in message for message in plugin.debugMessages) == 3
+
+    server.failWith = None
+    plugin.pollDevice(dev)
+    assert plugin.serverLog == ['VLC web interface for Device 1 is responding again']
+    server.failWith = 500
+    plugin.pollDevice(dev)
+    assert len(plugin.errorMessages) == 2